@@ -0,0 +1,124 @@
+"""
+Three-way merge of the attributes of conflicting features, so that only the
+true conflicts are left for the user to solve
+"""
+
+OURS = "ours"
+THEIRS = "theirs"
+
+GEOMETRY = "geometry"
+
+
+class AutoMergeRules:
+    """
+    Rules deciding the values changed differently in both versions of a
+    feature, which a three-way merge can't decide by itself.
+
+    geometry is the version ("ours" or "theirs") whose geometry is kept
+    when both changed it. timestampField names an attribute telling when
+    each version was edited; the newest version wins for all the values
+    changed in both. Values not decided by any rule leave the conflict
+    unsolved.
+    """
+
+    def __init__(self, geometry=None, timestampField=None):
+        self.geometry = geometry
+        self.timestampField = timestampField
+
+    def winner(self, name, ours, theirs):
+        """
+        Returns the version whose value of an attribute (or the geometry)
+        is kept when both versions changed it, or None
+        """
+        if name == GEOMETRY and self.geometry in (OURS, THEIRS):
+            return self.geometry
+        if self.timestampField:
+            oursTime = ours["properties"].get(self.timestampField)
+            theirsTime = theirs["properties"].get(self.timestampField)
+            if oursTime is None or theirsTime is None or oursTime == theirsTime:
+                return None
+            try:
+                return OURS if oursTime > theirsTime else THEIRS
+            except TypeError:
+                # values that can't be compared
+                return None
+        return None
+
+
+def _values(feature):
+    values = dict(feature["properties"])
+    values[GEOMETRY] = feature.get("geometry")
+    return values
+
+
+def mergeFeature(conflict, rules=None):
+    """
+    Merges the ours and theirs versions of a conflicting feature, taking
+    for each attribute the version that changed it from the ancestor.
+
+    Returns "ours" or "theirs" if the merge is one of them, the merged
+    feature otherwise, or None if it is a true conflict: a value changed
+    differently in both versions and not decided by the rules, a feature
+    deleted in one of them, or versions with different attributes.
+    """
+    ancestor, ours, theirs = conflict["ancestor"], conflict[OURS], conflict[THEIRS]
+    if ours is None or theirs is None:
+        return None
+    if ours["properties"].keys() != theirs["properties"].keys():
+        return None
+    # with no ancestor, the feature was added in both versions
+    ancestorValues = _values(ancestor) if ancestor is not None else {}
+    oursValues = _values(ours)
+    theirsValues = _values(theirs)
+    merged = {}
+    fromOurs = fromTheirs = True
+    for name, oursValue in oursValues.items():
+        theirsValue = theirsValues[name]
+        if oursValue == theirsValue:
+            merged[name] = oursValue
+            continue
+        ancestorValue = ancestorValues.get(name)
+        if name in ancestorValues and oursValue == ancestorValue:
+            version = THEIRS
+        elif name in ancestorValues and theirsValue == ancestorValue:
+            version = OURS
+        else:
+            version = rules.winner(name, ours, theirs) if rules is not None else None
+            if version is None:
+                return None
+        if version == OURS:
+            merged[name] = oursValue
+            fromTheirs = False
+        else:
+            merged[name] = theirsValue
+            fromOurs = False
+    if fromOurs:
+        return OURS
+    if fromTheirs:
+        return THEIRS
+    geometry = merged.pop(GEOMETRY)
+    return {"type": "Feature", "geometry": geometry, "properties": merged}
+
+
+def autoMerge(conflicts, rules=None):
+    """
+    Solves all the conflicts that can be merged, given as returned by
+    Repository.conflicts().
+
+    Returns the resolutions for Repository.resolveConflicts, keyed by
+    conflict label, and the conflicts left, in the same form as the ones
+    given.
+    """
+    resolved = {}
+    remaining = {}
+    for dataset, features in conflicts.items():
+        for fid, conflict in features.items():
+            label = f"{dataset}:feature:{fid}"
+            merged = mergeFeature(conflict, rules)
+            if merged is None:
+                remaining.setdefault(dataset, {})[fid] = conflict
+                continue
+            if isinstance(merged, dict):
+                merged["id"] = label
+            resolved[label] = merged
+    return resolved, remaining
@@ -0,0 +1,126 @@
+from qgis.core import QgsProject
+from qgis.PyQt.QtCore import QTimer
+
+from kart import logging
+from kart.kartapi import KartException, deferredDuringKartCalls
+
+
+class CanvasRefreshScheduler:
+    """
+    Collects the refresh requests made after repository operations and
+    refreshes the affected layers once, after a short delay. Operations run
+    back to back (e.g. resolving conflicts and continuing the merge) cause
+    a single refresh, limited to the layers of the datasets they changed.
+
+    When the changed features of a dataset are known, its GeoPackage layers
+    only have their provider data invalidated and are redrawn. Otherwise the
+    layers are reloaded.
+    """
+
+    __instance = None
+
+    DELAY_MS = 100
+
+    @staticmethod
+    def instance():
+        if CanvasRefreshScheduler.__instance is None:
+            CanvasRefreshScheduler.__instance = CanvasRefreshScheduler()
+        return CanvasRefreshScheduler.__instance
+
+    def __init__(self):
+        # repo path -> (repo, changes), where changes is None to reload all the
+        # layers of the repo, or maps each changed dataset to its changed
+        # features as (primary key name, {primary key: change type}), or to
+        # None to reload its layers
+        self.pending = {}
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(self.DELAY_MS)
+        self.timer.timeout.connect(deferredDuringKartCalls(self.refresh))
+
+    def schedule(self, repo, datasets=None, features=None):
+        """
+        Schedules a refresh of the layers of a repo. datasets limits it to
+        the layers of the given datasets, and features to the given features
+        of some of them.
+        """
+        if datasets is not None and not datasets and repo.path not in self.pending:
+            return
+        _, changes = self.pending.get(repo.path, (repo, {}))
+        if datasets is None or changes is None:
+            changes = None
+        else:
+            features = features or {}
+            for name in datasets:
+                newChanges = features.get(name)
+                if name in changes and (changes[name] is None or newChanges is None):
+                    changes[name] = None
+                elif name in changes:
+                    _mergeFeatureChanges(changes[name][1], newChanges[1])
+                elif newChanges is not None:
+                    changes[name] = (newChanges[0], dict(newChanges[1]))
+                else:
+                    changes[name] = None
+        self.pending[repo.path] = (repo, changes)
+        self.timer.start()
+
+    def refresh(self):
+        """
+        Refreshes the layers of the pending requests right away
+        """
+        self.timer.stop()
+        pending = self.pending
+        self.pending = {}
+        if not pending:
+            return
+        for layer in QgsProject.instance().mapLayers().values():
+            for repo, changes in pending.values():
+                try:
+                    if not repo.layerBelongsToRepo(layer):
+                        continue
+                    if changes is None:
+                        self.reloadLayer(layer)
+                        break
+                    dataset = repo.datasetNameFromLayer(layer)
+                    if dataset not in changes:
+                        break
+                    if changes[dataset] is None:
+                        self.reloadLayer(layer)
+                    else:
+                        self.updateFeatures(layer, *changes[dataset])
+                except KartException as e:
+                    logging.error(f"Layer {layer.name()} could not be refreshed: {e}")
+                break
+
+    def reloadLayer(self, layer):
+        if layer.isEditable():
+            # reloading would drop the edits in progress
+            layer.triggerRepaint()
+        else:
+            layer.reload()
+            layer.triggerRepaint()
+
+    def updateFeatures(self, layer, pkName, changes):
+        """
+        Updates a layer after some of the features of its dataset were changed
+        outside of QGIS, given their primary keys and change types. The
+        provider drops what it cached about the data (such as the feature
+        count and the extent), and the layer redraws its features, without
+        reloading its fields and style as reloadLayer does. The layer emits
+        its own signals; the edit buffer signals are not faked from outside.
+        """
+        if not changes:
+            return
+        if layer.isEditable() or layer.providerType() != "ogr":
+            self.reloadLayer(layer)
+            return
+        layer.dataProvider().reloadData()
+        layer.updateExtents(True)
+        layer.triggerRepaint()
+
+
+def _mergeFeatureChanges(changes, newChanges):
+    for pk, changeType in newChanges.items():
+        # a feature added and then modified is still new to the layer
+        if not (changes.get(pk) == "I" and changeType == "U"):
+            changes[pk] = changeType
@@ -0,0 +1,114 @@
+"""
+Lane layout of the commit graph drawn next to the log
+"""
+
+# expected in the lane of a linear graph, matching whatever commit comes next
+_NEXT = object()
+
+
+class CommitGraph:
+    """
+    Assigns the commits of a log to columns (lanes) and computes the edges
+    drawn in the row of each commit, from the parents of the commits.
+
+    Commits have to be added in the order they are shown, children before
+    their parents and otherwise newest first (as given by `log --date-order`,
+    which both the commit cache and Kart are read with). The layout is incremental: the only state
+    kept between commits is the commit expected in each lane and the edges
+    leaving the last row, so the graph can be extended a page at a time.
+
+    Edges are pairs of x coordinates in half columns, so that a lane moving
+    from column a in a row to column b in the next one crosses the boundary
+    between the rows at a + b:
+    - "up" edges go from the top of the row to its middle
+    - "down" edges go from the middle of the row to its bottom
+
+    In linear mode parents are ignored and each commit is linked to the next
+    one. That is used for logs filtered by dataset, where the parents of a
+    commit are often not in the log.
+    """
+
+    def __init__(self, linear=False):
+        self.linear = linear
+        self._lanes = []
+        # (column, column in the next row) of the lanes leaving the last row
+        self._edges = []
+
+    def add(self, commitid, parents):
+        """
+        Adds the next commit of the log, and returns its column and the
+        edges in its row
+        """
+        lanes = self._lanes
+        if self.linear:
+            lanes = [commitid if lane is _NEXT else lane for lane in lanes]
+            parents = [_NEXT] if parents else []
+        if commitid in lanes:
+            column = lanes.index(commitid)
+        else:
+            # a branch tip opens a new lane
+            column = len(lanes)
+            lanes = lanes + [commitid]
+        up = [(a + b, 2 * (column if lanes[b] == commitid else b)) for a, b in self._edges]
+
+        # parents already expected by another lane join it, instead of opening a new one
+        existing = {}
+        for i, lane in enumerate(lanes):
+            if lane != commitid and lane not in existing:
+                existing[lane] = i
+        joined = {existing[p] for p in parents if p in existing}
+        newParents = []
+        for parent in parents:
+            if parent not in existing and parent not in newParents:
+                newParents.append(parent)
+
+        nextLanes = []
+        edges = []
+        for i, lane in enumerate(lanes):
+            if i == column:
+                for parent in newParents:
+                    edges.append((column, len(nextLanes)))
+                    nextLanes.append(parent)
+            elif lane != commitid:
+                edges.append((i, len(nextLanes)))
+                if i in joined:
+                    edges.append((column, len(nextLanes)))
+                nextLanes.append(lane)
+            # other lanes expecting this commit end in it
+
+        self._lanes = nextLanes
+        self._edges = edges
+        down = [(2 * a, a + b) for a, b in edges]
+        return column, {"up": up, "down": down}
+
+    def end(self):
+        """
+        Drops the lanes still open, so the last row added is taken as the
+        end of the log. The down edges already returned are not changed.
+        """
+        self._lanes = []
+        self._edges = []
+
+    def layout(self, commits, last=False):
+        """
+        Adds a list of commits from the JSON log, setting their
+        "commitColumn" and "graph" entries. last tells that the log ends
+        with these commits.
+        """
+        for i, commit in enumerate(commits):
+            parents = commit["parents"]
+            if last and self.linear and i == len(commits) - 1:
+                parents = []
+            commit["commitColumn"], commit["graph"] = self.add(commit["commit"], parents)
+        if last:
+            self.end()
+        return commits
+
+
+def graphColumns(commit):
+    """
+    Returns the number of columns used by the graph in the row of a commit
+    """
+    edges = commit["graph"]["up"] + commit["graph"]["down"]
+    xs = [x for edge in edges for x in edge]
+    return max([commit["commitColumn"]] + [(x + 1) // 2 for x in xs]) + 1
@@ -1,11 +1,13 @@
-from typing import List, Optional
+import os
+from typing import Dict, List, Optional, Tuple
 
-from qgis.core import QgsMapLayer
+from qgis.core import QgsDataSourceUri, QgsMapLayer
 from qgis.PyQt.QtCore import QObject, pyqtSignal
 
 from kart.utils import setSetting, setting
 
-from ..kartapi import KartException, Repository
+from ..kartapi import CONFIG_CACHE, KartException, Repository
+from .repo_watcher import RepoWatcher
 
 
 class RepoManager(QObject):
@@ -17,6 +19,8 @@ class RepoManager(QObject):
 
     repo_added = pyqtSignal(Repository)
     repo_removed = pyqtSignal(Repository)
+    # emitted when the files of a repo change, with the list of expired cache scopes
+    repo_changed = pyqtSignal(Repository, list)
 
     @classmethod
     def instance(cls) -> "RepoManager":
@@ -32,6 +36,16 @@ class RepoManager(QObject):
         super().__init__()
 
         self._repos: List[Repository] = []
+        self._watchers: Dict[str, RepoWatcher] = {}
+        # repo folder -> repo, for layers in file working copies
+        self._repos_by_folder: Dict[str, Repository] = {}
+        # (database, schema) -> repo, for layers in PostGIS working copies.
+        # Built on first use, as it needs the config of every repo
+        self._repos_by_schema: Optional[Dict[Tuple[str, str], Repository]] = None
+
+        self.repo_added.connect(self._index_repo)
+        self.repo_removed.connect(self._unindex_repo)
+        self.repo_changed.connect(self._repo_changed)
 
         self.read_repos_from_settings()
 
@@ -49,6 +63,7 @@ class RepoManager(QObject):
                 repo = Repository(path)
                 if repo.isInitialized():
                     self._repos.append(repo)
+                    self._watch_repo(repo)
                     self.repo_added.emit(repo)
 
     def save_repos_to_settings(self):
@@ -64,6 +79,7 @@ class RepoManager(QObject):
         """
         self._repos.append(repo)
         self.save_repos_to_settings()
+        self._watch_repo(repo)
         self.repo_added.emit(repo)
 
     def remove_repo(self, repo: Repository):
@@ -75,8 +91,53 @@ class RepoManager(QObject):
                 self._repos.remove(r)
                 break
         self.save_repos_to_settings()
+        watcher = self._watchers.pop(repo.path, None)
+        if watcher is not None:
+            watcher.stop()
+            watcher.deleteLater()
         self.repo_removed.emit(repo)
 
+    def _watch_repo(self, repo: Repository):
+        """
+        Starts watching the files of a repo, so its cached state is expired
+        when it is changed (either by the plugin or by external tools)
+        """
+        if repo.path in self._watchers or not repo.isInitialized():
+            return
+        watcher = RepoWatcher(repo, self)
+        watcher.changed.connect(lambda scopes: self.repo_changed.emit(repo, scopes))
+        self._watchers[repo.path] = watcher
+
+    @staticmethod
+    def _folder_key(path: str) -> str:
+        return os.path.normcase(os.path.normpath(os.path.abspath(path)))
+
+    def _index_repo(self, repo: Repository):
+        self._repos_by_folder[self._folder_key(repo.path)] = repo
+        self._repos_by_schema = None
+
+    def _unindex_repo(self, repo: Repository):
+        self._repos_by_folder.pop(self._folder_key(repo.path), None)
+        self._repos_by_schema = None
+
+    def _repo_changed(self, repo: Repository, scopes: List[str]):
+        # the working copy location is part of the config
+        if CONFIG_CACHE in scopes:
+            self._repos_by_schema = None
+
+    def _schema_index(self) -> Dict[Tuple[str, str], Repository]:
+        if self._repos_by_schema is None:
+            index = {}
+            for repo in self._repos:
+                try:
+                    key = repo.workingCopyDatabaseAndSchema()
+                except KartException:
+                    continue
+                if key is not None:
+                    index.setdefault(key, repo)
+            self._repos_by_schema = index
+        return self._repos_by_schema
+
     def repos(self) -> List[Repository]:
         """
         Returns the list of known repositories
@@ -87,11 +148,17 @@ class RepoManager(QObject):
         """
         Returns the repo matching a layer, or None if not found
         """
-        try:
-            for repo in self._repos:
-                if repo.layerBelongsToRepo(layer):
-                    return repo
-        except KartException:
-            pass
-
-        return None
+        if layer.providerType() == "postgres":
+            uri = QgsDataSourceUri(layer.source())
+            return self._schema_index().get((uri.database(), uri.schema()))
+
+        # file layers belong to the repo of the closest folder containing them
+        path = self._folder_key(layer.source().split("|")[0])
+        while True:
+            parent = os.path.dirname(path)
+            if parent == path:
+                return None
+            path = parent
+            repo = self._repos_by_folder.get(path)
+            if repo is not None:
+                return repo
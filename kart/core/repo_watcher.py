@@ -0,0 +1,149 @@
+import configparser
+import os
+from typing import Dict, List, Optional, Tuple
+
+from qgis.PyQt.QtCore import QFileSystemWatcher, QObject, QTimer, pyqtSignal
+
+from ..kartapi import (
+    BRANCHES_CACHE,
+    CONFIG_CACHE,
+    LOG_CACHE,
+    STATUS_CACHE,
+    Repository,
+    deferredDuringKartCalls,
+)
+
+REFS_SCOPES = [BRANCHES_CACHE, LOG_CACHE]
+
+
+class RepoWatcher(QObject):
+    """
+    Watches the files a repository keeps its state in, and expires the
+    matching caches of the repository when they change
+    """
+
+    # emitted with the list of cache scopes that were expired
+    changed = pyqtSignal(list)
+
+    # Kart (like git) rewrites files through lock files and renames, so a
+    # single command triggers a burst of events
+    DEBOUNCE_MS = 200
+
+    def __init__(self, repo: Repository, parent: Optional[QObject] = None):
+        super().__init__(parent)
+        self.repo = repo
+        self._watcher = QFileSystemWatcher(self)
+        self._watcher.fileChanged.connect(self._scheduleCheck)
+        self._watcher.directoryChanged.connect(self._scheduleCheck)
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(self.DEBOUNCE_MS)
+        self._timer.timeout.connect(deferredDuringKartCalls(self.check))
+        # False when the working copy is in a database server, whose edits
+        # can't be noticed, so the status must not be cached
+        self.watchesWorkingCopy = True
+        self._tracked = self._trackedPaths()
+        self._mtimes = self._readMtimes()
+        self._updateWatchedPaths()
+        repo.watcher = self
+
+    def stop(self):
+        """
+        Stops watching, and drops the caches that can no longer be expired
+        """
+        self._timer.stop()
+        paths = self._watcher.files() + self._watcher.directories()
+        if paths:
+            self._watcher.removePaths(paths)
+        if self.repo.watcher is self:
+            self.repo.watcher = None
+            self.repo.invalidateCaches()
+
+    def _workingCopyLocation(self) -> str:
+        """
+        Returns the working copy location, read directly from the repo config
+        to avoid running Kart, or an empty string if there is none
+        """
+        parser = configparser.ConfigParser(strict=False, interpolation=None)
+        try:
+            with open(os.path.join(self.repo.path, ".kart", "config")) as f:
+                # git config indents keys, which configparser reads as continuation lines
+                parser.read_string("\n".join(line.strip() for line in f))
+        except (OSError, configparser.Error):
+            return ""
+        return parser.get('kart "workingcopy"', "location", fallback="").strip('"')
+
+    def _trackedPaths(self) -> Dict[str, List[str]]:
+        """
+        Returns the files and folders to watch, and the cache scopes that
+        expire when each of them changes
+        """
+        kartFolder = os.path.join(self.repo.path, ".kart")
+        tracked = {
+            os.path.join(kartFolder, "HEAD"): [BRANCHES_CACHE, LOG_CACHE, STATUS_CACHE],
+            os.path.join(kartFolder, "config"): [CONFIG_CACHE, STATUS_CACHE],
+            os.path.join(kartFolder, "index"): [STATUS_CACHE],
+            os.path.join(kartFolder, "packed-refs"): REFS_SCOPES,
+            os.path.join(kartFolder, "MERGE_HEAD"): [BRANCHES_CACHE, LOG_CACHE, STATUS_CACHE],
+        }
+        # ref files are replaced through renames, which change the mtime of their folder
+        for folder, _, _ in os.walk(os.path.join(kartFolder, "refs")):
+            tracked[folder] = REFS_SCOPES
+        location = self._workingCopyLocation()
+        self.watchesWorkingCopy = "://" not in location
+        if location and self.watchesWorkingCopy:
+            workingCopy = os.path.join(self.repo.path, location)
+            tracked[workingCopy] = [STATUS_CACHE]
+            tracked[f"{workingCopy}-wal"] = [STATUS_CACHE]
+        return tracked
+
+    def _readMtimes(self) -> Dict[str, Optional[Tuple[int, int]]]:
+        mtimes = {}
+        for path in self._tracked:
+            try:
+                stat = os.stat(path)
+                mtimes[path] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                mtimes[path] = None
+        return mtimes
+
+    def _updateWatchedPaths(self):
+        """
+        Watches the tracked paths that exist, plus the folders containing
+        them so files that are created or replaced are noticed
+        """
+        wanted = set()
+        for path in self._tracked:
+            if os.path.exists(path):
+                wanted.add(path)
+            wanted.add(os.path.dirname(path))
+        wanted = {p for p in wanted if os.path.exists(p)}
+        # a replaced file is silently dropped by the watcher, so it has to be added again
+        watched = set(self._watcher.files() + self._watcher.directories())
+        stale = watched - wanted
+        if stale:
+            self._watcher.removePaths(list(stale))
+        missing = wanted - set(self._watcher.files() + self._watcher.directories())
+        if missing:
+            self._watcher.addPaths(list(missing))
+
+    def _scheduleCheck(self, path: str):
+        self._timer.start()
+
+    def check(self) -> List[str]:
+        """
+        Compares the tracked paths with their last known state and expires
+        the caches affected by the ones that changed
+        """
+        self._tracked = self._trackedPaths()
+        mtimes = self._readMtimes()
+        scopes = []
+        for path, scopesForPath in self._tracked.items():
+            if mtimes[path] != self._mtimes.get(path):
+                scopes.extend(s for s in scopesForPath if s not in scopes)
+        self._mtimes = mtimes
+        self._updateWatchedPaths()
+        if scopes:
+            self.repo.invalidateCaches(scopes)
+            self.changed.emit(scopes)
+        return scopes
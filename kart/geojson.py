@@ -0,0 +1,143 @@
+"""
+Conversion of the GeoJSON geometries of Kart diffs to QGIS geometries
+"""
+
+import struct
+from collections import OrderedDict
+
+from qgis.core import (
+    QgsGeometry,
+    QgsGeometryCollection,
+    QgsLineString,
+    QgsMultiLineString,
+    QgsMultiPoint,
+    QgsMultiPolygon,
+    QgsPoint,
+    QgsPolygon,
+)
+
+# GeoJSON style names of the WKB geometry types, by type code
+_WKB_TYPE_NAMES = {
+    1: "Point",
+    2: "LineString",
+    3: "Polygon",
+    4: "MultiPoint",
+    5: "MultiLineString",
+    6: "MultiPolygon",
+    7: "GeometryCollection",
+    8: "CircularString",
+    9: "CompoundCurve",
+    10: "CurvePolygon",
+    11: "MultiCurve",
+    12: "MultiSurface",
+    15: "PolyhedralSurface",
+    16: "TIN",
+    17: "Triangle",
+}
+
+
+def wkbGeometry(wkb):
+    """
+    Returns a geometry dict for a WKB geometry, in place of its GeoJSON
+    one: its type named as in GeoJSON, and the WKB instead of coordinates,
+    which geometryFromGeojson passes on to QGIS as it is
+    """
+    byteOrder = "<" if wkb[0] == 1 else ">"
+    (wkbType,) = struct.unpack_from(byteOrder + "I", wkb, 1)
+    # ISO (thousands) and extended (high bits) Z/M/SRID flags both dropped
+    name = _WKB_TYPE_NAMES.get((wkbType & 0x0FFFFFFF) % 1000, "Unknown")
+    return {"type": name, "wkb": wkb}
+
+
+def _point(position):
+    return QgsPoint(*position[:3])
+
+
+def _lineString(positions):
+    xs = [p[0] for p in positions]
+    ys = [p[1] for p in positions]
+    zs = [p[2] for p in positions] if positions and len(positions[0]) > 2 else []
+    return QgsLineString(xs, ys, zs)
+
+
+def _polygon(rings):
+    polygon = QgsPolygon()
+    if rings:
+        polygon.setExteriorRing(_lineString(rings[0]))
+        for ring in rings[1:]:
+            polygon.addInteriorRing(_lineString(ring))
+    return polygon
+
+
+def _collection(collection, parts, partFunction):
+    for part in parts:
+        collection.addGeometry(partFunction(part))
+    return collection
+
+
+def _abstractGeometry(geometry):
+    geomtype = geometry["type"]
+    if geomtype == "GeometryCollection":
+        return _collection(QgsGeometryCollection(), geometry["geometries"], _abstractGeometry)
+    coordinates = geometry["coordinates"]
+    if geomtype == "Point":
+        return _point(coordinates)
+    elif geomtype == "LineString":
+        return _lineString(coordinates)
+    elif geomtype == "Polygon":
+        return _polygon(coordinates)
+    elif geomtype == "MultiPoint":
+        return _collection(QgsMultiPoint(), coordinates, _point)
+    elif geomtype == "MultiLineString":
+        return _collection(QgsMultiLineString(), coordinates, _lineString)
+    elif geomtype == "MultiPolygon":
+        return _collection(QgsMultiPolygon(), coordinates, _polygon)
+    raise ValueError(f"Unsupported GeoJSON geometry type: {geomtype}")
+
+
+def geometryFromGeojson(geometry):
+    """
+    Returns the QgsGeometry for a GeoJSON geometry dict (or one returned by
+    wkbGeometry), or None for a null geometry. The geometry is built from
+    the coordinates directly, instead of writing the GeoJSON out and
+    parsing it again.
+    """
+    if not geometry:
+        return None
+    if "wkb" in geometry:
+        geom = QgsGeometry()
+        geom.fromWkb(geometry["wkb"])
+        return geom
+    return QgsGeometry(_abstractGeometry(geometry))
+
+
+class GeometryCache:
+    """
+    Bounded cache of the geometries decoded from GeoJSON, least recently
+    used first out. Keys identify a version of a feature, e.g.
+    (dataset, fid, change type) within a diff.
+    """
+
+    MAX_SIZE = 1000
+
+    def __init__(self, maxSize=None):
+        self.maxSize = maxSize or self.MAX_SIZE
+        self._geometries = OrderedDict()
+
+    def geometry(self, key, geometry):
+        """
+        Returns the QgsGeometry for a GeoJSON geometry dict, decoding it only
+        if it is not cached under key yet
+        """
+        if key in self._geometries:
+            self._geometries.move_to_end(key)
+        else:
+            self._geometries[key] = geometryFromGeojson(geometry)
+            if len(self._geometries) > self.maxSize:
+                self._geometries.popitem(last=False)
+        cached = self._geometries[key]
+        # a copy (implicitly shared, so cheap), as callers may transform it
+        return QgsGeometry(cached) if cached is not None else None
+
+    def clear(self):
+        self._geometries.clear()
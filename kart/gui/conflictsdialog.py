@@ -115,26 +115,53 @@ class ConflictsDialog(BASE, WIDGET):
             self.btnSolveFeature.setEnabled(False)
 
     def solveAllOurs(self):
-        ret = QMessageBox.warning(
-            self,
-            tr("Solve conflicts"),
-            tr("Are you sure you want to solve all conflicts using the 'ours' version?"),
-            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
-            QMessageBox.StandardButton.Yes,
-        )
-        if ret == QMessageBox.StandardButton.Yes:
-            pass
+        self._solveAllWithVersion("ours")
 
     def solveAllTheirs(self):
+        self._solveAllWithVersion("theirs")
+
+    def _solveAllWithVersion(self, version):
+        """
+        Solves all the conflicts left, or those of the selected dataset, by
+        keeping one version. They are all passed on to Kart together once
+        the dialog is closed.
+        """
+        selected = self.treeConflicts.selectedItems()
+        if selected and selected[0].parent() is None:
+            datasetItems = [selected[0]]
+            question = tr(
+                "Are you sure you want to solve all conflicts in dataset '{dataset}' "
+                "using the '{version}' version?"
+            ).format(dataset=selected[0].text(0), version=version)
+        else:
+            datasetItems = [
+                self.treeConflicts.topLevelItem(i)
+                for i in range(self.treeConflicts.topLevelItemCount())
+            ]
+            question = tr(
+                "Are you sure you want to solve all conflicts using the '{version}' version?"
+            ).format(version=version)
         ret = QMessageBox.warning(
             self,
             tr("Solve conflicts"),
-            tr("Are you sure you want to solve all conflicts using the 'theirs' version?"),
+            question,
             QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
             QMessageBox.StandardButton.Yes,
         )
-        if ret == QMessageBox.StandardButton.Yes:
-            pass
+        if ret != QMessageBox.StandardButton.Yes:
+            return
+        for datasetItem in datasetItems:
+            for item in datasetItem.takeChildren():
+                self.resolvedFeatures[f"{item.path}:feature:{item.fid}"] = version
+            self.treeConflicts.takeTopLevelItem(
+                self.treeConflicts.indexOfTopLevelItem(datasetItem)
+            )
+        self.lastSelectedItem = None
+        if not self.treeConflicts.topLevelItemCount():
+            self._allConflictsSolved()
+            return
+        self.treeConflicts.setCurrentItem(self.treeConflicts.topLevelItem(0))
+        self.updateFromCurrentSelectedItem()
 
     def solveFeature(self):
         conflict = self.lastSelectedItem.conflict
@@ -178,33 +205,34 @@ class ConflictsDialog(BASE, WIDGET):
             idx = self.treeConflicts.indexOfTopLevelItem(parent)
             self.treeConflicts.takeTopLevelItem(idx)
             if not self.treeConflicts.topLevelItemCount():
-                QMessageBox.warning(
-                    self,
-                    tr("Solve conflicts"),
-                    tr("All conflicts are solved. The merge operation will now be closed"),
-                    QMessageBox.StandardButton.Ok,
-                    QMessageBox.StandardButton.Ok,
-                )
-                self.okToMerge = True
-                self.close()
+                self._allConflictsSolved()
                 return
 
         self.treeConflicts.setCurrentItem(self.treeConflicts.topLevelItem(0))
         self.updateFromCurrentSelectedItem()
 
-    def solveOurs(self):
-        conflict = self.lastSelectedItem.conflict
-        feature = dict(conflict["ours"])
-        feature["id"] = f"{self.lastSelectedItem.path}:feature:{self.lastSelectedItem.fid}"
-        self.resolvedFeatures[feature["id"]] = feature
+    def _solveWithVersion(self, version):
+        # kept versions are resolved by name, so they don't need a feature file
+        fid = f"{self.lastSelectedItem.path}:feature:{self.lastSelectedItem.fid}"
+        self.resolvedFeatures[fid] = version
         self.updateAfterSolvingCurrentItem()
 
+    def _allConflictsSolved(self):
+        QMessageBox.warning(
+            self,
+            tr("Solve conflicts"),
+            tr("All conflicts are solved. The merge operation will now be closed"),
+            QMessageBox.StandardButton.Ok,
+            QMessageBox.StandardButton.Ok,
+        )
+        self.okToMerge = True
+        self.close()
+
+    def solveOurs(self):
+        self._solveWithVersion("ours")
+
     def solveTheirs(self):
-        conflict = self.lastSelectedItem.conflict
-        feature = dict(conflict["theirs"])
-        feature["id"] = f"{self.lastSelectedItem.path}:feature:{self.lastSelectedItem.fid}"
-        self.resolvedFeatures[feature["id"]] = feature
-        self.updateAfterSolvingCurrentItem()
+        self._solveWithVersion("theirs")
 
     def solveWithDeleted(self):
         fid = f"{self.lastSelectedItem.path}:feature:{self.lastSelectedItem.fid}"
@@ -213,18 +241,10 @@ class ConflictsDialog(BASE, WIDGET):
 
     def solveWithModified(self):
         conflict = self.lastSelectedItem.conflict
-        feature = conflict["ours"] or conflict["theirs"]
-        feature = dict(feature)
-        feature["id"] = f"{self.lastSelectedItem.path}:feature:{self.lastSelectedItem.fid}"
-        self.resolvedFeatures[feature["id"]] = feature
-        self.updateAfterSolvingCurrentItem()
+        self._solveWithVersion("ours" if conflict["ours"] else "theirs")
 
     def solveWithAncestor(self):
-        conflict = self.lastSelectedItem.conflict
-        feature = dict(conflict["ancestor"])
-        feature["id"] = f"{self.lastSelectedItem.path}:feature:{self.lastSelectedItem.fid}"
-        self.resolvedFeatures[feature["id"]] = feature
-        self.updateAfterSolvingCurrentItem()
+        self._solveWithVersion("ancestor")
 
     def showSolveDeleted(self):
         self.stackedWidget.setCurrentWidget(self.pageSolveWithDeleted)
@@ -1,49 +1,50 @@
 # -*- coding: utf-8 -*-
 
-import json
 import os
 
 from qgis.core import (
     Qgis,
     QgsCategorizedSymbolRenderer,
     QgsFeature,
-    QgsGeometry,
-    QgsJsonUtils,
-    QgsPointXY,
     QgsProject,
     QgsRasterLayer,
     QgsRendererCategory,
     QgsSingleSymbolRenderer,
     QgsSymbol,
     QgsVectorLayer,
-    QgsWkbTypes,
     edit,
 )
 from qgis.gui import QgsMapCanvas, QgsMapToolPan, QgsMessageBar
 from qgis.PyQt import uic
-from qgis.PyQt.QtCore import Qt, pyqtSignal
+from qgis.PyQt.QtCore import QAbstractItemModel, QModelIndex, Qt, pyqtSignal
 from qgis.PyQt.QtGui import QBrush, QColor
 from qgis.PyQt.QtWidgets import (
     QDialog,
     QHeaderView,
     QSizePolicy,
     QTableWidgetItem,
-    QTreeWidgetItem,
-    QTreeWidgetItemIterator,
     QVBoxLayout,
 )
 from qgis.utils import iface
 
+from kart.geojson import GeometryCache
 from kart.gui import icons
+from kart.kartapi import DatasetDiffs, DiffStream
 from kart.utils import (
     CURRENT_COLOR_ADDED,
     CURRENT_COLOR_MODIFIED,
     CURRENT_COLOR_REMOVED,
     CURRENT_COLOR_UNCHANGED,
+    DEFAULT_DIFF_WARNING_SIZE,
+    DEFAULT_VERTEX_DIFF_TOLERANCE,
+    DIFFWARNINGSIZE,
     PALETTES,
+    VERTEXDIFFTOLERANCE,
+    confirm,
     setting,
     tr,
 )
+from kart.vertexdiff import multiPoint, vertexDiff
 
 from .mapswipetool import MapSwipeTool
 
@@ -66,20 +67,34 @@ WIDGET, BASE = uic.loadUiType(os.path.join(os.path.dirname(__file__), "diffviewe
 class DiffViewerWidget(WIDGET, BASE):
     workingLayerChanged = pyqtSignal()
 
-    def __init__(self, diff, repo, showRecoverNewButton):
+    def __init__(self, diff, repo, showRecoverNewButton, refa=None, refb=None):
         super(DiffViewerWidget, self).__init__()
-        self.diff = diff
+        # the diff of each dataset is added as it is done, or as it is read
+        self.datasetDiffs = diff if isinstance(diff, (DatasetDiffs, DiffStream)) else None
+        self.diff = {} if self.datasetDiffs is not None else diff
+        # the commits compared, whose metadata describes the datasets in the diff
+        if self.datasetDiffs is not None:
+            refa, refb = self.datasetDiffs.refa, self.datasetDiffs.refb
+        self.refa = refa
+        self.refb = refb
         self.repo = repo
         self.oldLayer = None
         self.newLayer = None
         self.osmLayer = None
         self.showRecoverNewButton = showRecoverNewButton
+        # old and new layers kept for the lifetime of the dialog, refilled as
+        # items are selected: for all the features of each dataset, and for a
+        # single feature of each (dataset, geometry type)
         self.layerDiffLayers = {}
+        self.staleLayerDiffLayers = set()
+        self.featureDiffLayers = {}
         self.currentFeatureItem = None
         self.currentDatasetItem = None
         self.workingCopyLayers = {}
         self.workingCopyLayersIdFields = {}
         self.workingCopyLayerCrs = {}
+        # decoded geometries, reused when features are selected again or the diff mode changes
+        self.geometries = GeometryCache()
 
         self.mostRecentTabIndex = None
 
@@ -106,7 +121,9 @@ class DiffViewerWidget(WIDGET, BASE):
         self.comboAdditionalLayers.currentIndexChanged.connect(self.fillCanvas)
         self.btnRecoverOldVersion.clicked.connect(self.recoverOldVersion)
         self.btnRecoverNewVersion.clicked.connect(self.recoverNewVersion)
-        self.featuresTree.currentItemChanged.connect(self.treeItemChanged)
+        self.featuresModel = DiffTreeModel(self)
+        self.featuresTree.setModel(self.featuresModel)
+        self.featuresTree.selectionModel().currentChanged.connect(self.currentIndexChanged)
         self.featuresTree.header().hide()
 
         self.featuresTree.header().setStretchLastSection(True)
@@ -127,6 +144,9 @@ class DiffViewerWidget(WIDGET, BASE):
 
         self.selectFirstChangedFeature()
 
+        if self.datasetDiffs is not None:
+            self.datasetDiffs.onDataset(self.datasetDiffDone)
+
     def get_color(self, status):
         """Fetches the color from QSettings, using "Standard" as fallback."""
         key_map = {
@@ -141,6 +161,12 @@ class DiffViewerWidget(WIDGET, BASE):
         return QColor(PALETTES["Standard"][status])
 
     # Lifecycle
+    def currentIndexChanged(self, current, previous):
+        self.treeItemChanged(
+            self.featuresModel.nodeFromIndex(current) if current.isValid() else None,
+            self.featuresModel.nodeFromIndex(previous) if previous.isValid() else None,
+        )
+
     def treeItemChanged(self, current, previous):
         self.canvasWidget.setVisible(True)
         self.widgetDiffConfig.setVisible(True)
@@ -168,7 +194,7 @@ class DiffViewerWidget(WIDGET, BASE):
             self.currentFeatureItem = current
             self.currentDatasetItem = None
             self.fillAttributesDiff()
-            self.removeMapLayers()
+            self._releaseLayers()
             self.attributesTable.setVisible(True)
             self.btnRecoverNewVersion.setVisible(True and self.showRecoverNewButton)
             self.btnRecoverOldVersion.setVisible(True)
@@ -181,7 +207,7 @@ class DiffViewerWidget(WIDGET, BASE):
         elif isinstance(current, DatasetItem):
             self.currentFeatureItem = None
             self.currentDatasetItem = current
-            self.removeMapLayers()
+            self._releaseLayers()
             self.tabWidget.setTabEnabled(TAB_ATTRIBUTES, False)
             self.attributesTable.setVisible(False)
             self.btnRecoverNewVersion.setVisible(False)
@@ -206,13 +232,31 @@ class DiffViewerWidget(WIDGET, BASE):
             "QTabBar::tab::disabled {width: 0; height: 0; margin: 0; padding: 0; border: none;} "
         )
 
-    def removeMapLayers(self):
+    def _releaseLayers(self):
+        """
+        Removes the layers of the diff mode of the previous selection. The old
+        and new layers are kept, to be refilled for the next one.
+        """
         self._cleanupModeLayers()
-        for layer in [self.oldLayer, self.newLayer, self.osmLayer]:
-            if layer is not None:
-                QgsProject.instance().removeMapLayer(layer.id())
         self.oldLayer = None
         self.newLayer = None
+
+    def removeMapLayers(self):
+        if self.datasetDiffs is not None:
+            self.datasetDiffs.cancel()
+        self._releaseLayers()
+        layers = [self.osmLayer]
+        for oldLayer, newLayer in [
+            *self.layerDiffLayers.values(),
+            *self.featureDiffLayers.values(),
+        ]:
+            layers.extend([oldLayer, newLayer])
+        for layer in layers:
+            if layer is not None and QgsProject.instance().mapLayer(layer.id()):
+                QgsProject.instance().removeMapLayer(layer.id())
+        self.layerDiffLayers = {}
+        self.staleLayerDiffLayers = set()
+        self.featureDiffLayers = {}
         self.osmLayer = None
 
     # Rendering
@@ -308,9 +352,68 @@ class DiffViewerWidget(WIDGET, BASE):
         if self.currentFeatureItem is not None:
             self._createFeatureDiffLayers()
         elif self.currentDatasetItem is not None:
-            oldLayer, newLayer = self.layerDiffLayers[self.currentDatasetItem.dataset]
-            self.oldLayer = oldLayer.clone()
-            self.newLayer = newLayer.clone()
+            self.oldLayer, self.newLayer = self._datasetDiffLayers(self.currentDatasetItem)
+
+    def _datasetDiffLayers(self, datasetItem):
+        """
+        Returns the layers with the old and new geometries of all the changed
+        features in a dataset, filled the first time the dataset is selected
+        and again after more of its changes are added
+        """
+        dataset = datasetItem.dataset
+        if dataset not in self.layerDiffLayers:
+            crs = self.workingCopyLayerCrs[dataset]
+            geom = datasetItem.geometry()
+            if geom is not None:
+                geomtype = geom["type"]
+                oldLayer = QgsVectorLayer(f"{geomtype}?crs={crs}", "old", "memory")
+                newLayer = QgsVectorLayer(f"{geomtype}?crs={crs}", "new", "memory")
+            else:
+                oldLayer = QgsVectorLayer("None", "old", "memory")
+                newLayer = QgsVectorLayer("None", "new", "memory")
+            self.layerDiffLayers[dataset] = (oldLayer, newLayer)
+            self.staleLayerDiffLayers.add(dataset)
+        oldLayer, newLayer = self.layerDiffLayers[dataset]
+        if dataset in self.staleLayerDiffLayers:
+            oldFeatures = []
+            newFeatures = []
+            for old, new in datasetItem.changes():
+                for feat, features in [(old, oldFeatures), (new, newFeatures)]:
+                    if feat and feat["geometry"] is not None:
+                        feature = QgsFeature()
+                        feature.setGeometry(self._geomFromGeojson(dataset, feat))
+                        features.append(feature)
+            self._setLayerFeatures(oldLayer, oldFeatures)
+            self._setLayerFeatures(newLayer, newFeatures)
+            self.staleLayerDiffLayers.discard(dataset)
+        return oldLayer, newLayer
+
+    def _featureDiffLayers(self, dataset, geomtype, fields):
+        """
+        Returns the layers for the old and new versions of a feature of a
+        dataset, created the first time a feature with that geometry type is
+        selected
+        """
+        key = (dataset, geomtype)
+        if key not in self.featureDiffLayers:
+            crs = self.workingCopyLayerCrs[dataset]
+            options = QgsVectorLayer.LayerOptions()
+            options.skipCrsValidation = True
+            uri = f"{geomtype}?crs={crs}" if geomtype is not None else "None"
+            oldLayer = QgsVectorLayer(uri, "old", "memory", options)
+            newLayer = QgsVectorLayer(uri, "new", "memory", options)
+            for lyr in [oldLayer, newLayer]:
+                lyr.dataProvider().addAttributes(fields.toList())
+                lyr.updateFields()
+            self.featureDiffLayers[key] = (oldLayer, newLayer)
+        return self.featureDiffLayers[key]
+
+    def _setLayerFeatures(self, layer, features):
+        """Replaces the features of one of the old and new memory layers."""
+        layer.dataProvider().truncate()
+        layer.dataProvider().addFeatures(features)
+        layer.updateExtents()
+        layer.triggerRepaint()
 
     def _createFeatureDiffLayers(self):
         old = self.currentFeatureItem.old
@@ -320,29 +423,19 @@ class DiffViewerWidget(WIDGET, BASE):
             self.workingCopyLayers[dataset] = self.repo.workingCopyLayer(dataset)
         layer = self.workingCopyLayers[dataset]
         if dataset not in self.workingCopyLayersIdFields:
-            self.workingCopyLayersIdFields[dataset] = self.repo.workingCopyLayerIdField(dataset)
-        crs = self.workingCopyLayerCrs[dataset]
+            self.workingCopyLayersIdFields[dataset] = self.repo.workingCopyLayerIdField(
+                dataset, self.refa, self.refb
+            )
         idField = self.workingCopyLayersIdFields[dataset]
         ref = new or old
         refGeom = ref["geometry"]
-        options = QgsVectorLayer.LayerOptions()
-        options.skipCrsValidation = True
-        if refGeom is not None:
-            geomtype = refGeom["type"]
-            self.oldLayer = QgsVectorLayer(f"{geomtype}?crs={crs}", "old", "memory", options)
-            self.newLayer = QgsVectorLayer(f"{geomtype}?crs={crs}", "new", "memory", options)
-        else:
-            self.oldLayer = QgsVectorLayer("None", "old", "memory", options)
-            self.newLayer = QgsVectorLayer("None", "new", "memory", options)
-
-        self.oldLayer.dataProvider().addAttributes(layer.fields().toList())
-        self.oldLayer.updateFields()
-        self.newLayer.dataProvider().addAttributes(layer.fields().toList())
-        self.newLayer.updateFields()
+        geomtype = refGeom["type"] if refGeom is not None else None
+        self.oldLayer, self.newLayer = self._featureDiffLayers(dataset, geomtype, layer.fields())
 
         for lyr, feat in [(self.newLayer, new), (self.oldLayer, old)]:
+            features = []
             if bool(feat):
-                geom = self._geomFromGeojson(feat)
+                geom = self._geomFromGeojson(dataset, feat)
                 props = feat["properties"]
                 feature = QgsFeature(lyr.fields())
                 for prop in feature.fields().names():
@@ -350,7 +443,8 @@ class DiffViewerWidget(WIDGET, BASE):
                 feature[idField] = self.currentFeatureItem.fid
                 if geom is not None:
                     feature.setGeometry(geom)
-                lyr.dataProvider().addFeatures([feature])
+                features.append(feature)
+            self._setLayerFeatures(lyr, features)
 
         currentFieldNames = set(layer.fields().names())
         oldFieldNames = set(old.get("properties", {}).keys())
@@ -369,28 +463,16 @@ class DiffViewerWidget(WIDGET, BASE):
         options = QgsVectorLayer.LayerOptions()
         options.skipCrsValidation = True
         vertexDiffLayer = QgsVectorLayer(
-            f"Point?crs={crs}&field=changetype:string", "vertexdiff", "memory", options
+            f"MultiPoint?crs={crs}&field=changetype:string", "vertexdiff", "memory", options
         )
 
-        def vertices(geom):
-            if geom is None or geom.isEmpty():
-                return set()
-            return {(round(v.x(), 5), round(v.y(), 5)) for v in geom.vertices()}
-
-        old_vertices = vertices(geoms[0])
-        new_vertices = vertices(geoms[1])
-
-        changetype_map = [
-            ("A", new_vertices - old_vertices),  # added: present in new, absent in old
-            ("R", old_vertices - new_vertices),  # removed: present in old, absent in new
-            ("U", old_vertices & new_vertices),  # unchanged: present in both
-        ]
-
+        # a single multipoint per change type, as geometries can have millions of vertices
         feats = []
-        for changetype, vertex_set in changetype_map:
-            for x, y in vertex_set:
+        for changetype, coords in vertexDiff(*geoms, vertexDiffTolerance()).items():
+            geom = multiPoint(coords)
+            if geom is not None:
                 feat = QgsFeature()
-                feat.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(x, y)))
+                feat.setGeometry(geom)
                 feat.setAttributes([changetype])
                 feats.append(feat)
 
@@ -417,90 +499,39 @@ class DiffViewerWidget(WIDGET, BASE):
 
     # UI
     def fillTree(self):
-        self.featuresTree.clear()
+        self.featuresModel.clear()
         for dataset, changes in self.diff.items():
-            if dataset not in self.workingCopyLayerCrs:
-                self.workingCopyLayerCrs[dataset] = self.repo.workingCopyLayerCrs(dataset)
-            crs = self.workingCopyLayerCrs[dataset]
-            datasetItem = DatasetItem(dataset, crs is None)
-            addedItem = QTreeWidgetItem()
-            addedItem.setText(0, tr("Added"))
-            addedItem.setIcon(0, icons.addedIcon)
-            removedItem = QTreeWidgetItem()
-            removedItem.setText(0, tr("Removed"))
-            removedItem.setIcon(0, icons.removeIcon)
-            modifiedItem = QTreeWidgetItem()
-            modifiedItem.setText(0, tr("Modified"))
-            modifiedItem.setIcon(0, icons.modifiedIcon)
-
-            subItems = {"I": addedItem, "U": modifiedItem, "D": removedItem}
-            changes = {feat["id"]: feat for feat in changes}
-            usedids = []
-            for feat in changes.values():
-                # Try to parse the feature id string in the old format first
-                # and if that fails try the new format. The old format is
-                # the change type and numeric id, eg.
-                # 'U-::49'
-                # whereas the new format additionally includes the dataset name
-                # and element type eg.
-                # 'nz_pipelines:feature:49:U-'
-                # TODO - remove support for 'old' format, requires users to have upgraded
-                #  this plugin first
-                is_new_id_format = False
-                elementtype = None
-                try:
-                    changetype, featid = feat["id"].split("::")
-                except ValueError:
-                    _, elementtype, featid, changetype = feat["id"].split(":")
-                    is_new_id_format = True
-                changetype = changetype[0]
-                if featid not in usedids:
-                    if changetype == "I":
-                        old = {}
-                        new = feat
-                    elif changetype == "D":
-                        old = feat
-                        new = {}
-                    else:
-                        if is_new_id_format:
-                            old = changes[f"{dataset}:{elementtype}:{featid}:U-"]
-                            new = changes[f"{dataset}:{elementtype}:{featid}:U+"]
-                        else:
-                            old = changes[f"U-::{featid}"]
-                            new = changes[f"U+::{featid}"]
-                    usedids.append(featid)
-                    item = FeatureItem(featid, old, new, dataset)
-                    subItems[changetype].addChild(item)
-                if dataset not in self.layerDiffLayers:
-                    ref = new or old
-                    geom = ref["geometry"]
-                    if geom is not None:
-                        geomtype = geom["type"]
-                        oldLayer = QgsVectorLayer(f"{geomtype}?crs={crs}", "old", "memory")
-                        newLayer = QgsVectorLayer(f"{geomtype}?crs={crs}", "new", "memory")
-                    else:
-                        oldLayer = QgsVectorLayer("None", "old", "memory")
-                        newLayer = QgsVectorLayer("None", "new", "memory")
-                    self.layerDiffLayers[dataset] = (oldLayer, newLayer)
-
-                if old and old["geometry"] is not None:
-                    oldFeature = QgsFeature()
-                    oldFeature.setGeometry(self._geomFromGeojson(old))
-                    oldLayer.dataProvider().addFeatures([oldFeature])
-                if new and new["geometry"] is not None:
-                    newFeature = QgsFeature()
-                    newFeature.setGeometry(self._geomFromGeojson(new))
-                    newLayer.dataProvider().addFeatures([newFeature])
-            for subItem in subItems.values():
-                if subItem.childCount():
-                    datasetItem.addChild(subItem)
-            if datasetItem.childCount():
-                self.featuresTree.addTopLevelItem(datasetItem)
+            self.addDatasetChanges(dataset, changes)
 
         self.attributesTable.clear()
         self.attributesTable.verticalHeader().hide()
         self.attributesTable.horizontalHeader().hide()
-        self.featuresTree.expandAll()
+
+    def datasetDiffDone(self, dataset, changes):
+        self.diff.setdefault(dataset, []).extend(changes)
+        self.addDatasetChanges(dataset, changes)
+        if not self.featuresTree.currentIndex().isValid():
+            self.selectFirstChangedFeature()
+
+    def addDatasetChanges(self, dataset, changes):
+        """
+        Adds changed features of a dataset to the tree. Can be called more than
+        once for the same dataset, e.g. with the chunks of a DiffStream
+        """
+        if not changes:
+            return
+        if dataset not in self.workingCopyLayerCrs:
+            self.workingCopyLayerCrs[dataset] = self.repo.workingCopyLayerCrs(
+                dataset, self.refa, self.refb
+            )
+        crs = self.workingCopyLayerCrs[dataset]
+        datasetItem = self.featuresModel.addChanges(dataset, changes, crs is None)
+        # the dataset layers have to be filled again to include the new features
+        self.staleLayerDiffLayers.add(dataset)
+        datasetIndex = self.featuresModel.indexForNode(datasetItem)
+        self.featuresTree.expand(datasetIndex)
+        for groupItem in datasetItem.children:
+            self.featuresTree.expand(self.featuresModel.indexForNode(groupItem))
 
     def fillAttributesDiff(self):
         old = self.currentFeatureItem.old
@@ -654,33 +685,32 @@ class DiffViewerWidget(WIDGET, BASE):
 
     # Helpers
     def selectFirstChangedFeature(self):
-        iterator = QTreeWidgetItemIterator(self.featuresTree)
-        while iterator.value():
-            item = iterator.value()
-            if isinstance(item, FeatureItem):
-                self.featuresTree.setCurrentItem(item)
-                return
-            iterator += 1
+        for datasetItem in self.featuresModel.root.children:
+            for groupItem in datasetItem.children:
+                groupIndex = self.featuresModel.indexForNode(groupItem)
+                if not groupItem.children and self.featuresModel.canFetchMore(groupIndex):
+                    self.featuresModel.fetchMore(groupIndex)
+                if groupItem.children:
+                    featureIndex = self.featuresModel.indexForNode(groupItem.children[0])
+                    self.featuresTree.setCurrentIndex(featureIndex)
+                    return
 
     def _hasGeometry(self, item):
         if isinstance(item, FeatureItem):
-            old = self.currentFeatureItem.old
-            new = self.currentFeatureItem.new
-            ref = old or new
+            ref = item.old or item.new
             return ref["geometry"] is not None
         else:
-            oldLayer, newLayer = self.layerDiffLayers[item.dataset]
-            return oldLayer.wkbType() != QgsWkbTypes.Type.NoGeometry
+            return item.geometry() is not None
 
-    def _geomFromGeojson(self, geojson):
+    def _geomFromGeojson(self, dataset, geojson):
         if not geojson or "geometry" not in geojson:
             return None
-        feats = QgsJsonUtils.stringToFeatureList(json.dumps(geojson))
-        return feats[0].geometry() if feats else None
+        changetype, fid = _parseFeatureId(geojson["id"])
+        return self.geometries.geometry((dataset, fid, changetype), geojson["geometry"])
 
 
 class DiffViewerDialog(QDialog):
-    def __init__(self, parent, diff, repo, showRecoverNewButton=True):
+    def __init__(self, parent, diff, repo, showRecoverNewButton=True, refa=None, refb=None):
         super(QDialog, self).__init__(parent)
         self.setWindowFlags(Qt.WindowType.Window)
         layout = QVBoxLayout()
@@ -688,12 +718,14 @@ class DiffViewerDialog(QDialog):
         self.bar = QgsMessageBar()
         self.bar.setSizePolicy(QSizePolicy.Policy.Minimum, QSizePolicy.Policy.Fixed)
         layout.addWidget(self.bar)
-        self.history = DiffViewerWidget(diff, repo, showRecoverNewButton)
+        self.history = DiffViewerWidget(diff, repo, showRecoverNewButton, refa, refb)
         self.history.workingLayerChanged.connect(self.workingLayerChanged)
         layout.addWidget(self.history)
         self.setLayout(layout)
         self.resize(1024, 768)
         self.setWindowTitle(tr("Diff viewer"))
+        # also when closed with Esc, which doesn't go through closeEvent
+        self.finished.connect(self.history.removeMapLayers)
 
     def workingLayerChanged(self):
         self.bar.pushMessage(
@@ -703,9 +735,39 @@ class DiffViewerDialog(QDialog):
             5,
         )
 
-    def closeEvent(self, evt):
-        self.history.removeMapLayers()
-        evt.accept()
+
+def vertexDiffTolerance():
+    """
+    Returns the distance under which vertices are taken as the same one in
+    vertex diffs
+    """
+    value = setting(VERTEXDIFFTOLERANCE)
+    try:
+        return DEFAULT_VERTEX_DIFF_TOLERANCE if value is None else float(value)
+    except ValueError:
+        return DEFAULT_VERTEX_DIFF_TOLERANCE
+
+
+def confirmDiffSize(summary):
+    """
+    Returns whether to go on showing a diff, given its Repository.diffSummary.
+    Diffs with more changed features than set in the settings have to be
+    confirmed first.
+    """
+    value = setting(DIFFWARNINGSIZE)
+    try:
+        warningSize = DEFAULT_DIFF_WARNING_SIZE if value is None else int(value)
+    except ValueError:
+        warningSize = DEFAULT_DIFF_WARNING_SIZE
+    total = sum(counts["total"] for counts in summary.values())
+    if warningSize <= 0 or total <= warningSize:
+        return True
+    return confirm(
+        tr(
+            "There are {total} changed features, which might take a long time to show. "
+            "Do you want to show them anyway?"
+        ).format(total=total)
+    )
 
 
 # Diff modes
@@ -770,8 +832,8 @@ class VertexDiffMode(DiffMode):
             old = self.w.currentFeatureItem.old
             new = self.w.currentFeatureItem.new
             geoms = [
-                self.w._geomFromGeojson(old) if old else None,
-                self.w._geomFromGeojson(new) if new else None,
+                self.w._geomFromGeojson(self.w.currentFeatureItem.dataset, old) if old else None,
+                self.w._geomFromGeojson(self.w.currentFeatureItem.dataset, new) if new else None,
             ]
             self._vertexDiffLayer = self.w._createVertexDiffLayer(geoms)
 
@@ -826,23 +888,281 @@ class VertexDiffMode(DiffMode):
 
 
 # Data model classes
-class FeatureItem(QTreeWidgetItem):
-    def __init__(self, fid, old, new, dataset):
-        QTreeWidgetItem.__init__(self)
-        self.setIcon(0, icons.featureIcon)
-        self.setText(0, fid)
-        self.old = old
-        self.new = new
-        self.dataset = dataset
-        self.fid = fid
+CHANGE_TYPES_ORDER = ["I", "U", "D"]
+
 
+def _parseFeatureId(featureId):
+    """
+    Returns the change type (I, U-, U+ or D) and feature id of a diff feature
+    """
+    # Try to parse the feature id string in the old format first
+    # and if that fails try the new format. The old format is
+    # the change type and numeric id, eg.
+    # 'U-::49'
+    # whereas the new format additionally includes the dataset name
+    # and element type eg.
+    # 'nz_pipelines:feature:49:U-'
+    # TODO - remove support for 'old' format, requires users to have upgraded
+    #  this plugin first
+    try:
+        changetype, featid = featureId.split("::")
+    except ValueError:
+        _, _, featid, changetype = featureId.split(":")
+    return changetype, featid
+
+
+class DiffTreeModel(QAbstractItemModel):
+    """
+    Tree of the features changed in a diff, grouped by dataset and change type.
+
+    Opening a diff only indexes the ids of the changed features. Feature rows
+    are created in batches as the view scrolls to them (canFetchMore/fetchMore),
+    and the old and new versions of a feature are only looked up when its
+    row is selected.
+    """
 
-class DatasetItem(QTreeWidgetItem):
-    def __init__(self, dataset, isTable):
-        QTreeWidgetItem.__init__(self)
+    FETCH_BATCH_SIZE = 500
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.root = DiffTreeNode(None, 0)
+        self._datasets = {}
+
+    def clear(self):
+        self.beginResetModel()
+        self.root.children = []
+        self._datasets = {}
+        self.endResetModel()
+
+    def addChanges(self, dataset, features, isTable):
+        """
+        Adds diff features of a dataset to the tree, and returns the DatasetItem
+        """
+        datasetItem = self._datasets.get(dataset)
+        if datasetItem is None:
+            row = len(self.root.children)
+            self.beginInsertRows(QModelIndex(), row, row)
+            datasetItem = DatasetItem(self.root, row, dataset, isTable)
+            self.root.children.append(datasetItem)
+            self._datasets[dataset] = datasetItem
+            self.endInsertRows()
+        datasetIndex = self.indexForNode(datasetItem)
+        for changetype, entries in datasetItem.addFeatures(features).items():
+            groupItem = datasetItem.groups.get(changetype)
+            if groupItem is None:
+                # groups are kept in the Added, Modified, Removed order
+                order = CHANGE_TYPES_ORDER.index(changetype)
+                row = len(
+                    [
+                        c
+                        for c in datasetItem.children
+                        if CHANGE_TYPES_ORDER.index(c.changetype) < order
+                    ]
+                )
+                self.beginInsertRows(datasetIndex, row, row)
+                groupItem = ChangeGroupItem(datasetItem, row, changetype)
+                datasetItem.children.insert(row, groupItem)
+                for i, child in enumerate(datasetItem.children):
+                    child.row = i
+                datasetItem.groups[changetype] = groupItem
+                self.endInsertRows()
+            groupItem.entries.extend(entries)
+        return datasetItem
+
+    def nodeFromIndex(self, index):
+        return index.internalPointer() if index.isValid() else self.root
+
+    def indexForNode(self, node):
+        if node is self.root:
+            return QModelIndex()
+        return self.createIndex(node.row, 0, node)
+
+    def index(self, row, column, parent=QModelIndex()):
+        node = self.nodeFromIndex(parent)
+        if column != 0 or not 0 <= row < len(node.children):
+            return QModelIndex()
+        return self.createIndex(row, column, node.children[row])
+
+    def parent(self, index=None):
+        if index is None:
+            return super().parent()
+        if not index.isValid():
+            return QModelIndex()
+        return self.indexForNode(index.internalPointer().parent)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        return len(self.nodeFromIndex(parent).children)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 1
+
+    def hasChildren(self, parent=QModelIndex()):
+        return self.nodeFromIndex(parent).hasChildren()
+
+    def canFetchMore(self, parent):
+        return self.nodeFromIndex(parent).canFetchMore()
+
+    def fetchMore(self, parent):
+        node = self.nodeFromIndex(parent)
+        count = min(self.FETCH_BATCH_SIZE, node.pendingCount())
+        if count <= 0:
+            return
+        start = len(node.children)
+        self.beginInsertRows(parent, start, start + count - 1)
+        node.fetch(count)
+        self.endInsertRows()
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        node = index.internalPointer()
+        if role == Qt.ItemDataRole.DisplayRole:
+            return node.text()
+        elif role == Qt.ItemDataRole.DecorationRole:
+            return node.icon()
+        return None
+
+
+class DiffTreeNode:
+    def __init__(self, parent, row):
+        self.parent = parent
+        self.row = row
+        self.children = []
+
+    def text(self):
+        return ""
+
+    def icon(self):
+        return None
+
+    def hasChildren(self):
+        return bool(self.children)
+
+    def canFetchMore(self):
+        return False
+
+    def pendingCount(self):
+        return 0
+
+
+class DatasetItem(DiffTreeNode):
+    def __init__(self, parent, row, dataset, isTable):
+        super().__init__(parent, row)
         self.dataset = dataset
-        self.setIcon(0, icons.tableIcon if isTable else icons.vectorDatasetIcon)
-        self.setText(0, dataset)
+        self.isTable = isTable
+        self.features = []
+        self.groups = {}
+        # modified features whose other version has not been seen yet
+        self._pendingUpdates = {}
+
+    def text(self):
+        return self.dataset
+
+    def icon(self):
+        return icons.tableIcon if self.isTable else icons.vectorDatasetIcon
+
+    def addFeatures(self, features):
+        """
+        Indexes diff features and returns the new [fid, oldIndex, newIndex]
+        entries for each change type. Features are not copied.
+        """
+        start = len(self.features)
+        self.features.extend(features)
+        entries = {}
+        for i, feat in enumerate(features, start):
+            changetype, fid = _parseFeatureId(feat["id"])
+            if changetype == "I":
+                entry = [fid, None, i]
+            elif changetype == "D":
+                entry = [fid, i, None]
+            else:
+                versionIndex = 1 if changetype == "U-" else 2
+                entry = self._pendingUpdates.pop(fid, None)
+                if entry is not None:
+                    entry[versionIndex] = i
+                    continue
+                entry = [fid, None, None]
+                entry[versionIndex] = i
+                self._pendingUpdates[fid] = entry
+            entries.setdefault(changetype[0], []).append(entry)
+        return entries
+
+    def feature(self, index):
+        return {} if index is None else self.features[index]
+
+    def changes(self):
+        """
+        Yields the old and new versions of all the changed features
+        """
+        for groupItem in self.children:
+            for _, oldIndex, newIndex in groupItem.entries:
+                yield self.feature(oldIndex), self.feature(newIndex)
+
+    def geometry(self):
+        """
+        Returns the geometry dict (GeoJSON, or WKB as from
+        geojson.wkbGeometry) of the first changed feature, or None if the
+        dataset has no geometries
+        """
+        if not self.features:
+            return None
+        return self.features[0]["geometry"]
+
+
+class ChangeGroupItem(DiffTreeNode):
+    def __init__(self, parent, row, changetype):
+        super().__init__(parent, row)
+        self.changetype = changetype
+        self.entries = []
+
+    def text(self):
+        return {"I": tr("Added"), "U": tr("Modified"), "D": tr("Removed")}[self.changetype]
+
+    def icon(self):
+        return {
+            "I": icons.addedIcon,
+            "U": icons.modifiedIcon,
+            "D": icons.removeIcon,
+        }[self.changetype]
+
+    def hasChildren(self):
+        return bool(self.entries)
+
+    def pendingCount(self):
+        return len(self.entries) - len(self.children)
+
+    def canFetchMore(self):
+        return self.pendingCount() > 0
+
+    def fetch(self, count):
+        start = len(self.children)
+        for row, entry in enumerate(self.entries[start : start + count], start):
+            self.children.append(FeatureItem(self, row, entry))
+
+
+class FeatureItem(DiffTreeNode):
+    def __init__(self, parent, row, entry):
+        super().__init__(parent, row)
+        self._entry = entry
+        self._datasetItem = parent.parent
+        self.dataset = self._datasetItem.dataset
+        self.fid = entry[0]
+
+    def text(self):
+        return self.fid
+
+    def icon(self):
+        return icons.featureIcon
+
+    @property
+    def old(self):
+        return self._datasetItem.feature(self._entry[1])
+
+    @property
+    def new(self):
+        return self._datasetItem.feature(self._entry[2])
 
 
 class DiffItem(QTableWidgetItem):
@@ -32,12 +32,13 @@ from qgis.PyQt.QtWidgets import (
 )
 from qgis.utils import iface
 
+from kart.automerge import AutoMergeRules, autoMerge
 from kart.core import RepoManager
 from kart.gui import icons
 from kart.gui.clonedialog import CloneDialog
 from kart.gui.conflictsdialog import ConflictsDialog
 from kart.gui.dbconnectiondialog import DbConnectionDialog
-from kart.gui.diffviewer import DiffViewerDialog
+from kart.gui.diffviewer import DiffViewerDialog, confirmDiffSize
 from kart.gui.historyviewer import HistoryDialog
 from kart.gui.initdialog import InitDialog
 from kart.gui.mergedialog import MergeDialog
@@ -52,7 +53,11 @@ from kart.kartapi import (
     executeskart,
 )
 from kart.utils import (
+    AUTOMERGE,
+    AUTOMERGEGEOMETRY,
+    AUTOMERGETIMESTAMPFIELD,
     LASTREPO,
+    ProgressBar,
     confirm,
     layerFromSource,
     progressBar,
@@ -67,6 +72,17 @@ pluginPath = os.path.split(os.path.dirname(__file__))[0]
 WIDGET, BASE = uic.loadUiType(os.path.join(os.path.dirname(__file__), "dockwidget.ui"))
 
 
+def autoMergeRules():
+    """
+    Returns the rules set in the settings for conflicts the automatic
+    merge can't solve by itself
+    """
+    return AutoMergeRules(
+        geometry=setting(AUTOMERGEGEOMETRY) or None,
+        timestampField=setting(AUTOMERGETIMESTAMPFIELD) or None,
+    )
+
+
 class KartDockWidget(QgsDockWidget, WIDGET):
     def __init__(self):
         super().__init__(iface.mainWindow())
@@ -304,7 +320,9 @@ class RepoItem(RefreshableItem):
         self.setIcon(0, icons.repoIcon)
         self.setChildIndicatorPolicy(QTreeWidgetItem.ChildIndicatorPolicy.ShowIndicator)
 
+    @executeskart
     def refreshContent(self):
+        self.repo.snapshot(useCache=False)
         self.takeChildren()
         self.populate()
         self.setTitle()
@@ -314,7 +332,7 @@ class RepoItem(RefreshableItem):
             try:
                 title = (
                     f"{self.repo.title() or os.path.normpath(self.repo.path)} "
-                    f"[{self.repo.currentBranch()}]"
+                    f"[{self.repo.snapshot().currentBranch}]"
                 )
             except KartException:
                 title = f"{self.repo.title() or os.path.normpath(self.repo.path)}"
@@ -498,27 +516,26 @@ class RepoItem(RefreshableItem):
 
     @executeskart
     def showChanges(self):
-        hasSchemaChanges = self.repo.diffHasSchemaChanges()
-        if hasSchemaChanges:
+        summary = self.repo.diffSummary()
+        if not summary:
             iface.messageBar().pushMessage(
                 tr("Changes"),
-                tr("There are schema changes in the working copy and changes cannot be shown"),
+                tr("There are no changes in the working copy"),
                 level=Qgis.MessageLevel.Warning,
             )
             return
-        diff = self.repo.diff()
-        hasChanges = any([bool(c) for c in diff.values()])
-        if hasChanges:
-            dialog = DiffViewerDialog(
-                iface.mainWindow(), diff, self.repo, showRecoverNewButton=False
-            )
-            dialog.exec()
-        else:
+        if not confirmDiffSize(summary):
+            return
+        hasSchemaChanges, diff = self.repo.diffForViewer()
+        if hasSchemaChanges:
             iface.messageBar().pushMessage(
                 tr("Changes"),
-                tr("There are no changes in the working copy"),
+                tr("There are schema changes in the working copy and changes cannot be shown"),
                 level=Qgis.MessageLevel.Warning,
             )
+            return
+        dialog = DiffViewerDialog(iface.mainWindow(), diff, self.repo, showRecoverNewButton=False)
+        dialog.exec()
 
     @executeskart
     def switchBranch(self):
@@ -600,16 +617,32 @@ class RepoItem(RefreshableItem):
             return
         conflicts = self.repo.conflicts()
         if conflicts:
-            dialog = ConflictsDialog(conflicts)
-            dialog.exec()
-            if dialog.okToMerge:
-                self.repo.resolveConflicts(dialog.resolvedFeatures)
-                self.repo.continueMerge()
-                iface.messageBar().pushMessage(
-                    tr("Merge"),
-                    tr("Merge operation was correctly continued and closed"),
-                    level=Qgis.MessageLevel.Info,
-                )
+            resolved = {}
+            if setting(AUTOMERGE):
+                resolved, conflicts = autoMerge(conflicts, autoMergeRules())
+                if resolved:
+                    iface.messageBar().pushMessage(
+                        tr("Resolve"),
+                        tr("{count} conflicts were solved automatically").format(
+                            count=len(resolved)
+                        ),
+                        level=Qgis.MessageLevel.Info,
+                    )
+            okToMerge = True
+            if conflicts:
+                # only the true conflicts are left for the user
+                dialog = ConflictsDialog(conflicts)
+                dialog.exec()
+                okToMerge = dialog.okToMerge
+                if okToMerge:
+                    resolved.update(dialog.resolvedFeatures)
+            if okToMerge:
+                # resolved in the background, so a large merge can be followed and cancelled
+                task = self.repo.resolveConflictsAsync(resolved)
+                bar = ProgressBar(tr("Resolving conflicts"), onCancel=task.cancel)
+                task.progressChanged.connect(lambda value: bar.setValue(int(value)))
+                task.onFinished(partial(self._conflictsResolved, bar))
+                task.onError(partial(self._conflictsNotResolved, bar))
         else:
             iface.messageBar().pushMessage(
                 tr("Resolve"),
@@ -617,6 +650,18 @@ class RepoItem(RefreshableItem):
                 level=Qgis.MessageLevel.Warning,
             )
 
+    def _conflictsResolved(self, bar, _):
+        bar.close()
+        self.continueMerge()
+
+    def _conflictsNotResolved(self, bar, exception):
+        bar.close()
+        iface.messageBar().pushMessage(
+            tr("Resolve"),
+            tr("Not all the conflicts were resolved: {error}").format(error=exception),
+            level=Qgis.MessageLevel.Warning,
+        )
+
     @executeskart
     def push(self):
         dialog = PushDialog(self.repo)
@@ -686,9 +731,14 @@ class DatasetsItem(RefreshableItem):
 
         self.populate()
 
+    @executeskart
+    def refreshContent(self):
+        self.repo.snapshot(useCache=False)
+        super().refreshContent()
+
     @executeskart
     def populate(self):
-        vectorDatasets, tables = self.repo.datasets()
+        vectorDatasets, tables = self.repo.snapshot().datasets()
         for dataset in vectorDatasets:
             item = DatasetItem(dataset, self.repo, False)
             self.addChild(item)
@@ -770,26 +820,26 @@ class DatasetItem(QTreeWidgetItem):
 
     @executeskart
     def showChanges(self):
-        hasSchemaChanges = self.repo.diffHasSchemaChanges(dataset=self.name)
-        if hasSchemaChanges:
+        summary = self.repo.diffSummary(dataset=self.name)
+        if not summary:
             iface.messageBar().pushMessage(
                 tr("Changes"),
-                tr("There are schema changes in the working copy and changes cannot be shown"),
+                tr("There are no changes in the working copy for this dataset"),
                 level=Qgis.MessageLevel.Warning,
             )
             return
-        diff = self.repo.diff(dataset=self.name)
-        if diff.get(self.name):
-            dialog = DiffViewerDialog(
-                iface.mainWindow(), diff, self.repo, showRecoverNewButton=False
-            )
-            dialog.exec()
-        else:
+        if not confirmDiffSize(summary):
+            return
+        hasSchemaChanges, diff = self.repo.diffForViewer(dataset=self.name)
+        if hasSchemaChanges:
             iface.messageBar().pushMessage(
                 tr("Changes"),
-                tr("There are no changes in the working copy for this dataset"),
+                tr("There are schema changes in the working copy and changes cannot be shown"),
                 level=Qgis.MessageLevel.Warning,
             )
+            return
+        dialog = DiffViewerDialog(iface.mainWindow(), diff, self.repo, showRecoverNewButton=False)
+        dialog.exec()
 
     @executeskart
     def discardChanges(self):
@@ -1,9 +1,7 @@
-import json
 import os
 
 from qgis.core import (
     Qgis,
-    QgsJsonUtils,
     QgsProject,
     QgsSingleSymbolRenderer,
     QgsSymbol,
@@ -23,6 +21,7 @@ from qgis.PyQt.QtWidgets import (
 )
 from qgis.utils import iface
 
+from kart.kartapi import KartException
 from kart.utils import tr
 
 WIDGET, BASE = uic.loadUiType(os.path.join(os.path.dirname(__file__), "featurehistorydialog.ui"))
@@ -62,8 +61,13 @@ class FeatureHistoryDialog(BASE, WIDGET):
         self.panTool = QgsMapToolPan(self.canvas)
         self.canvas.setMapTool(self.panTool)
 
+        # versions near the selected commit are fetched in the background
+        self.featureHistory = repo.featureHistory(dataset, fid, history, workingCopyLayer.fields())
+        # also when closed with Esc, which doesn't go through closeEvent
+        self.finished.connect(self.featureHistory.cancel)
+        self.finished.connect(self.removeLayer)
         for commit in history:
-            item = CommitListItem(commit, workingCopyLayer, dataset, fid, repo)
+            item = CommitListItem(commit, self.featureHistory)
             self.listCommits.addItem(item)
 
         self.listCommits.setCurrentRow(0)
@@ -90,7 +94,11 @@ class FeatureHistoryDialog(BASE, WIDGET):
         self.commitDetails.setHtml(html)
 
         self.removeLayer()
-        feature = self._currentCommitFeature()
+        try:
+            feature = self._currentCommitFeature()
+        except KartException as e:
+            self.bar.pushMessage(tr("Feature history"), str(e), Qgis.MessageLevel.Warning, 5)
+            return
         if feature is None:
             return
         geom = feature.geometry()
@@ -157,10 +165,6 @@ class FeatureHistoryDialog(BASE, WIDGET):
         if self.layer is not None:
             QgsProject.instance().removeMapLayers([self.layer.id()])
 
-    def closeEvent(self, evt):
-        self.removeLayer()
-        evt.accept()
-
     def retranslateUi(self, *args):
         """Update translations for UI elements from the .ui file"""
         super().retranslateUi(self)
@@ -176,43 +180,16 @@ class FeatureHistoryDialog(BASE, WIDGET):
 
 
 class CommitListItem(QListWidgetItem):
-    def __init__(self, commit, layer, dataset, fid, repo):
+    def __init__(self, commit, featureHistory):
         QListWidgetItem.__init__(self)
         self.commit = commit
-        self.layer = layer
-        self.dataset = dataset
-        self.repo = repo
-        self.fid = fid
-        self._feature = None
-        self._oldFeature = None
+        self.featureHistory = featureHistory
         self.setText(f"{commit['message'].splitlines()[0]}")
 
     def feature(self):
-        self._createFeatures()
-        return self._feature
+        versions = self.featureHistory.versions(self.commit["commit"])
+        return versions[0] if versions else None
 
     def oldFeature(self):
-        self._createFeatures()
-        return self._oldFeature
-
-    def _createFeatures(self):
-        if self._feature is None:
-            diff = self.repo.diff(
-                self.commit["parents"][0],
-                self.commit["commit"],
-                self.dataset,
-                self.fid,
-            )
-            geojson = diff[self.dataset][0]
-            self._feature = QgsJsonUtils.stringToFeatureList(json.dumps(geojson))[0]
-            props = geojson["properties"]
-            self._feature.setFields(self.layer.fields())
-            for prop in props:
-                self._feature[prop] = props[prop]
-            geojson = diff[self.dataset][-1]
-            self._oldFeature = QgsJsonUtils.stringToFeatureList(json.dumps(geojson))[0]
-            props = geojson["properties"]
-            self._oldFeature.setFields(self.layer.fields())
-            for prop in props:
-                self._oldFeature[prop] = props[prop]
-        return self._feature
+        versions = self.featureHistory.versions(self.commit["commit"])
+        return versions[1] if versions else None
@@ -1,14 +1,15 @@
 import json
 import os
+from collections import OrderedDict
 
 from qgis.core import Qgis, QgsProject, QgsVectorLayer, QgsWkbTypes
 from qgis.gui import QgsMessageBar
 from qgis.PyQt import uic
 from qgis.PyQt.QtCore import (
     QDateTime,
-    QPoint,
-    QRectF,
+    QPointF,
     Qt,
+    QTimer,
 )
 from qgis.PyQt.QtGui import (
     QBrush,
@@ -28,16 +29,17 @@ from qgis.PyQt.QtWidgets import (
     QLabel,
     QMenu,
     QSizePolicy,
+    QStyledItemDelegate,
     QTreeWidget,
     QTreeWidgetItem,
     QVBoxLayout,
-    QWidget,
 )
 from qgis.utils import iface
 
+from kart.commitgraph import graphColumns
 from kart.gui import icons
-from kart.gui.diffviewer import DiffViewerDialog
-from kart.kartapi import executeskart
+from kart.gui.diffviewer import DiffViewerDialog, confirmDiffSize
+from kart.kartapi import deferredDuringKartCalls, executeskart
 from kart.utils import DIFFSTYLES, setting, tr
 
 COMMIT_GRAPH_HEIGHT = 20
@@ -45,6 +47,12 @@ RADIUS = 4
 COL_SPACING = 20
 PEN_WIDTH = 2
 MARGIN = 50
+# commits shown by a filter before it stops loading older pages to find more
+MIN_FILTERED_COMMITS = 50
+# pages loaded at most to find them each time, the rest are loaded on request
+MAX_FILTER_PAGES = 5
+# typing in the filter applies it after this pause
+FILTER_DELAY_MS = 300
 
 COLORS = [
     QColor(Qt.GlobalColor.red),
@@ -78,6 +86,7 @@ class HistoryTree(QTreeWidget):
         self.dataset = dataset
         self.parent = parent
         self.filterText = ""
+        self.pager = None
         self.startDate = QDateTime.fromSecsSinceEpoch(0).date()
         self.endDate = QDateTime.currentDateTime().date()
         self.initGui()
@@ -96,7 +105,11 @@ class HistoryTree(QTreeWidget):
             ]
         )
         self.customContextMenuRequested.connect(self._showPopupMenu)
+        self.itemClicked.connect(self._itemClicked)
         self.setSelectionMode(QAbstractItemView.SelectionMode.ExtendedSelection)
+        self.setItemDelegateForColumn(0, GraphDelegate(self))
+        # loading a page processes events, which may scroll the tree
+        self.verticalScrollBar().valueChanged.connect(deferredDuringKartCalls(self._scrolled))
         self.populate()
 
     def _showPopupMenu(self, point):
@@ -108,7 +121,7 @@ class HistoryTree(QTreeWidget):
 
         point = self.mapToGlobal(point)
         selected = self.selectedItems()
-        if any([isinstance(item, ShallowCloneWarningItem) for item in selected]):
+        if any([not isinstance(item, CommitTreeItem) for item in selected]):
             return
         if selected and len(selected) == 1:
             item = self.currentItem()
@@ -213,13 +226,13 @@ class HistoryTree(QTreeWidget):
         if ok and name:
             self.repo.createTag(name, item.commit["commit"])
             self.message(tr("Tag correctly created"), Qgis.MessageLevel.Info)
-            self.populate()
+            item.addRef(f"tag: {name}")
 
     @executeskart
     def deleteTag(self, tag):
         self.repo.deleteTag(tag)
         self.message(tr(f"Correctly deleted tag '{tag}'"), Qgis.MessageLevel.Info)
-        self.populate()
+        self.removeRef(f"tag: {tag}")
 
     @executeskart
     def switchBranch(self, branch):
@@ -231,7 +244,7 @@ class HistoryTree(QTreeWidget):
     def deleteBranch(self, branch):
         self.repo.deleteBranch(branch)
         self.message(tr(f"Correctly deleted branch '{branch}'"), Qgis.MessageLevel.Info)
-        self.populate()
+        self.removeRef(branch)
 
     @executeskart
     def createBranch(self, item):
@@ -241,25 +254,37 @@ class HistoryTree(QTreeWidget):
         if ok and name:
             self.repo.createBranch(name, item.commit["commit"])
             self.message(tr("Branch correctly created"), Qgis.MessageLevel.Info)
-            self.populate()
+            item.addRef(name)
+
+    def removeRef(self, ref):
+        """
+        Removes a deleted tag or branch from the rows showing it, instead of
+        reloading the log, since the commits in it have not changed
+        """
+        for item in self.commitItems.values():
+            if ref in item.commit["refs"]:
+                item.removeRef(ref)
 
     @executeskart
     def showDiff(self, item, parent):
         refa = item.commit["commit"]
-        hasSchemaChanges = self.repo.diffHasSchemaChanges(refa, parent)
+        if not confirmDiffSize(self.repo.diffSummary(refa, parent)):
+            return
+        hasSchemaChanges, diff = self.repo.diffForViewer(refa, parent)
         if hasSchemaChanges:
             self.message(
                 tr("There are schema changes in the selected commit and changes cannot be shown"),
                 Qgis.MessageLevel.Warning,
             )
             return
-        diff = self.repo.diff(refa, parent)
-        dialog = DiffViewerDialog(self, diff, self.repo)
+        dialog = DiffViewerDialog(self, diff, self.repo, refa=refa, refb=parent)
         dialog.exec()
 
     @executeskart
     def showChangesBetweenCommits(self, refa, refb):
-        hasSchemaChanges = self.repo.diffHasSchemaChanges(refa, refb)
+        if not confirmDiffSize(self.repo.diffSummary(refa, refb)):
+            return
+        hasSchemaChanges, diff = self.repo.diffForViewer(refa, refb)
         if hasSchemaChanges:
             self.message(
                 tr(
@@ -269,8 +294,7 @@ class HistoryTree(QTreeWidget):
                 Qgis.MessageLevel.Warning,
             )
             return
-        diff = self.repo.diff(refa, refb)
-        dialog = DiffViewerDialog(self, diff, self.repo)
+        dialog = DiffViewerDialog(self, diff, self.repo, refa=refa, refb=refb)
         dialog.exec()
 
     @executeskart
@@ -285,7 +309,7 @@ class HistoryTree(QTreeWidget):
 
     @executeskart
     def saveAsLayer(self, refa, refb):
-        hasSchemaChanges = self.repo.diffHasSchemaChanges(refb, refa)
+        hasSchemaChanges, diff = self.repo.diffWithSchemaChanges(refb, refa)
         if hasSchemaChanges:
             self.message(
                 tr(
@@ -295,7 +319,6 @@ class HistoryTree(QTreeWidget):
                 Qgis.MessageLevel.Warning,
             )
             return
-        diff = self.repo.diff(refb, refa)
         for dataset in diff:
             geojson = {"type": "FeatureCollection", "features": diff[dataset]}
             layer = QgsVectorLayer(json.dumps(geojson), f"{dataset}_diff_{refa[:7]}", "ogr")
@@ -320,7 +343,7 @@ class HistoryTree(QTreeWidget):
     @executeskart
     def restoreDatasets(self, item):
         ALL_DATASETS = tr("Restore all datasets")
-        vectorLayers, tables = self.repo.datasets()
+        vectorLayers, tables = self.repo.snapshot().datasets()
         datasets = [ALL_DATASETS]
         datasets.extend(vectorLayers)
         datasets.extend(tables)
@@ -345,102 +368,104 @@ class HistoryTree(QTreeWidget):
 
     @executeskart
     def populate(self):
-        commits = self.repo.log(dataset=self.dataset)
-
-        self.log = {c["commit"]: c for c in commits}
+        self.closePager()
         self.clear()
+        self.log = {}
+        self.commitItems = {}
+        self.maxcol = 0
+        self.grafted = False
+        self.moreItem = None
+        self.pager = self.repo.logPager(dataset=self.dataset)
+        self._fetchMatching(MIN_FILTERED_COMMITS)
+        for i in range(1, 6):
+            self.resizeColumnToContents(i)
+        self.header().setSectionResizeMode(0, QHeaderView.ResizeMode.Fixed)
+        self.header().setSectionResizeMode(1, QHeaderView.ResizeMode.Fixed)
+
+    @executeskart
+    def fetchMore(self):
+        """
+        Adds the next page of the log to the tree
+        """
+        if self.pager is None or not self.pager.hasMore():
+            return
+        self._removeMoreItem()
+        commits = self.pager.nextPage()
+        self.log.update({c["commit"]: c for c in commits})
 
-        maxcol = 0
         for c in commits:
-            graph = c["graph"]
-            for i in range(3):
-                for positions in graph[i].values():
-                    if positions:
-                        maxcol = max(maxcol, max(positions))
+            self.maxcol = max(self.maxcol, graphColumns(c) - 1)
 
-        # maxcol = max([c["commitColumn"] for c in commits])
-        width = COL_SPACING * maxcol + 2 * RADIUS
+        width = COL_SPACING * self.maxcol + 2 * RADIUS
 
-        grafted = False
-        for i, commit in enumerate(commits):
+        for commit in commits:
             item = CommitTreeItem(commit, self)
             self.addTopLevelItem(item)
-            img = self.graphImage(commit, width)
-            w = GraphWidget(img)
-            w.setFixedHeight(COMMIT_GRAPH_HEIGHT)
-            self.setItemWidget(item, 0, w)
+            self.commitItems[commit["commit"]] = item
             if "grafted" in commit["refs"]:
-                grafted = True
-        if grafted:
+                self.grafted = True
+        if self.grafted and not self.pager.hasMore():
             item = ShallowCloneWarningItem(self)
             self.addTopLevelItem(item)
-        for i in range(1, 6):
-            self.resizeColumnToContents(i)
         self.setColumnWidth(0, width + MARGIN)
-        self.header().setSectionResizeMode(0, QHeaderView.ResizeMode.Fixed)
-        self.header().setSectionResizeMode(1, QHeaderView.ResizeMode.Fixed)
-        self.filterCommits()
-
-    def graphImage(self, commit, width):
-        image = QPixmap(width, COMMIT_GRAPH_HEIGHT).toImage()
-        qp = QPainter(image)
-        palette = QWidget().palette()
-        qp.fillRect(
-            QRectF(0, 0, width, COMMIT_GRAPH_HEIGHT),
-            palette.color(QPalette.ColorRole.Base),
-        )
+        self._applyFilter()
 
-        path = QPainterPath()
-        for col in commit["graph"][0][r"\|"]:
-            x = RADIUS + COL_SPACING * col
-            path.moveTo(x, COMMIT_GRAPH_HEIGHT / 2)
-            path.lineTo(x, 0)
-        for col in commit["graph"][2][r"\|"]:
-            x = RADIUS + COL_SPACING * col
-            path.moveTo(x, COMMIT_GRAPH_HEIGHT / 2)
-            path.lineTo(x, COMMIT_GRAPH_HEIGHT)
-        for col in commit["graph"][0][r"/"]:
-            x = RADIUS + COL_SPACING * col
-            x2 = RADIUS + COL_SPACING * (col + 0.5)
-            path.moveTo(x, COMMIT_GRAPH_HEIGHT / 2)
-            path.lineTo(x2, 0)
-        for col in commit["graph"][2][r"/"]:
-            x = RADIUS + COL_SPACING * (col + 1)
-            x2 = RADIUS + COL_SPACING * (col + 0.5)
-            path.moveTo(x, COMMIT_GRAPH_HEIGHT / 2)
-            path.lineTo(x2, COMMIT_GRAPH_HEIGHT)
-        for col in commit["graph"][0][r"\\"]:
-            x = RADIUS + COL_SPACING * (col + 1)
-            x2 = RADIUS + COL_SPACING * (col + 0.5)
-            path.moveTo(x, COMMIT_GRAPH_HEIGHT / 2)
-            path.lineTo(x2, 0)
-        for col in commit["graph"][2][r"\\"]:
-            x = RADIUS + COL_SPACING * (col)
-            x2 = RADIUS + COL_SPACING * (col + 0.5)
-            path.moveTo(x, COMMIT_GRAPH_HEIGHT / 2)
-            path.lineTo(x2, COMMIT_GRAPH_HEIGHT)
-        pen = QPen()
-        pen.setWidth(PEN_WIDTH)
-        pen.setBrush(palette.color(QPalette.ColorRole.WindowText))
-        qp.setPen(pen)
-        qp.drawPath(path)
-
-        col = commit["commitColumn"]
-        y = int(COMMIT_GRAPH_HEIGHT / 2)
-        x = int(RADIUS + COL_SPACING * col)
-        color = COLORS[col]
-        qp.setPen(color)
-        qp.setBrush(color)
-        qp.drawEllipse(QPoint(x, y), RADIUS, RADIUS)
-        qp.end()
-
-        return image
+    def _scrolled(self, value):
+        # load the next page before the end of the loaded commits is reached
+        scrollBar = self.verticalScrollBar()
+        if value >= scrollBar.maximum() - scrollBar.pageStep():
+            self._fetchMatching(self._applyFilter() + 1)
+
+    def _itemClicked(self, item, column):
+        if item is self.moreItem:
+            self._fetchMatching(self._applyFilter() + 1)
+
+    def closePager(self):
+        if self.pager is not None:
+            self.pager.close()
+            self.pager = None
 
     def filterCommits(self, text=None, startDate=None, endDate=None):
         self.filterText = text or self.filterText
         self.startDate = startDate or self.startDate
         self.endDate = endDate or self.endDate
         self.filterText = self.filterText.strip(" ").lower()
+        self._fetchMatching(MIN_FILTERED_COMMITS)
+
+    def _fetchMatching(self, count):
+        """
+        Loads pages of the log until count commits match the filter, there
+        are no more or MAX_FILTER_PAGES were loaded. The filter only sees the
+        loaded pages, and with too few matches there is no scrollbar to load
+        more by scrolling, so an item to load more is added at the end while
+        some commits are hidden.
+        """
+        for _ in range(MAX_FILTER_PAGES):
+            if self._applyFilter() >= count or self.pager is None or not self.pager.hasMore():
+                break
+            loaded = len(self.log)
+            self.fetchMore()
+            if len(self.log) == loaded:
+                # the page could not be read
+                break
+        if self.pager is not None and self.pager.hasMore() and self._applyFilter() < len(self.log):
+            if self.moreItem is None:
+                # added as the last top level item
+                self.moreItem = MoreCommitsItem(self)
+        else:
+            self._removeMoreItem()
+
+    def _removeMoreItem(self):
+        if self.moreItem is not None:
+            self.takeTopLevelItem(self.indexOfTopLevelItem(self.moreItem))
+            self.moreItem = None
+
+    def _applyFilter(self):
+        """
+        Hides the loaded commits not matching the filter, and returns the
+        number of those shown
+        """
+        shown = 0
         root = self.invisibleRootItem()
         for i in range(root.childCount()):
             item = root.child(i)
@@ -457,25 +482,121 @@ class HistoryTree(QTreeWidget):
                 withinDates = date >= self.startDate and date <= self.endDate
                 hide = hide or not withinDates
                 item.setHidden(hide)
+                shown += not hide
+        return shown
 
 
-class GraphWidget(QWidget):
-    def __init__(self, img):
-        QWidget.__init__(self)
-        self.setFixedWidth(img.width())
-        self.img = img
+def graphPixmap(signature, color, devicePixelRatio):
+    """
+    Paints the graph of a commit row, given its lane signature
+    """
+    column, up, down = signature
+    # edge coordinates are in half columns
+    halfColumns = max([2 * column] + [x for edge in up + down for x in edge])
+    width = COL_SPACING * halfColumns / 2 + 2 * RADIUS + PEN_WIDTH
+    pixmap = QPixmap(int(width * devicePixelRatio), int(COMMIT_GRAPH_HEIGHT * devicePixelRatio))
+    pixmap.setDevicePixelRatio(devicePixelRatio)
+    pixmap.fill(Qt.GlobalColor.transparent)
+    qp = QPainter(pixmap)
+    qp.setRenderHint(QPainter.RenderHint.Antialiasing)
+
+    path = QPainterPath()
+    for top, middle in up:
+        path.moveTo(RADIUS + COL_SPACING * top / 2, 0)
+        path.lineTo(RADIUS + COL_SPACING * middle / 2, COMMIT_GRAPH_HEIGHT / 2)
+    for middle, bottom in down:
+        path.moveTo(RADIUS + COL_SPACING * middle / 2, COMMIT_GRAPH_HEIGHT / 2)
+        path.lineTo(RADIUS + COL_SPACING * bottom / 2, COMMIT_GRAPH_HEIGHT)
+    pen = QPen()
+    pen.setWidth(PEN_WIDTH)
+    pen.setBrush(color)
+    qp.setPen(pen)
+    qp.drawPath(path)
+
+    dotColor = COLORS[column % len(COLORS)]
+    qp.setPen(dotColor)
+    qp.setBrush(dotColor)
+    qp.drawEllipse(QPointF(RADIUS + COL_SPACING * column, COMMIT_GRAPH_HEIGHT / 2), RADIUS, RADIUS)
+    qp.end()
+
+    return pixmap
+
+
+class GraphDelegate(QStyledItemDelegate):
+    """
+    Paints the commit graph cells of the history tree as they are shown.
 
-    def paintEvent(self, e):
-        painter = QPainter(self)
-        # painter.begin(self);
-        painter.drawImage(0, 0, self.img)
-        painter.end()
+    Many rows share the same lanes, so pixmaps are kept in a bounded LRU
+    cache keyed by the lane signature of the row.
+    """
+
+    MAX_CACHED_PIXMAPS = 256
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._pixmaps = OrderedDict()
+
+    def paint(self, painter, option, index):
+        super().paint(painter, option, index)
+        signature = index.data(Qt.ItemDataRole.UserRole)
+        if signature is None:
+            return
+        pixmap = self.pixmap(
+            signature,
+            option.palette.color(QPalette.ColorRole.WindowText),
+            painter.device().devicePixelRatioF(),
+        )
+        y = option.rect.top() + (option.rect.height() - COMMIT_GRAPH_HEIGHT) // 2
+        painter.drawPixmap(option.rect.left(), y, pixmap)
+
+    def sizeHint(self, option, index):
+        size = super().sizeHint(option, index)
+        size.setHeight(max(size.height(), COMMIT_GRAPH_HEIGHT))
+        return size
+
+    def pixmap(self, signature, color, devicePixelRatio):
+        key = (signature, color.rgba(), devicePixelRatio)
+        pixmap = self._pixmaps.get(key)
+        if pixmap is not None:
+            self._pixmaps.move_to_end(key)
+            return pixmap
+        pixmap = graphPixmap(signature, color, devicePixelRatio)
+        self._pixmaps[key] = pixmap
+        if len(self._pixmaps) > self.MAX_CACHED_PIXMAPS:
+            self._pixmaps.popitem(last=False)
+        return pixmap
 
 
 class CommitTreeItem(QTreeWidgetItem):
     def __init__(self, commit, parent):
         QTreeWidgetItem.__init__(self, parent)
         self.commit = commit
+        graph = commit["graph"]
+        # the lane signature of the row, which the graph delegate paints
+        self.setData(
+            0,
+            Qt.ItemDataRole.UserRole,
+            (commit["commitColumn"], tuple(graph["up"]), tuple(graph["down"])),
+        )
+        self.refsLabel = QLabel()
+        self.refsLabel.setStyleSheet("QLabel {padding-left: 15px;}")
+        parent.setItemWidget(self, 1, self.refsLabel)
+        self.updateRefs()
+        self.setText(2, commit["message"].splitlines()[0])
+        self.setText(3, commit["authorName"])
+        self.setText(4, commit["authorTime"])
+        self.setText(5, commit["abbrevCommit"])
+
+    def addRef(self, ref):
+        self.commit["refs"].append(ref)
+        self.updateRefs()
+
+    def removeRef(self, ref):
+        self.commit["refs"].remove(ref)
+        self.updateRefs()
+
+    def updateRefs(self):
+        commit = self.commit
         if commit["refs"]:
             labelslist = []
             for label in commit["refs"]:
@@ -502,13 +623,7 @@ class CommitTreeItem(QTreeWidgetItem):
                 labels = ""
         else:
             labels = ""
-        qlabel = QLabel(labels)
-        qlabel.setStyleSheet("QLabel {padding-left: 15px;}")
-        parent.setItemWidget(self, 1, qlabel)
-        self.setText(2, commit["message"].splitlines()[0])
-        self.setText(3, commit["authorName"])
-        self.setText(4, commit["authorTime"])
-        self.setText(5, commit["abbrevCommit"])
+        self.refsLabel.setText(labels)
 
 
 WIDGET, BASE = uic.loadUiType(os.path.join(os.path.dirname(__file__), "historyviewer.ui"))
@@ -524,6 +639,13 @@ class ShallowCloneWarningItem(QTreeWidgetItem):
         self.setForeground(2, QBrush(QColor(100, 100, 100)))
 
 
+class MoreCommitsItem(QTreeWidgetItem):
+    def __init__(self, parent):
+        QTreeWidgetItem.__init__(self, parent)
+        self.setText(2, tr("Click to search older commits"))
+        self.setForeground(2, QBrush(QColor(100, 100, 100)))
+
+
 class HistoryDialog(WIDGET, BASE):
     def __init__(self, repo, dataset=None):
         super(HistoryDialog, self).__init__(iface.mainWindow())
@@ -545,9 +667,15 @@ class HistoryDialog(WIDGET, BASE):
         layout.addWidget(self.history)
         self.frameHistory.setLayout(layout)
         self.history.currentItemChanged.connect(self.commitSelected)
-        self.txtFilter.textChanged.connect(self._filterCommmits)
+        # the filter may load more of the log, so it waits for typing to pause
+        self.filterTimer = QTimer(self)
+        self.filterTimer.setSingleShot(True)
+        self.filterTimer.setInterval(FILTER_DELAY_MS)
+        self.filterTimer.timeout.connect(self._filterCommmits)
+        self.txtFilter.textChanged.connect(lambda _: self.filterTimer.start())
         self.dateEditStart.valueChanged.connect(self._filterCommmits)
         self.dateEditEnd.valueChanged.connect(self._filterCommmits)
+        self.finished.connect(self.history.closePager)
         self.resize(1024, 768)
 
     def commitSelected(self, new, old):
@@ -562,7 +690,7 @@ class HistoryDialog(WIDGET, BASE):
             html = ""
         self.commitDetails.setHtml(html)
 
-    def _filterCommmits(self, value):
+    def _filterCommmits(self, value=None):
         startDate = self.dateEditStart.date()
         endDate = self.dateEditEnd.date()
         self.history.filterCommits(self.txtFilter.text(), startDate, endDate)
@@ -17,7 +17,7 @@ class MergeDialog(BASE, WIDGET):
         self.retranslateUi()
 
         self.comboTag.addItems(repo.tags())
-        self.comboBranch.addItems(repo.branches())
+        self.comboBranch.addItems(repo.snapshot().branches)
 
         self.radioBranch.toggled.connect(self.buttonToggled)
         self.radioTag.toggled.connect(self.buttonToggled)
@@ -46,7 +46,7 @@ class PullDialog(BASE, WIDGET):
         self.comboBranch.clear()
         remotes = self.repo.remotes().keys()
         self.comboRemote.addItems(remotes)
-        branches = self.repo.branches()
+        branches = self.repo.snapshot().branches
         self.comboBranch.addItems(branches)
 
     def okClicked(self):
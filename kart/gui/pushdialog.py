@@ -47,7 +47,7 @@ class PushDialog(BASE, WIDGET):
         self.comboBranch.clear()
         remotes = self.repo.remotes().keys()
         self.comboRemote.addItems(remotes)
-        branches = self.repo.branches()
+        branches = self.repo.snapshot().branches
         self.comboBranch.addItems(branches)
 
     def checkPushAllStateChanged(self):
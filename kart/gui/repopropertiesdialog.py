@@ -68,7 +68,7 @@ class RepoPropertiesDialog(BASE, WIDGET):
         else:
             extent = None
         self.repo.setSpatialFilter(extent)
-        LayerTracker.instance().updateRubberBands()
+        LayerTracker.instance().updateRepoOverlay(self.repo)
         self.accept()
 
     def showBoundingBoxStateChanged(self, _):
@@ -7,14 +7,23 @@ from qgis.utils import iface
 
 from kart.utils import (
     AUTOCOMMIT,
+    AUTOMERGE,
+    AUTOMERGEGEOMETRY,
+    AUTOMERGETIMESTAMPFIELD,
     CURRENT_COLOR_ADDED,
     CURRENT_COLOR_MODIFIED,
     CURRENT_COLOR_REMOVED,
     CURRENT_COLOR_UNCHANGED,
+    DEFAULT_DIFF_WARNING_SIZE,
+    DEFAULT_VERTEX_DIFF_TOLERANCE,
     DIFFSTYLES,
+    DIFFWARNINGSIZE,
+    DIFFWORKERS,
     HELPERMODE,
     KARTPATH,
     PALETTES,
+    PARALLELDIFF,
+    VERTEXDIFFTOLERANCE,
     setSetting,
     setting,
     tr,
@@ -43,6 +52,12 @@ class SettingsDialog(BASE, WIDGET):
         self.comboDiffStyles.clear()
         self.comboDiffStyles.addItems(PALETTES.keys())
 
+        # no rule, or the version whose geometry is kept
+        self.comboAutoMergeGeometry.clear()
+        self.comboAutoMergeGeometry.addItem(tr("Leave the conflict"), "")
+        self.comboAutoMergeGeometry.addItem(tr("Keep ours"), "ours")
+        self.comboAutoMergeGeometry.addItem(tr("Keep theirs"), "theirs")
+
         self.setValues()
 
     def setValues(self):
@@ -53,6 +68,29 @@ class SettingsDialog(BASE, WIDGET):
         self.chkHelperMode.setChecked(setting(HELPERMODE))
         self.chkAutoCommit.setChecked(setting(AUTOCOMMIT))
         self.txtKartPath.setText(setting(KARTPATH))
+        self.chkParallelDiff.setChecked(setting(PARALLELDIFF))
+        try:
+            self.spinDiffWorkers.setValue(int(setting(DIFFWORKERS) or 0))
+        except ValueError:
+            self.spinDiffWorkers.setValue(0)
+        warningSize = setting(DIFFWARNINGSIZE)
+        try:
+            self.spinDiffWarningSize.setValue(
+                DEFAULT_DIFF_WARNING_SIZE if warningSize is None else int(warningSize)
+            )
+        except ValueError:
+            self.spinDiffWarningSize.setValue(DEFAULT_DIFF_WARNING_SIZE)
+        tolerance = setting(VERTEXDIFFTOLERANCE)
+        try:
+            self.spinVertexDiffTolerance.setValue(
+                DEFAULT_VERTEX_DIFF_TOLERANCE if tolerance is None else float(tolerance)
+            )
+        except ValueError:
+            self.spinVertexDiffTolerance.setValue(DEFAULT_VERTEX_DIFF_TOLERANCE)
+        self.chkAutoMerge.setChecked(setting(AUTOMERGE))
+        index = self.comboAutoMergeGeometry.findData(setting(AUTOMERGEGEOMETRY) or "")
+        self.comboAutoMergeGeometry.setCurrentIndex(max(index, 0))
+        self.txtAutoMergeTimestampField.setText(setting(AUTOMERGETIMESTAMPFIELD) or "")
 
     def browse(self, textbox):
         folder = QFileDialog.getExistingDirectory(iface.mainWindow(), tr("Select Folder"), "")
@@ -66,6 +104,13 @@ class SettingsDialog(BASE, WIDGET):
         setSetting(HELPERMODE, self.chkHelperMode.isChecked())
         setSetting(AUTOCOMMIT, self.chkAutoCommit.isChecked())
         setSetting(DIFFSTYLES, selected_style)
+        setSetting(PARALLELDIFF, self.chkParallelDiff.isChecked())
+        setSetting(DIFFWORKERS, self.spinDiffWorkers.value())
+        setSetting(DIFFWARNINGSIZE, self.spinDiffWarningSize.value())
+        setSetting(VERTEXDIFFTOLERANCE, self.spinVertexDiffTolerance.value())
+        setSetting(AUTOMERGE, self.chkAutoMerge.isChecked())
+        setSetting(AUTOMERGEGEOMETRY, self.comboAutoMergeGeometry.currentData())
+        setSetting(AUTOMERGETIMESTAMPFIELD, self.txtAutoMergeTimestampField.text().strip())
 
         # Deploy colors from selected palette to current settings
         if selected_style in PALETTES:
@@ -99,3 +144,27 @@ class SettingsDialog(BASE, WIDGET):
         # Diff Styles Section
         self.groupBox_2.setTitle(tr("Diff styles"))
         self.label.setText(tr("Styles to use for geometry diffs"))
+
+        # Diff Performance Section
+        self.groupBox_4.setTitle(tr("Diff performance"))
+        self.chkParallelDiff.setText(tr("Compute the diff of each dataset in parallel"))
+        self.labelDiffWorkers.setText(tr("Maximum number of Kart processes"))
+        self.spinDiffWorkers.setSpecialValueText(tr("Number of CPUs"))
+        self.labelDiffWarningSize.setText(
+            tr("Confirm before showing diffs with more changed features than")
+        )
+        self.spinDiffWarningSize.setSpecialValueText(tr("Never"))
+        self.labelVertexDiffTolerance.setText(
+            tr("Distance under which vertices are taken as the same one in vertex diffs")
+        )
+        self.spinVertexDiffTolerance.setSpecialValueText(tr("Exact"))
+
+        # Merge Conflicts Section
+        self.groupBox_5.setTitle(tr("Merge conflicts"))
+        self.chkAutoMerge.setText(
+            tr("Solve conflicts automatically when the versions changed different attributes")
+        )
+        self.labelAutoMergeGeometry.setText(tr("When both versions changed the geometry"))
+        self.labelAutoMergeTimestampField.setText(
+            tr("Attribute with the edit time (the newest version wins)")
+        )
@@ -21,7 +21,7 @@ class SwitchDialog(BASE, WIDGET):
         # Initialize translations for UI elements defined in the .ui file
         self.retranslateUi()
 
-        self.comboBranch.addItems(repo.branches())
+        self.comboBranch.addItems(repo.snapshot().branches)
 
         self.btnCreateNew.clicked.connect(self.createNewClicked)
 
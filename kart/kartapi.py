@@ -1,24 +1,30 @@
 import json
 import os
-import re
 import subprocess
 import sys
 import tempfile
-from functools import wraps
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing, contextmanager
+from functools import partial, wraps
 from typing import Callable, List, Optional
 from urllib.parse import urlparse
 
 from qgis.core import (
     Qgis,
+    QgsApplication,
     QgsCoordinateReferenceSystem,
     QgsDataSourceUri,
+    QgsFeature,
+    QgsGeometry,
     QgsMessageOutput,
-    QgsProject,
     QgsRectangle,
     QgsReferencedRectangle,
+    QgsTask,
     QgsVectorLayer,
 )
-from qgis.PyQt.QtCore import Qt
+from qgis.PyQt.QtCore import QCoreApplication, QEventLoop, Qt, QThread, QTimer, pyqtSignal
 from qgis.PyQt.QtGui import QColor
 from qgis.PyQt.QtWidgets import (
     QApplication,
@@ -27,9 +33,12 @@ from qgis.PyQt.QtWidgets import (
 from qgis.utils import iface
 
 from kart import logging
+from kart.commitgraph import CommitGraph
+from kart.geojson import geometryFromGeojson, wkbGeometry
 from kart.gui.installationwarningdialog import InstallationWarningDialog
 from kart.gui.userconfigdialog import UserConfigDialog
-from kart.utils import HELPERMODE, KARTPATH, setSetting, setting, tr
+from kart.repocache import RepoCache, resolveRef
+from kart.utils import DIFFWORKERS, HELPERMODE, KARTPATH, PARALLELDIFF, setSetting, setting, tr
 
 MINIMUM_SUPPORTED_VERSION = "0.14.0"
 CURRENT_VERSION = "0.17.0"
@@ -43,6 +52,60 @@ class KartNotSupportedOperationException(Exception):
     pass
 
 
+# event loops running on the main thread while waiting for Kart
+_waitingLoops = 0
+# (function, args, kwargs) of the handlers deferred until they have finished
+_deferredCalls = []
+
+
+def _waitInLoop(loop):
+    """
+    Runs an event loop waiting for Kart to finish. The handlers fired
+    meanwhile that are marked with deferredDuringKartCalls run afterwards.
+    """
+    global _waitingLoops
+    _waitingLoops += 1
+    try:
+        # user input is held back so nothing can start another operation on
+        # the repository while this one is running, but the canvas and the
+        # rest of the UI keep repainting
+        loop.exec(QEventLoop.ProcessEventsFlag.ExcludeUserInputEvents)
+    finally:
+        _waitingLoops -= 1
+        if not _waitingLoops and _deferredCalls:
+            QTimer.singleShot(0, _runDeferredCalls)
+
+
+def _runDeferredCalls():
+    global _deferredCalls
+    if _waitingLoops:
+        # run when the loop started meanwhile finishes
+        return
+    calls, _deferredCalls = _deferredCalls, []
+    for f, args, kwargs in calls:
+        f(*args, **kwargs)
+
+
+def deferredDuringKartCalls(f):
+    """
+    Marks a handler of timers or queued signals that uses repositories.
+    If it fires while a Kart call is waited for on the main thread, which
+    processes events, it runs once the call has finished instead of in the
+    middle of the operation. Repeated calls with the same arguments are
+    run once.
+    """
+
+    @wraps(f)
+    def inner(*args, **kwargs):
+        if _waitingLoops:
+            if (f, args, kwargs) not in _deferredCalls:
+                _deferredCalls.append((f, args, kwargs))
+            return None
+        return f(*args, **kwargs)
+
+    return inner
+
+
 def executeskart(f):
     @wraps(f)
     def inner(*args):
@@ -200,11 +263,7 @@ def kartVersionDetails():
         return errtxt
 
 
-def executeKart(commands, path=None, jsonoutput=False, feedback=None):
-    commands.insert(0, kartExecutable())
-    if jsonoutput:
-        commands.append("-ojson")
-
+def _kartEnvironment():
     # The env PYTHONHOME/GDAL_DRIVER_PATH from QGIS can interfere with Kart.
     if not hasattr(executeKart, "env"):
         executeKart.env = os.environ.copy()
@@ -221,66 +280,1101 @@ def executeKart(commands, path=None, jsonoutput=False, feedback=None):
     executeKart.env["KART_POINT_CLOUD_VPCS"] = "1"
     executeKart.env["KART_RASTER_VRTS"] = "1"
 
+    return executeKart.env
+
+
+def _kartCommand(commands, jsonoutput=False):
+    commands = [kartExecutable()] + list(commands)
+    if jsonoutput:
+        commands.append("-ojson")
+    return commands
+
+
+class KartProcessPool:
+    """
+    Bounds, tracks and times the Kart processes run for a repository.
+
+    In helper mode the kart executable hands each command over to a warm,
+    long-lived helper process that Kart itself spawns and keeps alive, so
+    spawning `kart` stays cheap. What the plugin manages on top of that is how
+    many Kart processes run at once across all repositories, which of them
+    are still alive (so they can be killed), and how long each call takes.
+    The latencies outlive the pools, which are dropped when idle.
+    """
+
+    MAX_PROCESSES = max(2, QThread.idealThreadCount())
+    IDLE_TIMEOUT = 300  # seconds
+
+    _pools = {}
+    _poolsLock = threading.Lock()
+    # process slots shared by all the pools
+    _slots = threading.BoundedSemaphore(MAX_PROCESSES)
+    # path -> command -> (calls, total, max) latencies
+    _latencies = {}
+    _latenciesLock = threading.Lock()
+
+    @classmethod
+    def forPath(cls, path):
+        key = os.path.normpath(path) if path else ""
+        now = time.monotonic()
+        with cls._poolsLock:
+            # evict pools of repositories that have not been used for a while
+            for other, pool in list(cls._pools.items()):
+                if other != key and pool.isIdle(now):
+                    del cls._pools[other]
+            if key not in cls._pools:
+                cls._pools[key] = KartProcessPool(key)
+            return cls._pools[key]
+
+    @classmethod
+    def pools(cls):
+        with cls._poolsLock:
+            return list(cls._pools.values())
+
+    @classmethod
+    def killAll(cls):
+        for pool in cls.pools():
+            pool.kill()
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._processes = set()
+        self._lastUsed = time.monotonic()
+
+    def isIdle(self, now=None):
+        now = now or time.monotonic()
+        with self._lock:
+            return not self._processes and now - self._lastUsed > self.IDLE_TIMEOUT
+
+    @contextmanager
+    def slot(self):
+        """
+        Waits until there is a free process slot and holds it
+        """
+        with self._slots:
+            yield
+
+    def started(self, proc):
+        with self._lock:
+            self._processes.add(proc)
+            self._lastUsed = time.monotonic()
+
+    def finished(self, proc, command, elapsed):
+        with self._lock:
+            self._processes.discard(proc)
+            self._lastUsed = time.monotonic()
+        with self._latenciesLock:
+            latencies = self._latencies.setdefault(self.path, {})
+            calls, total, maximum = latencies.get(command, (0, 0.0, 0.0))
+            latencies[command] = (calls + 1, total + elapsed, max(maximum, elapsed))
+
+    def kill(self):
+        with self._lock:
+            processes = list(self._processes)
+        for proc in processes:
+            if proc.poll() is None:
+                proc.kill()
+
+    def runningProcesses(self):
+        with self._lock:
+            return len(self._processes)
+
+    def latencies(self):
+        """
+        Returns call count, mean and max latency (in ms) per Kart command
+        run for the repository
+        """
+        with self._latenciesLock:
+            latencies = dict(self._latencies.get(self.path, {}))
+        return {
+            command: {
+                "calls": calls,
+                "mean": total / calls * 1000,
+                "max": maximum * 1000,
+            }
+            for command, (calls, total, maximum) in latencies.items()
+        }
+
+
+def kartLatencies():
+    """
+    Returns call count, mean and max latency (in ms) per Kart command,
+    across all repositories
+    """
+    merged = {}
+    with KartProcessPool._latenciesLock:
+        latencies = [dict(stats) for stats in KartProcessPool._latencies.values()]
+    for pathLatencies in latencies:
+        for command, (calls, total, maximum) in pathLatencies.items():
+            mergedCalls, mergedTotal, mergedMaximum = merged.get(command, (0, 0.0, 0.0))
+            merged[command] = (
+                mergedCalls + calls,
+                mergedTotal + total,
+                max(mergedMaximum, maximum),
+            )
+    return {
+        command: {"calls": calls, "mean": total / calls * 1000, "max": maximum * 1000}
+        for command, (calls, total, maximum) in merged.items()
+    }
+
+
+def _commandName(commands):
+    # commands[0] is the executable, skip it and any leading option
+    return next((c for c in commands[1:] if not c.startswith("-")), "kart")
+
+
+def _runKart(commands, path=None, jsonoutput=False, feedback=None, processStarted=None):
+    """
+    Runs a fully prepared Kart command line to completion in the calling thread.
+
+    processStarted, if passed, is called with the Popen object as soon as the
+    process has been spawned, so it can be killed from another thread.
+    """
+    pool = KartProcessPool.forPath(path)
     try:
-        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
-        logging.debug(f"Command: {' '.join(commands)}")
-        # TODO - all of this should be replaced by useage of QgsTask which
-        #  will execute on a background thread. There are a number of
-        #  ways in which this can deadlock
-        with subprocess.Popen(
-            commands,
-            env=executeKart.env,
-            stdout=subprocess.PIPE,
-            stdin=subprocess.DEVNULL,
-            stderr=subprocess.PIPE,
-            universal_newlines=True,
-            # Decode as utf-8 rather than the locale codepage: Kart's JSON
-            # output is utf-8 (msgspec writes raw utf-8 bytes), so on a Windows
-            # cp1252 locale the old code silently corrupted non-ASCII data. Its
-            # human banner/progress text can still contain a stray codepage byte
-            # (e.g. a '»' = 0xbb), which is invalid utf-8 and previously crashed
-            # the reader thread under QGIS 4 / Python utf-8 mode (issue #137);
-            # errors="replace" tolerates those rare cosmetic bytes.
-            encoding="utf-8",
-            errors="replace",
-            cwd=path,
-        ) as proc:
+        with pool.slot():
+            return _runKartProcess(pool, commands, path, jsonoutput, feedback, processStarted)
+    except Exception as e:
+        logging.error(str(e))
+        raise KartException(str(e))
+
+
+def _openKartProcess(commands, path):
+    return subprocess.Popen(
+        commands,
+        env=executeKart.env,
+        stdout=subprocess.PIPE,
+        stdin=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        # Decode as utf-8 rather than the locale codepage: Kart's JSON
+        # output is utf-8 (msgspec writes raw utf-8 bytes), so on a Windows
+        # cp1252 locale the old code silently corrupted non-ASCII data. Its
+        # human banner/progress text can still contain a stray codepage byte
+        # (e.g. a '»' = 0xbb), which is invalid utf-8 and previously crashed
+        # the reader thread under QGIS 4 / Python utf-8 mode (issue #137);
+        # errors="replace" tolerates those rare cosmetic bytes.
+        encoding="utf-8",
+        errors="replace",
+        cwd=path,
+    )
+
+
+def _runKartProcess(pool, commands, path, jsonoutput, feedback, processStarted):
+    logging.debug(f"Command: {' '.join(commands)}")
+    start = time.monotonic()
+    with _openKartProcess(commands, path) as proc:
+        pool.started(proc)
+        try:
+            if processStarted is not None:
+                processStarted(proc)
             if feedback is not None:
+                # stdout is drained on its own thread, otherwise Kart can block
+                # writing to a full stdout pipe while we wait for stderr to close
                 output = []
+                reader = threading.Thread(target=lambda: output.extend(proc.stdout))
+                reader.start()
                 err = []
                 for line in proc.stderr:
                     feedback(line)
                     err.append(line)
-                for line in proc.stdout:
-                    output.append(line)
+                reader.join()
                 stdout = "".join(output)
                 stderr = "".join(err)
-                proc.communicate()  # need to get the returncode
+                proc.wait()  # need to get the returncode
             else:
                 stdout, stderr = proc.communicate()
-            logging.debug(f"Command output: {stdout}")
-            if proc.returncode:
-                raise KartException(stderr)
-            if jsonoutput:
-                return json.loads(stdout)
+        finally:
+            elapsed = time.monotonic() - start
+            pool.finished(proc, _commandName(commands), elapsed)
+        logging.debug(f"Command finished in {elapsed * 1000:.0f} ms. Output: {stdout}")
+        if proc.returncode:
+            raise KartException(stderr)
+        if jsonoutput:
+            return json.loads(stdout)
+        else:
+            return stdout
+
+
+def executeKartLines(commands, path=None):
+    """
+    Runs a Kart command and yields the lines of its output as they are
+    written, so outputs larger than memory can be consumed.
+
+    The lines are read on the calling thread, so from the main thread this
+    is better used through readKartLines. The process keeps one of the
+    repository's process slots until the generator is exhausted or closed.
+    Closing it early kills the process.
+    """
+    _kartEnvironment()
+    return _kartLines(_kartCommand(commands), path)
+
+
+def _kartLines(commands, path, processStarted=None):
+    pool = KartProcessPool.forPath(path)
+    with pool.slot():
+        logging.debug(f"Command: {' '.join(commands)}")
+        start = time.monotonic()
+        try:
+            proc = _openKartProcess(commands, path)
+        except OSError as e:
+            logging.error(str(e))
+            raise KartException(str(e))
+        pool.started(proc)
+        if processStarted is not None:
+            processStarted(proc)
+        # stderr is drained on its own thread, so Kart never blocks on a full pipe
+        err = []
+        reader = threading.Thread(target=lambda: err.extend(proc.stderr))
+        reader.start()
+        try:
+            for line in proc.stdout:
+                yield line.rstrip("\n")
+            proc.wait()
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+            reader.join()
+            proc.stdout.close()
+            proc.stderr.close()
+            elapsed = time.monotonic() - start
+            pool.finished(proc, _commandName(commands), elapsed)
+        logging.debug(f"Command finished in {elapsed * 1000:.0f} ms")
+        if proc.returncode:
+            logging.error("".join(err))
+            raise KartException("".join(err))
+
+
+def _isMainThread():
+    app = QCoreApplication.instance()
+    return app is not None and QThread.currentThread() == app.thread()
+
+
+class KartTask(QgsTask):
+    """
+    Runs a Kart command on a background thread.
+
+    The task doubles as a future: once it has finished, result() returns the
+    command output (parsed if jsonoutput was set) or raises the KartException
+    that made it fail. Callbacks passed to onFinished/onError are called on the
+    main thread. Cancelling the task kills the Kart process.
+    """
+
+    outputLine = pyqtSignal(str)
+
+    def __init__(
+        self,
+        commands,
+        path=None,
+        jsonoutput=False,
+        feedback=None,
+        description=None,
+        hidden=False,
+    ):
+        flags = QgsTask.Flag.CanCancel
+        if hidden and hasattr(QgsTask.Flag, "Hidden"):
+            # short lived calls are kept out of the task manager UI (QGIS >= 3.26)
+            flags |= QgsTask.Flag.Hidden
+        super().__init__(description or f"Kart {' '.join(commands[:1])}", flags)
+        self.commands = _kartCommand(commands, jsonoutput)
+        self.path = path
+        self.jsonoutput = jsonoutput
+        self.feedback = feedback
+        self._result = None
+        self._exception = None
+        self._done = False
+        self._process = None
+        self._finishedCallbacks = []
+        self._errorCallbacks = []
+        if feedback is not None:
+            # feedback handlers usually touch widgets, so lines are handed
+            # over to the main thread instead of being passed on directly
+            self.outputLine.connect(feedback)
+        _kartEnvironment()
+
+    def run(self):
+        if self.isCanceled():
+            self._exception = KartException(tr("Kart command was cancelled"))
+            return False
+        try:
+            self._result = _runKart(
+                self.commands,
+                self.path,
+                self.jsonoutput,
+                self.outputLine.emit if self.feedback is not None else None,
+                self._setProcess,
+            )
+            return True
+        except KartException as ex:
+            if self.isCanceled():
+                self._exception = KartException(tr("Kart command was cancelled"))
             else:
-                return stdout
-    except Exception as e:
-        logging.error(str(e))
-        raise KartException(str(e))
+                self._exception = ex
+            return False
+        finally:
+            self._process = None
+
+    def _setProcess(self, proc):
+        self._process = proc
+        if self.isCanceled():
+            proc.kill()
+
+    def cancel(self):
+        proc = self._process
+        if proc is not None and proc.poll() is None:
+            proc.kill()
+        super().cancel()
+
+    def finished(self, result):
+        self._done = True
+        if result:
+            for callback in self._finishedCallbacks:
+                callback(self._result)
+        else:
+            if self._exception is None:
+                self._exception = KartException(tr("Kart command was cancelled"))
+            for callback in self._errorCallbacks:
+                callback(self._exception)
+
+    def onFinished(self, callback):
+        """
+        Registers a callback to be called with the command output
+        """
+        self._finishedCallbacks.append(callback)
+        return self
+
+    def onError(self, callback):
+        """
+        Registers a callback to be called with the KartException if the command fails
+        """
+        self._errorCallbacks.append(callback)
+        return self
+
+    def isDone(self):
+        return self._done
+
+    def result(self):
+        """
+        Returns the command output, blocking (while processing events) until
+        the command has finished
+        """
+        self.waitForDone()
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self):
+        self.waitForDone()
+        return self._exception
+
+    def waitForDone(self):
+        if self._done:
+            return
+        loop = QEventLoop()
+        self.onFinished(lambda _: loop.quit())
+        self.onError(lambda _: loop.quit())
+        _waitInLoop(loop)
+
+
+class KartBatchTask(KartTask):
+    """
+    Runs a list of Kart commands one after the other on a background
+    thread, as a single task reporting the progress made through them.
+
+    Each step is a command and the commands to run instead if it fails
+    (e.g. one per item, for Kart versions that take a single item), and is
+    weighted by the number of those. Cancelling the task kills the running
+    command and skips the rest. result() returns the outputs of the
+    commands run.
+    """
+
+    def __init__(self, steps, path=None, description=None):
+        super().__init__([], path, description=description)
+        self.steps = [
+            (_kartCommand(command), [_kartCommand(fallback) for fallback in fallbacks])
+            for command, fallbacks in steps
+        ]
+
+    def run(self):
+        outputs = []
+        total = sum(max(1, len(fallbacks)) for _, fallbacks in self.steps) or 1
+        done = 0
+        try:
+            for command, fallbacks in self.steps:
+                try:
+                    outputs.append(self._runCommand(command))
+                except KartException:
+                    if not fallbacks or self.isCanceled():
+                        raise
+                    for fallback in fallbacks:
+                        outputs.append(self._runCommand(fallback))
+                done += max(1, len(fallbacks))
+                self.setProgress(100 * done / total)
+            self._result = outputs
+            return True
+        except KartException as ex:
+            if self.isCanceled():
+                self._exception = KartException(tr("Kart command was cancelled"))
+            else:
+                self._exception = ex
+            return False
+        finally:
+            self._process = None
+
+    def _runCommand(self, command):
+        if self.isCanceled():
+            raise KartException(tr("Kart command was cancelled"))
+        return _runKart(command, self.path, False, None, self._setProcess)
+
+
+class KartLinesTask(KartTask):
+    """
+    Runs a Kart command on a background thread, passing the lines of its
+    output to consume, on that thread too, as they are written. result()
+    returns what consume returns, so large outputs are never read whole.
+    """
+
+    def __init__(self, commands, consume, path=None, description=None, hidden=False):
+        super().__init__(commands, path, description=description, hidden=hidden)
+        self.consume = consume
+
+    def run(self):
+        if self.isCanceled():
+            self._exception = KartException(tr("Kart command was cancelled"))
+            return False
+        try:
+            with closing(_kartLines(self.commands, self.path, self._setProcess)) as lines:
+                self._result = self.consume(lines)
+            return True
+        except (KartException, ValueError) as ex:
+            if self.isCanceled():
+                self._exception = KartException(tr("Kart command was cancelled"))
+            else:
+                self._exception = KartException(str(ex))
+            return False
+        finally:
+            self._process = None
+
+
+def executeKartAsync(
+    commands,
+    path=None,
+    jsonoutput=False,
+    onFinished=None,
+    onError=None,
+    feedback=None,
+    description=None,
+    hidden=False,
+):
+    """
+    Starts a Kart command on a background thread and returns its KartTask.
+    """
+    task = KartTask(commands, path, jsonoutput, feedback, description, hidden)
+    if onFinished is not None:
+        task.onFinished(onFinished)
+    if onError is not None:
+        task.onError(onError)
+    QgsApplication.taskManager().addTask(task)
+    return task
+
+
+def executeKart(commands, path=None, jsonoutput=False, feedback=None):
+    if not _isMainThread():
+        # already running in the background (e.g. a processing algorithm)
+        _kartEnvironment()
+        return _runKart(_kartCommand(commands, jsonoutput), path, jsonoutput, feedback)
+
+    try:
+        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+        task = executeKartAsync(commands, path, jsonoutput, feedback=feedback, hidden=True)
+        return task.result()
+    finally:
+        QApplication.restoreOverrideCursor()
+
+
+def readKartLines(commands, consume, path=None):
+    """
+    Runs a Kart command and returns what consume returns for the lines of
+    its output. As with executeKart, the command runs in a KartLinesTask
+    when called from the main thread, so the output is read (and consumed)
+    off it, while events keep being processed.
+    """
+    if not _isMainThread():
+        with closing(executeKartLines(commands, path)) as lines:
+            return consume(lines)
+
+    try:
+        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+        task = KartLinesTask(commands, consume, path, hidden=True)
+        QgsApplication.taskManager().addTask(task)
+        return task.result()
     finally:
         QApplication.restoreOverrideCursor()
 
 
+def _datasetsFromMeta(meta):
+    vectorLayers = []
+    tables = []
+    for name, dataset in meta.items():
+        crsProps = [k for k in dataset.keys() if k.startswith("crs/")]
+        if crsProps:
+            vectorLayers.append(name)
+        else:
+            tables.append(name)
+    return vectorLayers, tables
+
+
+def _branchesFromJson(branchJson):
+    branches = list(branchJson.values())[0]["branches"]
+    return list(b.split("->")[-1].strip() for b in branches.keys())
+
+
+def _changesFromStatus(status):
+    return (list(status.values())[0].get("workingCopy") or {}).get("changes") or {}
+
+
+def _diffRange(refa=None, refb=None, mergeBase=True):
+    """
+    Returns the range of commits compared by a diff from refb to refa. With
+    mergeBase, only the changes made in refa since the merge base of both
+    (a three-dot range, as for reviewing a branch); otherwise, everything
+    that differs between both (a two-dot range, as `diff refb refa`).
+    """
+    if refa and refb:
+        return f"{refb}...{refa}" if mergeBase else f"{refb}..{refa}"
+    return refa or "HEAD"
+
+
+def _diffColumns(schema):
+    """
+    Returns the names of the primary key and geometry columns of a schema
+    """
+    pkName = next((c["name"] for c in schema if c.get("primaryKeyIndex") == 0), None)
+    geomName = next((c["name"] for c in schema if c.get("dataType") == "geometry"), None)
+    return pkName, geomName
+
+
+def _geojsonFromDiffChange(dataset, change, pkName, geomName, wkbGeometries=False):
+    """
+    Converts a feature change from Kart's JSON lines diff (values keyed by
+    column name, geometries as hex WKB) to the features of the
+    geojson:extracompact diff format. With wkbGeometries, geometries are
+    left as WKB (see geojson.wkbGeometry) instead of converted to GeoJSON.
+    """
+    old, new = change.get("-"), change.get("+")
+    if old and new:
+        versions = [(old, "U-"), (new, "U+")]
+    elif new:
+        versions = [(new, "I")]
+    else:
+        versions = [(old, "D")]
+    features = []
+    for values, changetype in versions:
+        hexwkb = values.get(geomName) if geomName else None
+        if hexwkb and wkbGeometries:
+            geometry = wkbGeometry(bytes.fromhex(hexwkb))
+        elif hexwkb:
+            geom = QgsGeometry()
+            geom.fromWkb(bytes.fromhex(hexwkb))
+            geometry = json.loads(geom.asJson())
+        else:
+            geometry = None
+        features.append(
+            {
+                "type": "Feature",
+                "geometry": geometry,
+                "properties": {k: v for k, v in values.items() if k != geomName},
+                "id": f"{dataset}:feature:{values.get(pkName)}:{changetype}",
+            }
+        )
+    return features
+
+
+class RepoSnapshot:
+    """
+    The state of a repository as shown in the UI: current branch, branches,
+    working copy changes, config and datasets
+    """
+
+    def __init__(self, branchJson, status, config, meta, merging):
+        self.currentBranch = list(branchJson.values())[0]["current"]
+        self.branches = _branchesFromJson(branchJson)
+        self.changes = _changesFromStatus(status)
+        self.config = config
+        self.vectorDatasets, self.tables = _datasetsFromMeta(meta)
+        self.isMerging = merging
+
+    def datasets(self):
+        return self.vectorDatasets, self.tables
+
+    def isWorkingTreeClean(self):
+        return not bool(self.changes)
+
+
+# Scopes of the Repository caches, expired separately as the files behind them change
+CONFIG_CACHE = "config"
+BRANCHES_CACHE = "branches"
+LOG_CACHE = "log"
+STATUS_CACHE = "status"
+ALL_CACHES = (CONFIG_CACHE, BRANCHES_CACHE, LOG_CACHE, STATUS_CACHE)
+
+# conflict labels resolved by each Kart call
+RESOLVE_BATCH_SIZE = 200
+
+# decoded versions of features kept by each repository for their history
+MAX_CACHED_FEATURE_VERSIONS = 1000
+
+# above this number of changed features, layers are reloaded instead of
+# updating the changed features one by one
+MAX_TARGETED_REFRESH_FEATURES = 1000
+
+
+def diffWorkers():
+    """
+    Returns the number of Kart processes a parallel diff runs at once
+    """
+    try:
+        workers = int(setting(DIFFWORKERS) or 0)
+    except ValueError:
+        workers = 0
+    return workers if workers > 0 else QThread.idealThreadCount()
+
+
+class DatasetDiffs:
+    """
+    Runs the diff of each dataset in its own Kart process, at most workers
+    at a time, so the decoding of features done by Kart uses several cores.
+
+    Like KartTask, it doubles as a future: result() returns the diff as
+    {dataset: features}, as Repository.diff does. Callbacks passed to
+    onDataset are called on the main thread with each dataset and its
+    features as soon as its diff is done.
+    """
+
+    def __init__(self, repo, refa, refb, datasets, workers):
+        self.repo = repo
+        self.refa = refa
+        self.refb = refb
+        self.datasets = list(datasets)
+        self.workers = max(1, workers)
+        self._pending = list(datasets)
+        self._running = {}
+        self._results = {}
+        self._exception = None
+        self._done = False
+        self._datasetCallbacks = []
+        self._doneCallbacks = []
+
+    def start(self):
+        self._startNext()
+        return self
+
+    def _startNext(self):
+        while self._pending and len(self._running) < self.workers:
+            dataset = self._pending.pop(0)
+            commands = [
+                "diff",
+                "--output-format=geojson:extracompact",
+                _diffRange(self.refa, self.refb),
+                dataset,
+            ]
+            task = KartTask(commands, self.repo.path, hidden=True)
+            task.onFinished(partial(self._datasetFinished, dataset))
+            task.onError(partial(self._datasetFailed, dataset))
+            self._running[dataset] = task
+            QgsApplication.taskManager().addTask(task)
+        if not self._running and not self._done:
+            self._done = True
+            for callback in self._doneCallbacks:
+                callback()
+
+    def _datasetFinished(self, dataset, output):
+        self._running.pop(dataset, None)
+        features = json.loads(output)["features"]
+        self._results[dataset] = features
+        for callback in self._datasetCallbacks:
+            callback(dataset, features)
+        self._startNext()
+
+    def _datasetFailed(self, dataset, exception):
+        self._running.pop(dataset, None)
+        if self._exception is None:
+            self._exception = exception
+            self.cancel()
+        self._startNext()
+
+    def cancel(self):
+        self._pending = []
+        for task in list(self._running.values()):
+            task.cancel()
+
+    def onDataset(self, callback):
+        """
+        Registers a callback to be called with each dataset and its features
+        """
+        self._datasetCallbacks.append(callback)
+        return self
+
+    def onDone(self, callback):
+        """
+        Registers a callback to be called once all the datasets are done
+        """
+        self._doneCallbacks.append(callback)
+        return self
+
+    def isDone(self):
+        return self._done
+
+    def result(self):
+        """
+        Returns the diff of all the datasets, blocking (while processing
+        events) until they are done
+        """
+        if not self._done:
+            loop = QEventLoop()
+            self.onDone(loop.quit)
+            _waitInLoop(loop)
+        if self._exception is not None:
+            raise self._exception
+        return {name: self._results[name] for name in self.datasets if name in self._results}
+
+
+class DiffStream(KartLinesTask):
+    """
+    Reads a diff from a single Kart call on a background thread, handing it
+    over to the main thread in (dataset, features) chunks of about
+    chunkSize features as it is read, so the reader never holds more than
+    a chunk. Both versions of a modified feature always go in the same
+    chunk, and a dataset can come in several chunks. Features are as
+    returned by diff(), with geometries as WKB if wkbGeometries is set.
+
+    Like DatasetDiffs, callbacks passed to onDataset are called on the main
+    thread with each chunk, and the ones passed to onDone once the diff has
+    been read. Reading stops at the first schema change, and result()
+    returns whether there was one.
+    """
+
+    chunkRead = pyqtSignal(str, object)
+
+    def __init__(
+        self, repo, refa, refb, dataset=None, featureid=None, chunkSize=1000, wkbGeometries=False
+    ):
+        commands = repo._jsonLinesDiffCommands(refa, refb, dataset, featureid)
+        super().__init__(commands, self._readChunks, repo.path, hidden=True)
+        self.repo = repo
+        self.refa = refa
+        self.refb = refb
+        self.chunkSize = chunkSize
+        self.wkbGeometries = wkbGeometries
+        self._datasetCallbacks = []
+        self.chunkRead.connect(self._chunkRead)
+
+    def start(self):
+        QgsApplication.taskManager().addTask(self)
+        return self
+
+    def _readChunks(self, lines):
+        chunkDataset = None
+        chunk = []
+        hasSchemaChanges = False
+        items = self.repo._jsonLinesDiff(lines, self.refa, self.refb, self.wkbGeometries)
+        with closing(items):
+            for itemType, name, features in items:
+                if itemType == "schema":
+                    hasSchemaChanges = True
+                    break
+                if chunk and (name != chunkDataset or len(chunk) >= self.chunkSize):
+                    self.chunkRead.emit(chunkDataset, chunk)
+                    chunk = []
+                chunkDataset = name
+                chunk.extend(features)
+        if chunk:
+            self.chunkRead.emit(chunkDataset, chunk)
+        return hasSchemaChanges
+
+    def _chunkRead(self, dataset, features):
+        if self.isCanceled():
+            return
+        for callback in self._datasetCallbacks:
+            callback(dataset, features)
+
+    def onDataset(self, callback):
+        """
+        Registers a callback to be called with each dataset and chunk of its features
+        """
+        self._datasetCallbacks.append(callback)
+        return self
+
+    def onDone(self, callback):
+        """
+        Registers a callback to be called once the diff has been read
+        """
+        self.onFinished(lambda _: callback())
+        self.onError(lambda _: callback())
+        return self
+
+
+def _featureFromGeojson(geojson, fields):
+    feature = QgsFeature(fields)
+    geometry = geometryFromGeojson(geojson.get("geometry"))
+    if geometry is not None:
+        feature.setGeometry(geometry)
+    props = geojson["properties"]
+    for prop in props:
+        feature[prop] = props[prop]
+    return feature
+
+
+class FeatureHistory:
+    """
+    Fetches in the background the versions of a feature in the commits of
+    its log, so they are ready when the commits are selected. Only the
+    commits next to the selected one (or to the newest one, before any is
+    selected) are prefetched, however long the log is.
+
+    Kart has no command giving the versions of a feature across several
+    commits (log -p only shows the patches of the raw feature blobs), so the
+    diff of the feature in each commit runs in its own Kart process, at most
+    workers at a time. The decoded versions are cached by the repository per
+    (dataset, fid, commit), as commits never change, so showing the history
+    of a feature again takes no Kart calls.
+    """
+
+    # commits prefetched on each side of the selected one
+    PREFETCH_COMMITS = 5
+
+    def __init__(self, repo, dataset, fid, commits, fields, workers):
+        self.repo = repo
+        self.dataset = dataset
+        self.fid = fid
+        self.fields = fields
+        self.workers = max(1, workers)
+        self.commits = {commit["commit"]: commit for commit in commits}
+        self._ids = [commit["commit"] for commit in commits]
+        self._pending = []
+        self._running = {}
+        self._exceptions = {}
+        self._versionCallbacks = []
+
+    def _key(self, commitid):
+        return (self.dataset, str(self.fid), commitid)
+
+    def start(self):
+        if self._ids:
+            self._prefetchAround(self._ids[0])
+        self._startNext()
+        return self
+
+    def _prefetchAround(self, commitid):
+        """
+        Replaces the commits waiting to be prefetched with the ones next to a
+        commit in the log, nearest first
+        """
+        index = self._ids.index(commitid)
+        nearby = range(
+            max(0, index - self.PREFETCH_COMMITS),
+            min(len(self._ids), index + self.PREFETCH_COMMITS + 1),
+        )
+        self._pending = []
+        for i in sorted(nearby, key=lambda i: abs(i - index)):
+            if i == len(self._ids) - 1 and i > 0:
+                # the oldest version is read from the diff of the next commit
+                continue
+            nearbyid = self._ids[i]
+            if (
+                nearbyid not in self._running
+                and nearbyid not in self._exceptions
+                and self.repo._cachedFeatureVersions(self._key(nearbyid)) is None
+            ):
+                self._pending.append(nearbyid)
+
+    def _startNext(self):
+        while self._pending and len(self._running) < self.workers:
+            self._startCommit(self._pending.pop(0))
+
+    def _startCommit(self, commitid):
+        commit = self.commits[commitid]
+        # a root commit is compared to the empty tree
+        parent = commit["parents"][0] if commit["parents"] else "[EMPTY]"
+        commands = [
+            "diff",
+            "--output-format=geojson:extracompact",
+            _diffRange(parent, commitid),
+            f"{self.dataset}:{self.fid}",
+        ]
+        task = KartTask(commands, self.repo.path, hidden=True)
+        task.onFinished(partial(self._commitFinished, commitid))
+        task.onError(partial(self._commitFailed, commitid))
+        self._running[commitid] = task
+        QgsApplication.taskManager().addTask(task)
+
+    def _commitFinished(self, commitid, output):
+        self._running.pop(commitid, None)
+        features = json.loads(output)["features"]
+        if features:
+            versions = (
+                _featureFromGeojson(features[0], self.fields),
+                _featureFromGeojson(features[-1], self.fields),
+            )
+            self.repo._cacheFeatureVersions(self._key(commitid), versions)
+        else:
+            self._exceptions[commitid] = KartException(
+                tr("The feature was not changed in commit {commit}").format(commit=commitid)
+            )
+        for callback in self._versionCallbacks:
+            callback(commitid)
+        self._startNext()
+
+    def _commitFailed(self, commitid, exception):
+        self._running.pop(commitid, None)
+        self._exceptions[commitid] = exception
+        for callback in self._versionCallbacks:
+            callback(commitid)
+        self._startNext()
+
+    def cancel(self):
+        self._pending = []
+        for task in list(self._running.values()):
+            task.cancel()
+
+    def onVersions(self, callback):
+        """
+        Registers a callback to be called with the id of each commit whose
+        versions of the feature are fetched
+        """
+        self._versionCallbacks.append(callback)
+        return self
+
+    def versions(self, commitid):
+        """
+        Returns the new and old versions of the feature in a commit, as
+        QgsFeatures. If they are not fetched yet, they are fetched before the
+        other commits, blocking (while processing events) until they are.
+        """
+        key = self._key(commitid)
+        self._prefetchAround(commitid)
+        if self.repo._cachedFeatureVersions(key) is None and commitid not in self._exceptions:
+            if commitid not in self._running:
+                # started right away, ahead of the commits waiting to be prefetched
+                if commitid in self._pending:
+                    self._pending.remove(commitid)
+                self._startCommit(commitid)
+            self._startNext()
+            loop = QEventLoop()
+
+            def fetched(fetchedid):
+                if fetchedid == commitid:
+                    loop.quit()
+
+            self._versionCallbacks.append(fetched)
+            try:
+                _waitInLoop(loop)
+            finally:
+                self._versionCallbacks.remove(fetched)
+        if commitid in self._exceptions:
+            raise self._exceptions.pop(commitid)
+        versions = self.repo._cachedFeatureVersions(key)
+        # copies, as adding a feature to a layer changes it
+        return tuple(QgsFeature(feature) for feature in versions) if versions else None
+
+
+class LogPager:
+    """
+    Reads the log of a ref a page at a time. The graph layout is extended
+    with each page, so pages have to be read in order.
+
+    Commits come from the commit cache of the repo when it can be used, and
+    otherwise from Kart with --skip/-n.
+    """
+
+    def __init__(self, repo, ref="HEAD", dataset=None, featureid=None, pageSize=200):
+        self.repo = repo
+        self.ref = ref
+        self.pageSize = pageSize
+        self.loaded = 0
+        self._exhausted = False
+        if dataset is not None:
+            self.filters = ["--", f"{dataset}:{featureid}" if featureid is not None else dataset]
+        else:
+            self.filters = []
+        self.dataset = dataset
+        self.featureid = featureid
+        # the parents of the commits in a filtered log are often not in it
+        self.graph = CommitGraph(linear=dataset is not None)
+        # the ids of the commits in the log, if read from the commit cache
+        self._ids = None
+        self._cacheChecked = False
+
+    def hasMore(self):
+        return not self._exhausted
+
+    def nextPage(self):
+        """
+        Returns the next page of commits, or an empty list at the end of the log
+        """
+        if self._exhausted:
+            return []
+        commits = self._readCommits(self.loaded, self.pageSize)
+        self.loaded += len(commits)
+        self._exhausted = len(commits) < self.pageSize
+        return self.graph.layout(commits, last=self._exhausted)
+
+    def read(self, skip=0, limit=None):
+        """
+        Returns the commits in the given range of the log. The commits before
+        the range are read as well, since the graph layout depends on them.
+        """
+        commits = self._readCommits(0, None if limit is None else skip + limit)
+        self.graph.layout(commits, last=limit is None or len(commits) < skip + limit)
+        return commits[skip:]
+
+    def _readCommits(self, skip, limit):
+        cache = self.repo.commitCache()
+        if cache is not None and not self._cacheChecked:
+            # decided once, so all pages come in the same order; when the cache
+            # is not filled yet, the pages are read from Kart meanwhile
+            self._cacheChecked = True
+            maxNewCommits = None if limit is None else skip + limit
+            self._ids = cache.logIds(self.ref, self.dataset, self.featureid, maxNewCommits)
+        if self._ids is not None:
+            return cache.commits(self._ids[skip : None if limit is None else skip + limit])
+        commands = ["log", "-ojson", "--date-order", self.ref]
+        if skip:
+            commands.extend(["--skip", str(skip)])
+        if limit is not None:
+            commands.extend(["-n", str(limit)])
+        return json.loads(self.repo.executeKart(commands + self.filters))
+
+    def close(self):
+        """
+        Stops reading the log
+        """
+        self._exhausted = True
+
+
 class Repository:
     def __init__(self, path):
         self.path = path
         self.boundingBoxColor = QColor(150, 0, 0)
         self.showBoundingBox = True
+        self._snapshot = None
+        self._snapshotKey = None
+        self._commitCache = None
+        self._caches = {}
+        # (dataset, fid, commit) -> (new, old) versions of a feature, least recently used first
+        self._featureVersions = OrderedDict()
+        # set by a RepoWatcher while it watches the repo. Results of read-only
+        # commands are only cached while there is something to expire them
+        self.watcher = None
 
     def executeKart(self, commands, jsonoutput=False):
         return executeKart(commands, self.path, jsonoutput)
 
+    def executeKartAsync(self, commands, jsonoutput=False, onFinished=None, onError=None):
+        return executeKartAsync(commands, self.path, jsonoutput, onFinished, onError)
+
     @staticmethod
     def supportedDbTypes():
         formats = {
@@ -377,6 +1471,33 @@ class Repository:
     def _invalidateConfigCache(self):
         self._configDict = None
 
+    def isWatched(self):
+        return self.watcher is not None
+
+    def invalidateCaches(self, scopes=ALL_CACHES):
+        """
+        Expires the cached results in the given scopes (any of ALL_CACHES)
+        """
+        if CONFIG_CACHE in scopes:
+            self._invalidateConfigCache()
+        for scope in scopes:
+            self._caches.pop(scope, None)
+        self._snapshotKey = None
+
+    def _cached(self, scope, key, func):
+        if not self.isWatched():
+            return func()
+        if scope == STATUS_CACHE and not self.watcher.watchesWorkingCopy:
+            # edits saved to a working copy in a database server can't be noticed
+            return func()
+        entries = self._caches.setdefault(scope, {})
+        if key not in entries:
+            entries[key] = func()
+        return entries[key]
+
+    def _branchJson(self):
+        return self._cached(BRANCHES_CACHE, "branch", lambda: self.executeKart(["branch"], True))
+
     def _config(self):
         if self._configDict is None:
             ret = self.executeKart(["config", "-l"])
@@ -388,6 +1509,60 @@ class Repository:
                     self._configDict[tokens[0]] = tokens[1]
         return self._configDict
 
+    def _stateKey(self):
+        """
+        Returns a key that changes whenever the state gathered by snapshot()
+        may have changed, or None if that can't be told from the filesystem
+        (e.g. the working copy is in a database server)
+        """
+        kartFolder = os.path.join(self.path, ".kart")
+        headPath = os.path.join(kartFolder, "HEAD")
+        try:
+            with open(headPath) as f:
+                head = f.read().strip()
+        except OSError:
+            return None
+        paths = [
+            headPath,
+            os.path.join(kartFolder, "index"),
+            os.path.join(kartFolder, "config"),
+            os.path.join(kartFolder, "packed-refs"),
+            os.path.join(kartFolder, "MERGE_HEAD"),
+            os.path.join(kartFolder, "refs", "heads"),
+        ]
+        if head.startswith("ref:"):
+            paths.append(os.path.join(kartFolder, head[4:].strip()))
+        location = self._config().get("kart.workingcopy.location")
+        if location:
+            workingCopyPath = os.path.join(self.path, location)
+            if not os.path.isfile(workingCopyPath):
+                return None
+            paths.extend([workingCopyPath, f"{workingCopyPath}-wal"])
+        return tuple(os.stat(p).st_mtime_ns if os.path.exists(p) else None for p in paths)
+
+    def snapshot(self, useCache=True):
+        """
+        Returns a RepoSnapshot with the current state of the repo.
+
+        The Kart calls needed are run concurrently, and the result is reused
+        until the files under .kart (or the working copy file) change.
+        """
+        key = self._stateKey()
+        if useCache and key is not None and key == self._snapshotKey:
+            return self._snapshot
+        if not useCache:
+            self.invalidateCaches()
+        tasks = [
+            executeKartAsync(cmd, self.path, True, hidden=True) for cmd in (["branch"], ["status"])
+        ]
+        config = self._config()
+        meta = self.datasetsMeta()
+        branchJson, status = [task.result() for task in tasks]
+        self._snapshot = RepoSnapshot(branchJson, status, config, meta, self.isMerging())
+        # the key read before running Kart, so changes made meanwhile are not masked
+        self._snapshotKey = key
+        return self._snapshot
+
     def spatialFilter(self):
         configDict = self._config()
         if "kart.spatialfilter.geometry" in configDict:
@@ -403,7 +1578,7 @@ class Repository:
             self.executeKart(["checkout", "--spatial-filter", kartExtent])
         else:
             self.executeKart(["checkout", "--spatial-filter="])
-        self._invalidateConfigCache()
+        self.invalidateCaches([CONFIG_CACHE, STATUS_CACHE])
         self.updateCanvas()
 
     def isInitialized(self):
@@ -414,12 +1589,14 @@ class Repository:
             self.executeKart(["init", "--workingcopy", location])
         else:
             self.executeKart(["init"])
+        self.invalidateCaches()
 
     def importIntoRepo(self, source, dataset=None):
         importArgs = [source]
         if dataset:
             importArgs += ["--dataset", dataset]
         self.executeKart(["import"] + importArgs)
+        self.invalidateCaches()
 
     def checkUserConfigured(self):
         configDict = self._config()
@@ -436,6 +1613,7 @@ class Repository:
     def configureUser(self, name, email):
         self.executeKart(["config", "--global", "user.name", name])
         self.executeKart(["config", "--global", "user.email", email])
+        self.invalidateCaches([CONFIG_CACHE])
 
     def commit(self, msg, dataset=None):
         if self.checkUserConfigured():
@@ -443,81 +1621,98 @@ class Repository:
             if dataset is not None:
                 commands.append(dataset)
             self.executeKart(commands)
+            self.invalidateCaches([BRANCHES_CACHE, LOG_CACHE, STATUS_CACHE])
             return True
         else:
             return False
 
     def reset(self, ref="HEAD"):
+        head, changed = self._resolveRef("HEAD"), self._workingCopyDatasets()
         self.executeKart(["reset", ref, "-f"])
-        self.updateCanvas()
+        self.invalidateCaches()
+        self.updateCanvas(*self._canvasChanges(head, self._resolveRef("HEAD"), changed))
 
-    def log(self, ref="HEAD", dataset=None, featureid=None):
-        if dataset is not None:
-            if featureid is not None:
-                filt = f"{dataset}:{featureid}"
-            else:
-                filt = dataset
+    def log(self, ref="HEAD", dataset=None, featureid=None, skip=0, limit=None):
+        """
+        Returns the commits in the log of a ref, newest first, with their graph
+        layout. skip and limit select a page of it.
+        """
+        return self._cached(
+            LOG_CACHE,
+            (ref, dataset, featureid, skip, limit),
+            lambda: LogPager(self, ref, dataset, featureid).read(skip, limit),
+        )
 
-            commands = ["log", "-ojson", ref, "--", filt]
-        else:
-            commands = ["log", "-ojson", ref]
-        ret = self.executeKart(commands)
-        jsonRet = json.loads(ret)
-        log = {c["commit"]: c for c in jsonRet}
-        if dataset is not None:
-            commands = [
-                "log",
-                ref,
-                "--graph",
-                "-otext:%H%n",
-                "--",
-                filt,
-            ]
-        else:
-            commands = ["log", ref, "--graph", "-otext:%H%n"]
-        logb = self.executeKart(commands)
-        lines = logb.splitlines()
-        lines.insert(0, "")
-        lines.append("")
-        commitlinesidxs = []
-        for i, line in enumerate(lines):
-            if "*" in line:
-                commitlinesidxs.append(i)
-        commits = []
-        for commitlineidx in commitlinesidxs:
-            commitline = lines[commitlineidx]
-            commitid = commitline.split(" ")[-1]
-            log[commitid]["commitColumn"] = (commitline.index("*")) // 2
-            graph = []
-            for j in range(3):
-                graph.append({})
-                for char in [r"\|", "/", r"\\"]:
-                    line = lines[commitlineidx - 1 + j]
-                    matches = re.finditer(char, line)
-                    positions = [match.start() // 2 for match in matches]
-                    graph[j][char] = positions
-            log[commitid]["graph"] = graph
-            commits.append(log[commitid])
-        return commits
+    def commitCache(self):
+        """
+        Returns the on-disk cache of the commits of the repo
+        """
+        if self._commitCache is None and self.isInitialized():
+            self._commitCache = RepoCache(self)
+        return self._commitCache
+
+    def logPager(self, ref="HEAD", dataset=None, featureid=None, pageSize=200):
+        return LogPager(self, ref, dataset, featureid, pageSize)
+
+    def featureHistory(self, dataset, fid, commits, fields):
+        """
+        Starts fetching the versions of a feature in the given commits of its
+        log, decoded as features with the given fields, and returns the
+        FeatureHistory
+        """
+        return FeatureHistory(self, dataset, fid, commits, fields, diffWorkers()).start()
+
+    def _cachedFeatureVersions(self, key):
+        versions = self._featureVersions.get(key)
+        if versions is not None:
+            self._featureVersions.move_to_end(key)
+        return versions
+
+    def _cacheFeatureVersions(self, key, versions):
+        self._featureVersions[key] = versions
+        if len(self._featureVersions) > MAX_CACHED_FEATURE_VERSIONS:
+            self._featureVersions.popitem(last=False)
 
     def datasets(self):
-        vectorLayers = []
-        tables = []
-        meta = self.executeKart(["meta", "get"], True)
-        for name, dataset in meta.items():
-            crsProps = [k for k in dataset.keys() if k.startswith("crs/")]
-            if crsProps:
-                vectorLayers.append(name)
-            else:
-                tables.append(name)
-        return vectorLayers, tables
+        return _datasetsFromMeta(self.datasetsMeta())
+
+    def datasetsMeta(self, ref="HEAD"):
+        """
+        Returns the metadata of all the datasets at a ref, as given by
+        `meta get`, from the commit cache when it can be used (its database
+        connection belongs to the main thread)
+        """
+        cache = self.commitCache()
+        if cache is None or not _isMainThread():
+            return self.executeKart(["meta", "get", "--ref", ref], True)
+        return cache.meta(ref)
+
+    def datasetMeta(self, dataset, ref="HEAD"):
+        meta = self.datasetsMeta(ref).get(dataset)
+        if meta is None:
+            raise KartException(
+                tr("Dataset {dataset} does not exist at {ref}").format(dataset=dataset, ref=ref)
+            )
+        return meta
+
+    def diffDatasetMeta(self, dataset, refa=None, refb=None):
+        """
+        Returns the metadata of a dataset in the diff from refb to refa, read
+        at the newest of those commits that has it (e.g. the old one for a
+        deleted dataset), or at HEAD for working copy changes
+        """
+        refs = [ref for ref in (refa, refb) if ref and ref != "[EMPTY]"] or ["HEAD"]
+        for ref in refs[:-1]:
+            meta = self.datasetsMeta(ref).get(dataset)
+            if meta is not None:
+                return meta
+        return self.datasetMeta(dataset, refs[-1])
 
     def branches(self):
-        branches = list(self.executeKart(["branch"], True).values())[0]["branches"]
-        return list(b.split("->")[-1].strip() for b in branches.keys())
+        return _branchesFromJson(self._branchJson())
 
     def currentBranch(self):
-        branch = list(self.executeKart(["branch"], True).values())[0]["current"]
+        branch = list(self._branchJson().values())[0]["current"]
         return branch
 
     def checkoutBranch(self, branch, force=False):
@@ -525,14 +1720,20 @@ class Repository:
             commands = ["checkout", "--force", branch]
         else:
             commands = ["checkout", branch]
+        head, changed = self._resolveRef("HEAD"), self._workingCopyDatasets()
         self.executeKart(commands)
-        self.updateCanvas()
+        self.invalidateCaches()
+        self.updateCanvas(*self._canvasChanges(head, self._resolveRef("HEAD"), changed))
 
     def createBranch(self, branch, commit="HEAD"):
-        return self.executeKart(["branch", branch, commit])
+        ret = self.executeKart(["branch", branch, commit])
+        self.invalidateCaches([BRANCHES_CACHE, LOG_CACHE])
+        return ret
 
     def deleteBranch(self, branch):
-        return self.executeKart(["branch", "-d", branch])
+        ret = self.executeKart(["branch", "-d", branch])
+        self.invalidateCaches([BRANCHES_CACHE, LOG_CACHE])
+        return ret
 
     def mergeBranch(self, branch, msg="", noff=False, ffonly=False):
         commands = ["merge", branch, "--no-editor"]
@@ -542,33 +1743,39 @@ class Repository:
             commands.append("--no-ff")
         if ffonly:
             commands.append("--ff-only")
+        head = self._resolveRef("HEAD")
         ret = self.executeKart(commands, True)
-        self.updateCanvas()
+        self.invalidateCaches()
+        self.updateCanvas(*self._canvasChanges(head, self._resolveRef("HEAD")))
         return list(ret.values())[0].get("conflicts", [])
 
     def abortMerge(self):
-        return self.executeKart(["merge", "--abort"])
+        ret = self.executeKart(["merge", "--abort"])
+        self.invalidateCaches()
+        return ret
 
     def continueMerge(self):
-        return self.executeKart(["merge", "--continue", "-m", self.mergeMessage()])
+        head = self._resolveRef("HEAD")
+        ret = self.executeKart(["merge", "--continue", "-m", self.mergeMessage()])
+        self.invalidateCaches()
+        self.updateCanvas(*self._canvasChanges(head, self._resolveRef("HEAD")))
+        return ret
 
     def tags(self):
-        return self.executeKart(["tag"]).splitlines()
+        return self._cached(BRANCHES_CACHE, "tag", lambda: self.executeKart(["tag"]).splitlines())
 
     def createTag(self, tag, ref):
-        return self.executeKart(["tag", tag, ref])
+        ret = self.executeKart(["tag", tag, ref])
+        self.invalidateCaches([BRANCHES_CACHE, LOG_CACHE])
+        return ret
 
     def deleteTag(self, tag):
-        return self.executeKart(["tag", "-d", tag])
+        ret = self.executeKart(["tag", "-d", tag])
+        self.invalidateCaches([BRANCHES_CACHE, LOG_CACHE])
+        return ret
 
     def diffHasSchemaChanges(self, refa=None, refb=None, dataset=None):
-        commands = ["diff"]
-        if refa and refb:
-            commands.append(f"{refb}...{refa}")
-        elif refa:
-            commands.append(refa)
-        else:
-            commands.append("HEAD")
+        commands = ["diff", _diffRange(refa, refb)]
         if dataset is not None:
             commands.append(f"{dataset}:meta")
         else:
@@ -580,16 +1787,94 @@ class Repository:
         )
         return any(s is not None for s in schemaChanges)
 
+    def diffFeatureCounts(
+        self, refa=None, refb=None, dataset=None, accuracy="veryfast", mergeBase=True
+    ):
+        """
+        Returns the number of changed features of each dataset with changes,
+        estimated unless accuracy is "exact"
+        """
+        commands = [
+            "diff",
+            f"--only-feature-count={accuracy}",
+            _diffRange(refa, refb, mergeBase),
+        ]
+        if dataset is not None:
+            commands.append(dataset)
+        ret = self.executeKart(commands, True)
+        values = list(ret.values())
+        if len(values) == 1 and isinstance(values[0], dict):
+            # counts wrapped in the diff format name
+            return values[0]
+        return ret
+
+    def diffSummary(self, refa=None, refb=None, dataset=None):
+        """
+        Returns the number of changed features of each dataset with changes,
+        without reading the features, as
+        {dataset: {"inserts": n, "updates": n, "deletes": n, "total": n}}.
+
+        Kart only gives the total between commits, so the inserts, updates
+        and deletes are only there for the working copy changes (when no
+        refs are given), which come from the status. Those also include the
+        datasets with only schema or metadata changes, with the number of
+        changed metadata items as "meta".
+        """
+        summary = {}
+        if refa is None and refb is None:
+            for name, changes in self.changes().items():
+                if dataset is not None and name != dataset:
+                    continue
+                counts = {
+                    key: changes.get("feature", {}).get(key, 0)
+                    for key in ("inserts", "updates", "deletes")
+                }
+                counts["total"] = sum(counts.values())
+                meta = sum(changes.get("meta", {}).values())
+                if meta:
+                    counts["meta"] = meta
+                if counts["total"] or meta:
+                    summary[name] = counts
+        else:
+            for name, count in self.diffFeatureCounts(refa, refb, dataset, "exact").items():
+                if count:
+                    summary[name] = {"total": count}
+        return summary
+
+    def datasetDiffs(self, refa=None, refb=None, workers=None):
+        """
+        Starts the diff of each changed dataset in its own Kart process, and
+        returns the DatasetDiffs running them
+        """
+        datasets = sorted(self.diffFeatureCounts(refa, refb))
+        return DatasetDiffs(self, refa, refb, datasets, workers or diffWorkers()).start()
+
+    def diffForViewer(self, refa=None, refb=None, dataset=None):
+        """
+        Returns whether there are schema changes, and the diff to show in the
+        diff viewer, streamed to it as it is read: DatasetDiffs if the
+        parallel diff is enabled, otherwise a DiffStream. Schema changes are
+        checked first, from a diff of the datasets metadata only.
+        """
+        if self.diffHasSchemaChanges(refa, refb, dataset):
+            return True, {}
+        if setting(PARALLELDIFF) and dataset is None:
+            try:
+                return False, self.datasetDiffs(refa, refb)
+            except KartException:
+                pass
+        return False, self.diffStream(refa, refb, dataset, wkbGeometries=True)
+
     def diff(self, refa=None, refb=None, dataset=None, featureid=None):
         changes = {}
+        if dataset is None and setting(PARALLELDIFF) and _isMainThread():
+            try:
+                return self.datasetDiffs(refa, refb).result()
+            except KartException:
+                # e.g. Kart versions without feature counts
+                pass
         try:
-            commands = ["diff", "--output-format=geojson:extracompact"]
-            if refa and refb:
-                commands.append(f"{refb}...{refa}")
-            elif refa:
-                commands.append(refa)
-            else:
-                commands.append("HEAD")
+            commands = ["diff", "--output-format=geojson:extracompact", _diffRange(refa, refb)]
             if dataset is not None:
                 if featureid is not None:
                     commands.append(f"{dataset}:{featureid}")
@@ -612,20 +1897,101 @@ class Repository:
             pass
         return changes
 
+    def diffStream(
+        self,
+        refa=None,
+        refb=None,
+        dataset=None,
+        featureid=None,
+        chunkSize=1000,
+        wkbGeometries=False,
+    ):
+        """
+        Starts reading the diff in the background, and returns the DiffStream
+        handing it over in (dataset, features) chunks, with features in the
+        same form as the ones returned by diff()
+        """
+        return DiffStream(self, refa, refb, dataset, featureid, chunkSize, wkbGeometries).start()
+
+    def diffWithSchemaChanges(self, refa=None, refb=None, dataset=None, wkbGeometries=False):
+        """
+        Returns whether there are schema changes, and the diff (as returned by
+        diff()), from a single Kart call whose output is read off the main
+        thread.
+
+        Feature changes can't be shown across schema changes, so reading
+        stops at the first one, and the diff returned is then incomplete.
+        With wkbGeometries, geometries are left as WKB (see
+        geojson.wkbGeometry), which is enough for showing them.
+        """
+
+        def consume(lines):
+            changes = {}
+            for itemType, name, features in self._jsonLinesDiff(lines, refa, refb, wkbGeometries):
+                if itemType == "schema":
+                    return True, changes
+                changes.setdefault(name, []).extend(features)
+            return False, changes
+
+        commands = self._jsonLinesDiffCommands(refa, refb, dataset)
+        return readKartLines(commands, consume, self.path)
+
+    def _jsonLinesDiffCommands(self, refa=None, refb=None, dataset=None, featureid=None):
+        commands = ["diff", "--output-format=json-lines", _diffRange(refa, refb)]
+        if dataset is not None:
+            if featureid is not None:
+                commands.append(f"{dataset}:{featureid}")
+            else:
+                commands.append(dataset)
+        return commands
+
+    def _jsonLinesDiff(self, lines, refa=None, refb=None, wkbGeometries=False):
+        """
+        Yields ("schema", dataset, None) for each schema change and
+        ("feature", dataset, features) for each feature change in the lines
+        of Kart's JSON lines diff from refb to refa, as they are read
+        """
+        columns = {}
+        for line in lines:
+            if not line:
+                continue
+            item = json.loads(line)
+            itemType = item.get("type")
+            if itemType == "metaInfo" and item.get("key") == "schema.json":
+                columns[item["dataset"]] = _diffColumns(item["value"])
+            elif itemType == "meta" and item.get("key") == "schema.json":
+                change = item.get("change") or {}
+                schema = change.get("+") or change.get("-")
+                if schema:
+                    columns[item["dataset"]] = _diffColumns(schema)
+                yield "schema", item["dataset"], None
+            elif itemType == "feature":
+                name = item["dataset"]
+                if name not in columns:
+                    # older Kart versions don't write the schema ahead of the features
+                    schema = self.diffDatasetMeta(name, refa, refb)["schema.json"]
+                    columns[name] = _diffColumns(schema)
+                yield (
+                    "feature",
+                    name,
+                    _geojsonFromDiffChange(name, item["change"], *columns[name], wkbGeometries),
+                )
+
     def restore(self, ref, dataset=None):
         if dataset is not None:
+            changes = {dataset}, None
             self.executeKart(["restore", "-s", ref, dataset])
         else:
+            changes = self._canvasChanges(
+                self._resolveRef("HEAD"), self._resolveRef(ref), self._workingCopyDatasets()
+            )
             self.executeKart(["restore", "-s", ref])
-        self.updateCanvas()
+        self.invalidateCaches([STATUS_CACHE])
+        self.updateCanvas(*changes)
 
     def changes(self):
-        return (
-            list(self.executeKart(["status"], True).values())[0]
-            .get("workingCopy", {})
-            .get("changes")
-            or {}
-        )
+        status = self._cached(STATUS_CACHE, "status", lambda: self.executeKart(["status"], True))
+        return _changesFromStatus(status)
 
     def isWorkingTreeClean(self):
         return not bool(self.changes())
@@ -669,17 +2035,54 @@ class Repository:
         return conflicts
 
     def resolveConflicts(self, resolved):
-        for fid, feature in resolved.items():
-            if feature is not None:
-                fc = {"type": "FeatureCollection", "features": [feature]}
-                tmpfile = tempfile.NamedTemporaryFile("w+t", delete=False)
-                json.dump(fc, tmpfile)
-                tmpfile.close()
-                self.executeKart(["resolve", "--with-file", tmpfile.name, fid])
-                os.unlink(tmpfile.name)
+        return self.resolveConflictsAsync(resolved).result()
+
+    def resolveConflictsAsync(self, resolved):
+        """
+        Starts resolving conflicts in the background and returns the
+        KartBatchTask doing it.
+
+        resolved maps conflict labels to the feature to resolve them with,
+        to None to delete the feature, or to the version to keep
+        ("ancestor", "ours" or "theirs"). Conflicts resolved with the same
+        version are resolved together, a chunk of labels per Kart call, and
+        the files for the features are all written up front. The canvas is
+        refreshed once, when the task ends, even if it fails or is cancelled
+        half way.
+        """
+        # conflict labels start with the dataset name
+        changed = {label.split(":")[0] for label in resolved}
+        tmpdir = tempfile.TemporaryDirectory()
+        versions = {}
+        featureSteps = []
+        for i, (label, resolution) in enumerate(resolved.items()):
+            if isinstance(resolution, dict):
+                path = os.path.join(tmpdir.name, f"{i}.geojson")
+                with open(path, "w") as f:
+                    json.dump({"type": "FeatureCollection", "features": [resolution]}, f)
+                featureSteps.append((["resolve", "--with-file", path, label], []))
             else:
-                self.executeKart(["resolve", "--with", "delete", fid])
-        self.updateCanvas()
+                versions.setdefault(resolution or "delete", []).append(label)
+        steps = []
+        for version, labels in versions.items():
+            for i in range(0, len(labels), RESOLVE_BATCH_SIZE):
+                chunk = labels[i : i + RESOLVE_BATCH_SIZE]
+                fallbacks = []
+                if len(chunk) > 1:
+                    # one label at a time, for Kart versions that don't take several
+                    fallbacks = [["resolve", "--with", version, label] for label in chunk]
+                steps.append((["resolve", "--with", version] + chunk, fallbacks))
+
+        def finished(_):
+            tmpdir.cleanup()
+            self.invalidateCaches([STATUS_CACHE])
+            self.updateCanvas(changed)
+
+        task = KartBatchTask(steps + featureSteps, self.path, tr("Resolving conflicts"))
+        task.onFinished(finished)
+        task.onError(finished)
+        QgsApplication.taskManager().addTask(task)
+        return task
 
     def remotes(self):
         remotes = {}
@@ -691,28 +2094,31 @@ class Repository:
 
     def addRemote(self, name, url):
         self.executeKart(["remote", "add", name, url])
+        self.invalidateCaches([CONFIG_CACHE])
 
     def removeRemote(self, name):
         self.executeKart(["remote", "remove", name])
+        self.invalidateCaches([CONFIG_CACHE])
 
     def push(self, remote, branch, push_all=False):
         if push_all:
             self.executeKart(["push", remote, "--all"])
         else:
             self.executeKart(["push", remote, branch])
+        self.invalidateCaches([BRANCHES_CACHE, LOG_CACHE])
 
     def pull(self, remote, branch):
+        head = self._resolveRef("HEAD")
         ret = self.executeKart(["pull", remote, branch, "--no-editor"])
-        self.updateCanvas()
+        self.invalidateCaches()
+        self.updateCanvas(*self._canvasChanges(head, self._resolveRef("HEAD")))
         return "kart conflicts" not in ret
 
     def layerBelongsToRepo(self, layer):
-        location = self.workingCopyLocation()
-        if location.lower().startswith("postgres"):
+        postgres = self.workingCopyDatabaseAndSchema()
+        if postgres is not None:
             uri = QgsDataSourceUri(layer.source())
-            parse = urlparse(location)
-            database, schema = parse.path.strip("/").split("/", 1)
-            return uri.database() == database and uri.schema() == schema
+            return (uri.database(), uri.schema()) == postgres
         else:
             return f"{os.path.normpath(self.path)}{os.path.sep}" in os.path.normpath(
                 layer.source()
@@ -721,6 +2127,18 @@ class Repository:
     def workingCopyLocation(self):
         return self._config()["kart.workingcopy.location"]
 
+    def workingCopyDatabaseAndSchema(self):
+        """
+        Returns the (database, schema) of a PostGIS working copy, or None if
+        the working copy is not in PostGIS
+        """
+        location = self.workingCopyLocation()
+        if not location.lower().startswith("postgres"):
+            return None
+        parse = urlparse(location)
+        database, schema = parse.path.strip("/").split("/", 1)
+        return database, schema
+
     def workingCopyLayer(self, dataset):
         location = self.workingCopyLocation()
         path = os.path.join(self.path, location)
@@ -740,16 +2158,23 @@ class Repository:
             layer = QgsVectorLayer(uri.uri(), dataset, "postgres")
             return layer
 
-    def workingCopyLayerIdField(self, dataset):
-        schema = self.executeKart(["meta", "get", dataset, "schema.json"], True)[dataset][
-            "schema.json"
-        ]
+    def workingCopyLayerIdField(self, dataset, refa=None, refb=None):
+        """
+        Returns the name of the primary key of a dataset. refa and refb are
+        the commits of a diff the dataset is in, to read it from its metadata
+        there, instead of at HEAD.
+        """
+        schema = self.diffDatasetMeta(dataset, refa, refb)["schema.json"]
         for attr in schema:
             if attr.get("primaryKeyIndex") == 0:
                 return attr["name"]
 
-    def workingCopyLayerCrs(self, dataset):
-        meta = self.executeKart(["meta", "get", dataset], True)[dataset]
+    def workingCopyLayerCrs(self, dataset, refa=None, refb=None):
+        """
+        Returns the CRS of a dataset. refa and refb are as for
+        workingCopyLayerIdField.
+        """
+        meta = self.diffDatasetMeta(dataset, refa, refb)
         for k in meta.keys():
             if k.startswith("crs/"):
                 return k[4:-4]
@@ -764,14 +2189,101 @@ class Repository:
 
     def deleteDataset(self, dataset):
         self.executeKart(["data", "rm", "-m", f"Removed dataset {dataset}", dataset])
+        self.invalidateCaches()
 
     def createPatch(self, ref, filename):
         self.executeKart(["show", "-ojson", "--output", filename, ref])
 
     def applyPatch(self, filename):
         self.executeKart(["apply", "--no-commit", filename])
+        self.invalidateCaches([STATUS_CACHE])
+
+    def updateCanvas(self, datasets=None, features=None):
+        """
+        Schedules a refresh of the layers of the repo, or only of the given
+        datasets. features gives the changed features of some of the
+        datasets (as returned by _changedFeatures), so only those are
+        updated in their layers. Requests made in a short time are merged
+        into one refresh.
+        """
+        from kart.canvasrefresh import CanvasRefreshScheduler
+
+        CanvasRefreshScheduler.instance().schedule(self, datasets, features)
+
+    def _resolveRef(self, ref):
+        """
+        Returns the commit a ref points to, read from the repo files, or None
+        """
+        try:
+            return resolveRef(os.path.join(self.path, ".kart"), ref)
+        except OSError:
+            return None
 
-    def updateCanvas(self):
-        for layer in QgsProject.instance().mapLayers().values():
-            if self.layerBelongsToRepo(layer):
-                layer.triggerRepaint()
+    def _workingCopyDatasets(self):
+        """
+        Returns the datasets with working copy changes, or None if they can't
+        be told
+        """
+        try:
+            return set(self.changes())
+        except KartException:
+            return None
+
+    def _canvasChanges(self, refa, refb, workingCopyDatasets=()):
+        """
+        Returns what changes in the layers when the working copy goes from
+        refa to refb, as the (datasets, features) arguments of updateCanvas.
+        workingCopyDatasets are the datasets whose working copy changes are
+        discarded, which are reloaded as a whole.
+        """
+        if refa is None or refb is None or workingCopyDatasets is None:
+            return None, None
+        datasets = set(workingCopyDatasets)
+        if refa == refb:
+            return datasets, None
+        try:
+            # everything that differs, also when going back to an ancestor
+            # or to a diverged branch
+            counts = self.diffFeatureCounts(refb, refa, mergeBase=False)
+            features = None
+            if sum(counts.values()) <= MAX_TARGETED_REFRESH_FEATURES:
+                features = self._changedFeatures(refa, refb)
+                for name in datasets:
+                    features.pop(name, None)
+        except KartException:
+            return None, None
+        return datasets | set(counts), features
+
+    def _changedFeatures(self, refa, refb):
+        """
+        Returns the features changed between two commits, as
+        {dataset: (primary key name, {primary key: "I", "U" or "D"})}
+        """
+
+        def consume(lines):
+            changed = {}
+            for line in lines:
+                if not line:
+                    continue
+                item = json.loads(line)
+                itemType = item.get("type")
+                if itemType == "metaInfo" and item.get("key") == "schema.json":
+                    pkName, _ = _diffColumns(item["value"])
+                    changed.setdefault(item["dataset"], (pkName, {}))
+                elif itemType == "feature":
+                    name = item["dataset"]
+                    if name not in changed:
+                        schema = self.diffDatasetMeta(name, refb, refa)["schema.json"]
+                        changed[name] = (_diffColumns(schema)[0], {})
+                    pkName, features = changed[name]
+                    old, new = item["change"].get("-"), item["change"].get("+")
+                    if old is None:
+                        features[new[pkName]] = "I"
+                    elif new is None:
+                        features[old[pkName]] = "D"
+                    else:
+                        features[new[pkName]] = "U"
+            return changed
+
+        commands = ["diff", "--output-format=json-lines", _diffRange(refb, refa, False)]
+        return readKartLines(commands, consume, self.path)
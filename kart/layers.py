@@ -17,17 +17,18 @@ from qgis.core import (
     QgsWkbTypes,
 )
 from qgis.gui import QgsMapToolEmitPoint, QgsRubberBand
-from qgis.PyQt.QtCore import QPointF, QSizeF, Qt
+from qgis.PyQt.QtCore import QPointF, QSizeF, Qt, QTimer
 from qgis.PyQt.QtGui import QColor, QTextDocument
 from qgis.PyQt.QtWidgets import QAction, QInputDialog
 from qgis.utils import iface
 
+from kart import logging
 from kart.core import RepoManager
 from kart.gui import icons
-from kart.gui.diffviewer import DiffViewerDialog
+from kart.gui.diffviewer import DiffViewerDialog, confirmDiffSize
 from kart.gui.featurehistorydialog import FeatureHistoryDialog
 from kart.gui.historyviewer import HistoryDialog
-from kart.kartapi import executeskart
+from kart.kartapi import CONFIG_CACHE, KartException, deferredDuringKartCalls, executeskart
 from kart.utils import AUTOCOMMIT, setting, tr
 
 
@@ -38,9 +39,31 @@ def _f(f, *args):
     return wrapper
 
 
+class SpatialFilterOverlay:
+    """
+    The rubber band and annotation showing the spatial filter of a repo on
+    the canvas. key describes what is drawn, so it is only redrawn when it
+    changes.
+    """
+
+    def __init__(self, key, rubberBand, annotation):
+        self.key = key
+        self.rubberBand = rubberBand
+        self.annotation = annotation
+
+    def remove(self):
+        iface.mapCanvas().scene().removeItem(self.rubberBand)
+        try:
+            QgsProject.instance().annotationManager().removeAnnotation(self.annotation)
+        except Exception:
+            pass
+
+
 class LayerTracker:
     __instance = None
 
+    OVERLAY_REFRESH_MS = 100
+
     @staticmethod
     def instance():
         if LayerTracker.__instance is None:
@@ -54,7 +77,19 @@ class LayerTracker:
         LayerTracker.__instance = self
 
         self.connected = {}
-        self.rubberBands = {}
+        # repo path -> ids of the project layers in the repo
+        self.repoLayers = {}
+        # repo path -> SpatialFilterOverlay
+        self.overlays = {}
+        # repos whose overlay has to be checked on the next refresh
+        self.dirtyRepos = {}
+        # adding or removing many layers (e.g. loading a project) causes a single refresh
+        self.overlayTimer = QTimer()
+        self.overlayTimer.setSingleShot(True)
+        self.overlayTimer.setInterval(self.OVERLAY_REFRESH_MS)
+        self.overlayTimer.timeout.connect(deferredDuringKartCalls(self.refreshOverlays))
+        RepoManager.instance().repo_changed.connect(self._repoChanged)
+        RepoManager.instance().repo_removed.connect(self._repoRemoved)
 
         self.mapTool = QgsMapToolEmitPoint(iface.mapCanvas())
         self.mapTool.canvasClicked.connect(self.canvasClicked)
@@ -128,6 +163,7 @@ class LayerTracker:
         if isinstance(layer, QgsVectorLayer):
             repo = RepoManager.instance().repo_for_layer(layer)
             if repo is not None:
+                self.repoLayers.setdefault(repo.path, set()).add(layer.id())
                 func = _f(partial(self.commitLayerChanges, layer))
                 layer.afterCommitChanges.connect(func)
                 self.connected[layer] = func
@@ -138,7 +174,7 @@ class LayerTracker:
                 if layer.wkbType() != QgsWkbTypes.Type.NoGeometry:
                     iface.addCustomActionForLayer(self.setMapToolAction, layer)
 
-                self.updateRubberBands()
+                self.updateRepoOverlay(repo)
 
     def addAnnotation(self, repo, rect, layer):
         symbol = QgsMarkerSymbol()
@@ -170,49 +206,118 @@ class LayerTracker:
         PT_MM = 25.4 / 72.0
         annotation.setFrameOffsetFromReferencePointMm(QPointF(-doc.size().width() * PT_MM, -5))
         QgsProject.instance().annotationManager().addAnnotation(annotation)
+        return annotation
 
     def updateRubberBands(self):
-        self.clearRubberBands()
-        usedRepos = []
-        for layer in QgsProject.instance().mapLayers().values():
-            repo = RepoManager.instance().repo_for_layer(layer)
-            if repo is not None and repo not in usedRepos:
-                usedRepos.append(repo)
-                rect = repo.spatialFilter()
-                if rect is not None and repo.showBoundingBox:
-                    rubberBand = QgsRubberBand(
-                        iface.mapCanvas(), QgsWkbTypes.GeometryType.PolygonGeometry
-                    )
-                    rubberBand.setFillColor(QColor(0, 0, 0, 0))
-                    rubberBand.setWidth(1)
-                    rubberBand.setLineStyle(Qt.PenStyle.DotLine)
-                    if repo.showBoundingBox:
-                        rubberBand.setStrokeColor(repo.boundingBoxColor)
-                    else:
-                        rubberBand.setStrokeColor(QColor(0, 0, 0, 0))
-                    self.rubberBands.append(rubberBand)
-                    transform = QgsCoordinateTransform(
-                        rect.crs(),
-                        QgsProject.instance().crs(),
-                        QgsProject.instance(),
+        """
+        Schedules a check of the spatial filter overlays of all repos
+        """
+        for path in list(self.repoLayers) + list(self.overlays):
+            self.dirtyRepos.setdefault(path, None)
+        self.overlayTimer.start()
+
+    def updateRepoOverlay(self, repo):
+        """
+        Schedules a check of the spatial filter overlay of a repo
+        """
+        self.dirtyRepos[repo.path] = repo
+        self.overlayTimer.start()
+
+    def _repoChanged(self, repo, scopes):
+        # the spatial filter is part of the config
+        if CONFIG_CACHE in scopes and repo.path in self.repoLayers:
+            self.updateRepoOverlay(repo)
+
+    def _repoRemoved(self, repo):
+        self.repoLayers.pop(repo.path, None)
+        self.dirtyRepos.pop(repo.path, None)
+        overlay = self.overlays.pop(repo.path, None)
+        if overlay is not None:
+            overlay.remove()
+
+    def refreshOverlays(self):
+        """
+        Creates, redraws or removes the overlays of the repos changed since
+        the last refresh, leaving the rest untouched
+        """
+        dirtyRepos = self.dirtyRepos
+        self.dirtyRepos = {}
+        project = QgsProject.instance()
+        self._removeStaleAnnotations()
+        reposByPath = {repo.path: repo for repo in RepoManager.instance().repos()}
+        for path, repo in dirtyRepos.items():
+            repo = repo or reposByPath.get(path)
+            layerIds = [
+                layerid for layerid in self.repoLayers.get(path, ()) if project.mapLayer(layerid)
+            ]
+            key = None
+            if repo is not None and layerIds and repo.showBoundingBox:
+                try:
+                    rect = repo.spatialFilter()
+                except KartException as e:
+                    logging.error(f"Spatial filter of {path} could not be read: {e}")
+                    continue
+                if rect is not None:
+                    key = (
+                        rect.toString(),
+                        rect.crs().authid(),
+                        project.crs().authid(),
+                        repo.boundingBoxColor.name(),
+                        repo.title(),
                     )
-                    geom = QgsGeometry.fromRect(rect)
-                    geom.transform(transform)
-                    rubberBand.setToGeometry(geom)
-                    self.addAnnotation(repo, rect, layer)
+            overlay = self.overlays.get(path)
+            if overlay is not None and overlay.key == key:
+                continue
+            if overlay is not None:
+                overlay.remove()
+                del self.overlays[path]
+            if key is not None:
+                self.overlays[path] = self._createOverlay(
+                    key, repo, rect, project.mapLayer(layerIds[0])
+                )
+
+    def _createOverlay(self, key, repo, rect, layer):
+        rubberBand = QgsRubberBand(iface.mapCanvas(), QgsWkbTypes.GeometryType.PolygonGeometry)
+        rubberBand.setFillColor(QColor(0, 0, 0, 0))
+        rubberBand.setWidth(1)
+        rubberBand.setLineStyle(Qt.PenStyle.DotLine)
+        rubberBand.setStrokeColor(repo.boundingBoxColor)
+        transform = QgsCoordinateTransform(
+            rect.crs(),
+            QgsProject.instance().crs(),
+            QgsProject.instance(),
+        )
+        geom = QgsGeometry.fromRect(rect)
+        geom.transform(transform)
+        rubberBand.setToGeometry(geom)
+        annotation = self.addAnnotation(repo, rect, layer)
+        return SpatialFilterOverlay(key, rubberBand, annotation)
 
     def clearRubberBands(self):
-        for rubberBand in self.rubberBands:
-            iface.mapCanvas().scene().removeItem(rubberBand)
-        self.rubberBands = []
-        for annotation in QgsProject.instance().annotationManager().annotations():
-            if isinstance(
-                annotation, QgsTextAnnotation
-            ) and annotation.document().toPlainText().startswith("kart:"):
-                try:
-                    QgsProject.instance().annotationManager().removeAnnotation(annotation)
-                except Exception:
-                    pass
+        self.overlayTimer.stop()
+        self.dirtyRepos = {}
+        for overlay in self.overlays.values():
+            overlay.remove()
+        self.overlays = {}
+        self._removeStaleAnnotations()
+
+    def _removeStaleAnnotations(self):
+        """
+        Removes the spatial filter annotations not drawn by an overlay, such
+        as those saved with a project and read back when it is loaded
+        """
+        manager = QgsProject.instance().annotationManager()
+        for annotation in manager.annotations():
+            if not isinstance(annotation, QgsTextAnnotation):
+                continue
+            if not annotation.document().toPlainText().startswith("kart:"):
+                continue
+            if any(annotation is overlay.annotation for overlay in self.overlays.values()):
+                continue
+            try:
+                manager.removeAnnotation(annotation)
+            except Exception:
+                pass
 
     def setMapTool(self):
         layer, repo = self._kartActiveLayerAndRepo()
@@ -259,26 +364,26 @@ class LayerTracker:
         layer, repo = self._kartActiveLayerAndRepo()
         if layer is not None:
             dataset = repo.datasetNameFromLayer(layer)
-            hasSchemaChanges = repo.diffHasSchemaChanges(dataset=dataset)
-            if hasSchemaChanges:
+            summary = repo.diffSummary(dataset=dataset)
+            if not summary:
                 iface.messageBar().pushMessage(
                     tr("Changes"),
-                    tr("There are schema changes in the working tree and changes cannot be shown"),
+                    tr("There are no changes in the working copy"),
                     level=Qgis.MessageLevel.Warning,
                 )
                 return
-            diff = repo.diff(dataset=dataset)
-            if diff.get(dataset):
-                dialog = DiffViewerDialog(
-                    iface.mainWindow(), diff, repo, showRecoverNewButton=False
-                )
-                dialog.exec()
-            else:
+            if not confirmDiffSize(summary):
+                return
+            hasSchemaChanges, diff = repo.diffForViewer(dataset=dataset)
+            if hasSchemaChanges:
                 iface.messageBar().pushMessage(
                     tr("Changes"),
-                    tr("There are no changes in the working copy"),
+                    tr("There are schema changes in the working tree and changes cannot be shown"),
                     level=Qgis.MessageLevel.Warning,
                 )
+                return
+            dialog = DiffViewerDialog(iface.mainWindow(), diff, repo, showRecoverNewButton=False)
+            dialog.exec()
 
     @executeskart
     def discardWorkingTreeChanges(self):
@@ -321,7 +426,12 @@ class LayerTracker:
                 )
 
     def layerRemoved(self, layerid):
-        self.updateRubberBands()
+        for path, layerIds in self.repoLayers.items():
+            if layerid in layerIds:
+                layerIds.discard(layerid)
+                self.dirtyRepos.setdefault(path, None)
+                self.overlayTimer.start()
+                break
 
     @executeskart
     def commitLayerChanges(self, layer):
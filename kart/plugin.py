@@ -9,7 +9,7 @@ from qgis.PyQt.QtWidgets import QAction
 from kart.gui.dockwidget import KartDockWidget
 from kart.gui.icons import kartIcon
 from kart.gui.settingsdialog import SettingsDialog
-from kart.kartapi import checkKartInstalled, kartVersionDetails
+from kart.kartapi import KartProcessPool, checkKartInstalled, kartVersionDetails
 from kart.layers import LayerTracker
 from kart.processing import KartProvider
 from kart.utils import tr
@@ -147,8 +147,12 @@ class KartPlugin(object):
         QgsProject.instance().layerRemoved.disconnect(self.tracker.layerRemoved)
         QgsProject.instance().layerWasAdded.disconnect(self.tracker.layerAdded)
         QgsProject.instance().crsChanged.disconnect(self.tracker.updateRubberBands)
+        self.tracker.clearRubberBands()
         QgsApplication.processingRegistry().removeProvider(self.provider)
 
+        # don't leave Kart processes behind if the plugin is unloaded mid-operation
+        KartProcessPool.killAll()
+
         # init
         if self.translator:
             QCoreApplication.removeTranslator(self.translator)
@@ -0,0 +1,394 @@
+import hashlib
+import heapq
+import json
+import os
+import sqlite3
+from datetime import datetime
+
+from qgis.core import QgsApplication
+
+from kart import logging
+
+
+def cacheFolder():
+    return os.path.join(QgsApplication.qgisSettingsDirPath(), "kart", "cache")
+
+
+def readRefs(kartFolder):
+    """
+    Returns the commit each ref points to, read from the repo files
+    (loose refs and packed-refs), and the HEAD symbolic ref or commit
+    """
+    refs = {}
+    packedRefs = os.path.join(kartFolder, "packed-refs")
+    if os.path.exists(packedRefs):
+        with open(packedRefs) as f:
+            name = None
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                if line.startswith("^"):
+                    # the commit an annotated tag points to
+                    if name is not None:
+                        refs[name] = line[1:]
+                    continue
+                sha, name = line.split(" ", 1)
+                refs[name] = sha
+    refsFolder = os.path.join(kartFolder, "refs")
+    for folder, _, files in os.walk(refsFolder):
+        for filename in files:
+            path = os.path.join(folder, filename)
+            name = "refs/" + os.path.relpath(path, refsFolder).replace(os.sep, "/")
+            with open(path) as f:
+                value = f.read().strip()
+            if not value.startswith("ref:"):
+                refs[name] = value
+    with open(os.path.join(kartFolder, "HEAD")) as f:
+        head = f.read().strip()
+    if head.startswith("ref:"):
+        head = head[4:].strip()
+    return refs, head
+
+
+def resolveRef(kartFolder, ref):
+    """
+    Returns the commit id a ref points to, or None if it can't be told
+    from the repo files (e.g. for expressions like HEAD~1)
+    """
+    refs, head = readRefs(kartFolder)
+    if ref == "HEAD":
+        ref = head
+    for name in (ref, f"refs/heads/{ref}", f"refs/tags/{ref}", f"refs/remotes/{ref}"):
+        if name in refs:
+            return refs[name]
+    if len(ref) == 40 and all(c in "0123456789abcdef" for c in ref):
+        return ref
+    return None
+
+
+def decorations(refs, head, grafted=()):
+    """
+    Returns the labels shown next to each commit for a set of refs, in the
+    same form as the "refs" of the JSON log
+    """
+    labels = {sha: ["grafted"] for sha in grafted}
+    for name, sha in sorted(refs.items()):
+        if name.startswith("refs/heads/"):
+            label = name[len("refs/heads/") :]
+            if name == head:
+                label = f"HEAD -> {label}"
+        elif name.startswith("refs/tags/"):
+            label = f"tag: {name[len('refs/tags/') :]}"
+        elif name.startswith("refs/remotes/"):
+            label = name[len("refs/remotes/") :]
+        else:
+            continue
+        labels.setdefault(sha, []).append(label)
+    if head not in refs:
+        # detached HEAD
+        labels.setdefault(head, []).append("HEAD")
+    for commitLabels in labels.values():
+        commitLabels.sort(key=lambda label: not label.startswith("HEAD"))
+    return labels
+
+
+def readShallow(kartFolder):
+    """
+    Returns the commits where the history of a shallow clone is cut
+    """
+    path = os.path.join(kartFolder, "shallow")
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return f.read().split()
+
+
+def _timestamp(isoTime):
+    return int(datetime.fromisoformat(isoTime.replace("Z", "+00:00")).timestamp())
+
+
+class RepoCache:
+    """
+    Persistent cache of the commits of a repo, keyed by commit id.
+
+    Commits never change, so once the commits reachable from a tip are
+    cached only the ones reachable from newer tips have to be read from
+    Kart (`log <tip> ^<cached tips>`). When there are many of them (e.g. the
+    first time a repo is used) they are read in the background instead, so
+    showing the log doesn't wait for the whole history. Refs do change, so
+    they are read from the repo files every time. The log of a dataset or
+    feature is cached as the list of its commit ids for the last tip it was
+    read for.
+
+    Logs are in date order, children before their parents and otherwise
+    newest first, as `log --date-order`.
+
+    The metadata of the datasets is cached the same way, keyed by the
+    commit it was read at.
+    """
+
+    SCHEMA_VERSION = 2
+    # cached tips excluded from the log call; older ones only cost a longer log
+    MAX_EXCLUDED_TIPS = 100
+    # commits the metadata is kept for
+    MAX_META_COMMITS = 20
+
+    def __init__(self, repo, path=None):
+        self.repo = repo
+        self.kartFolder = os.path.join(repo.path, ".kart")
+        if path is None:
+            key = hashlib.sha1(os.path.normcase(os.path.abspath(repo.path)).encode()).hexdigest()
+            path = os.path.join(cacheFolder(), f"{key}.sqlite")
+        self.path = path
+        self._db = None
+        # commit id -> (commit time, parents) of all cached commits
+        self._graph = None
+        # (commit id, metadata) last read
+        self._meta = None
+        # tips whose commits are being read in the background
+        self._updating = set()
+
+    def _connection(self):
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            db = sqlite3.connect(self.path)
+            version = db.execute("PRAGMA user_version").fetchone()[0]
+            if version != self.SCHEMA_VERSION:
+                db.executescript(
+                    """
+                    DROP TABLE IF EXISTS commits;
+                    DROP TABLE IF EXISTS tips;
+                    DROP TABLE IF EXISTS filtered;
+                    DROP TABLE IF EXISTS meta;
+                    CREATE TABLE commits (
+                        id TEXT PRIMARY KEY, time INTEGER, parents TEXT, data TEXT
+                    );
+                    CREATE TABLE tips (id TEXT PRIMARY KEY);
+                    CREATE TABLE filtered (filter TEXT PRIMARY KEY, tip TEXT, ids TEXT);
+                    CREATE TABLE meta (id TEXT PRIMARY KEY, data TEXT);
+                    """
+                )
+                db.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+                db.commit()
+            self._db = db
+        return self._db
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+        self._db = None
+        self._graph = None
+        self._meta = None
+
+    def _loadGraph(self):
+        if self._graph is None:
+            rows = self._connection().execute("SELECT id, time, parents FROM commits")
+            self._graph = {sha: (time, parents.split()) for sha, time, parents in rows}
+        return self._graph
+
+    def _hasTip(self, tip):
+        db = self._connection()
+        self._loadGraph()
+        return db.execute("SELECT 1 FROM tips WHERE id = ?", (tip,)).fetchone() is not None
+
+    def _updateCommands(self, tip):
+        tips = [row[0] for row in self._connection().execute("SELECT id FROM tips")]
+        excluded = [f"^{sha}" for sha in tips[-self.MAX_EXCLUDED_TIPS :]]
+        return ["log", "-ojson", tip] + excluded
+
+    def update(self, tip, limit=None):
+        """
+        Reads from Kart the commits reachable from tip that are not cached yet.
+        With a limit, nothing is read if there are more new commits than
+        that. Returns whether the commits reachable from tip are all cached.
+        """
+        if self._hasTip(tip):
+            return True
+        commands = self._updateCommands(tip)
+        if limit is not None:
+            commands.extend(["-n", str(limit + 1)])
+        commits = json.loads(self.repo.executeKart(commands))
+        if limit is not None and len(commits) > limit:
+            return False
+        self._store(tip, commits)
+        return True
+
+    def updateAsync(self, tip):
+        """
+        Reads from Kart the commits reachable from tip that are not cached yet,
+        in a background task
+        """
+        if tip in self._updating:
+            return
+
+        def store(output):
+            self._updating.discard(tip)
+            try:
+                self._store(tip, json.loads(output))
+            except (OSError, sqlite3.Error) as e:
+                logging.error(f"Commit cache can't be updated: {e}")
+
+        def failed(exception):
+            self._updating.discard(tip)
+            logging.error(f"Commit cache can't be updated: {exception}")
+
+        self._updating.add(tip)
+        self.repo.executeKartAsync(self._updateCommands(tip), onFinished=store, onError=failed)
+
+    def _store(self, tip, commits):
+        db = self._connection()
+        graph = self._loadGraph()
+        rows = []
+        for commit in commits:
+            sha = commit["commit"]
+            time = _timestamp(commit["committerTime"])
+            data = {k: v for k, v in commit.items() if k != "refs"}
+            rows.append((sha, time, " ".join(commit["parents"]), json.dumps(data)))
+            graph[sha] = (time, commit["parents"])
+        db.executemany("INSERT OR REPLACE INTO commits VALUES (?, ?, ?, ?)", rows)
+        # tips reached from the new one are implied by it
+        tips = [row[0] for row in db.execute("SELECT id FROM tips")]
+        parents = {p for commit in commits for p in commit["parents"]}
+        db.executemany("DELETE FROM tips WHERE id = ?", [(sha,) for sha in tips if sha in parents])
+        db.execute("INSERT OR REPLACE INTO tips VALUES (?)", (tip,))
+        db.commit()
+        logging.debug(f"Commit cache: {len(commits)} new commits")
+
+    def _isAncestor(self, ancestor, sha):
+        graph = self._graph
+        seen = {sha}
+        stack = [sha]
+        while stack:
+            current = stack.pop()
+            if current == ancestor:
+                return True
+            for parent in graph.get(current, (0, []))[1]:
+                if parent not in seen:
+                    seen.add(parent)
+                    stack.append(parent)
+        return False
+
+    def _ordered(self, tip):
+        """
+        Returns the ids of the commits reachable from tip, children before
+        their parents and otherwise newest first (as `log --date-order`)
+        """
+        graph = self._graph
+        children = {}
+        stack = [tip]
+        while stack:
+            sha = stack.pop()
+            for parent in graph[sha][1]:
+                if parent in graph:
+                    if parent not in children:
+                        stack.append(parent)
+                    children[parent] = children.get(parent, 0) + 1
+        heap = [(-graph[tip][0], tip)]
+        ordered = []
+        while heap:
+            _, sha = heapq.heappop(heap)
+            ordered.append(sha)
+            for parent in graph[sha][1]:
+                if parent in children:
+                    children[parent] -= 1
+                    if not children[parent]:
+                        heapq.heappush(heap, (-graph[parent][0], parent))
+        return ordered
+
+    def _filtered(self, tip, filt):
+        db = self._connection()
+        row = db.execute("SELECT tip, ids FROM filtered WHERE filter = ?", (filt,)).fetchone()
+        if row is not None and row[0] == tip:
+            return row[1].split()
+        commands = ["log", "-otext:%H", "--date-order", tip]
+        cached = []
+        if row is not None and self._isAncestor(row[0], tip):
+            # the commits added since the cached tip come before the cached ones
+            commands.append(f"^{row[0]}")
+            cached = row[1].split()
+        ids = self.repo.executeKart(commands + ["--", filt]).split() + cached
+        db.execute("INSERT OR REPLACE INTO filtered VALUES (?, ?, ?)", (filt, tip, " ".join(ids)))
+        db.commit()
+        return ids
+
+    def logIds(self, ref="HEAD", dataset=None, featureid=None, maxNewCommits=None):
+        """
+        Returns the ids of the commits in the log of a ref, newest first, or
+        None if the cache can't be used for it. If there are more than
+        maxNewCommits commits to add to the cache first, they are read in the
+        background and None is returned.
+        """
+        try:
+            tip = resolveRef(self.kartFolder, ref)
+            if tip is None:
+                return None
+            if not self.update(tip, maxNewCommits):
+                self.updateAsync(tip)
+                return None
+            if tip not in self._graph:
+                # e.g. an annotated tag, which is not a commit itself
+                return None
+            if dataset is None:
+                return self._ordered(tip)
+            filt = dataset if featureid is None else f"{dataset}:{featureid}"
+            return self._filtered(tip, filt)
+        except (OSError, sqlite3.Error) as e:
+            logging.error(f"Commit cache can't be used: {e}")
+            return None
+
+    def commits(self, ids):
+        """
+        Returns the cached commits with the given ids, as in the JSON log,
+        with their current refs
+        """
+        refs, head = readRefs(self.kartFolder)
+        labels = decorations(refs, head, readShallow(self.kartFolder))
+        db = self._connection()
+        data = {}
+        # SQLite limits the number of parameters of a query
+        for i in range(0, len(ids), 500):
+            chunk = ids[i : i + 500]
+            query = f"SELECT id, data FROM commits WHERE id IN ({','.join('?' * len(chunk))})"
+            data.update(db.execute(query, chunk))
+        commits = []
+        for sha in ids:
+            commit = json.loads(data[sha])
+            commit["refs"] = labels.get(sha, [])
+            commits.append(commit)
+        return commits
+
+    def meta(self, ref="HEAD"):
+        """
+        Returns the metadata of all the datasets at a ref, as given by
+        `meta get`. It is only read from Kart the first time it is needed
+        for a commit.
+        """
+        try:
+            commit = resolveRef(self.kartFolder, ref)
+        except OSError:
+            commit = None
+        if commit is None:
+            # e.g. a repo without commits yet
+            return self.repo.executeKart(["meta", "get", "--ref", ref], True)
+        if self._meta is not None and self._meta[0] == commit:
+            return self._meta[1]
+        try:
+            db = self._connection()
+            row = db.execute("SELECT data FROM meta WHERE id = ?", (commit,)).fetchone()
+            if row is not None:
+                meta = json.loads(row[0])
+            else:
+                meta = self.repo.executeKart(["meta", "get", "--ref", commit], True)
+                db.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (commit, json.dumps(meta)))
+                db.execute(
+                    "DELETE FROM meta WHERE rowid NOT IN "
+                    "(SELECT rowid FROM meta ORDER BY rowid DESC LIMIT ?)",
+                    (self.MAX_META_COMMITS,),
+                )
+                db.commit()
+        except sqlite3.Error as e:
+            logging.error(f"Metadata cache can't be used: {e}")
+            meta = self.repo.executeKart(["meta", "get", "--ref", commit], True)
+        self._meta = (commit, meta)
+        return meta
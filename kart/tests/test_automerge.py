@@ -0,0 +1,83 @@
+import unittest
+
+from kart.automerge import AutoMergeRules, autoMerge, mergeFeature
+
+POINT = {"type": "Point", "coordinates": [0, 0]}
+MOVED = {"type": "Point", "coordinates": [1, 1]}
+
+
+def feature(geometry=POINT, **properties):
+    props = {"fid": 1, "name": "a", "kind": "x", "edited": "2024-01-01"}
+    props.update(properties)
+    return {"type": "Feature", "geometry": geometry, "properties": props}
+
+
+def conflict(ancestor, ours, theirs):
+    return {"ancestor": ancestor, "ours": ours, "theirs": theirs}
+
+
+class AutoMergeTest(unittest.TestCase):
+    def test_disjoint_edits_are_merged(self):
+        merged = mergeFeature(conflict(feature(), feature(name="b"), feature(MOVED, kind="y")))
+        self.assertEqual(merged["geometry"], MOVED)
+        self.assertEqual(merged["properties"], feature(name="b", kind="y")["properties"])
+
+    def test_merge_equal_to_one_version_keeps_it(self):
+        self.assertEqual(mergeFeature(conflict(feature(), feature(name="b"), feature())), "ours")
+        self.assertEqual(
+            mergeFeature(conflict(feature(), feature(name="b"), feature(name="b", kind="y"))),
+            "theirs",
+        )
+
+    def test_same_value_changed_differently_is_a_conflict(self):
+        self.assertIsNone(mergeFeature(conflict(feature(), feature(name="b"), feature(name="c"))))
+
+    def test_deleted_feature_is_a_conflict(self):
+        self.assertIsNone(mergeFeature(conflict(feature(), None, feature(name="b"))))
+
+    def test_different_attributes_are_a_conflict(self):
+        theirs = feature()
+        theirs["properties"]["new"] = 1
+        self.assertIsNone(mergeFeature(conflict(feature(), feature(name="b"), theirs)))
+
+    def test_geometry_rule(self):
+        ours = feature(MOVED, name="b")
+        theirs = feature({"type": "Point", "coordinates": [2, 2]}, kind="y")
+        self.assertIsNone(mergeFeature(conflict(feature(), ours, theirs)))
+        merged = mergeFeature(conflict(feature(), ours, theirs), AutoMergeRules(geometry="ours"))
+        self.assertEqual(merged["geometry"], MOVED)
+        self.assertEqual(merged["properties"]["kind"], "y")
+
+    def test_newest_timestamp_wins(self):
+        rules = AutoMergeRules(timestampField="edited")
+        ours = feature(name="b", edited="2024-03-01")
+        theirs = feature(name="c", kind="y", edited="2024-02-01")
+        merged = mergeFeature(conflict(feature(), ours, theirs), rules)
+        self.assertEqual(merged["properties"]["name"], "b")
+        self.assertEqual(merged["properties"]["kind"], "y")
+        self.assertEqual(merged["properties"]["edited"], "2024-03-01")
+        # without a newer version the conflict is left
+        theirs = feature(name="c", edited="2024-03-01")
+        self.assertIsNone(mergeFeature(conflict(feature(), ours, theirs), rules))
+
+    def test_features_added_in_both_versions(self):
+        self.assertEqual(mergeFeature(conflict(None, feature(), feature())), "ours")
+        self.assertIsNone(mergeFeature(conflict(None, feature(), feature(name="b"))))
+
+    def test_auto_merge_leaves_true_conflicts(self):
+        conflicts = {
+            "layer": {
+                "1": conflict(feature(), feature(name="b"), feature(kind="y")),
+                "2": conflict(feature(), feature(name="b"), feature(name="c")),
+                "3": conflict(feature(), feature(), feature(kind="y")),
+            },
+            "other": {"4": conflict(feature(), None, feature())},
+        }
+        resolved, remaining = autoMerge(conflicts)
+        self.assertEqual(set(resolved), {"layer:feature:1", "layer:feature:3"})
+        self.assertEqual(resolved["layer:feature:1"]["id"], "layer:feature:1")
+        self.assertEqual(resolved["layer:feature:3"], "theirs")
+        self.assertEqual(
+            remaining,
+            {"layer": {"2": conflicts["layer"]["2"]}, "other": {"4": conflicts["other"]["4"]}},
+        )
@@ -0,0 +1,51 @@
+import unittest
+
+from kart.commitgraph import CommitGraph, graphColumns
+
+# e merges d into c, both branched off b
+LOG = [
+    ("e", ["c", "d"]),
+    ("d", ["b"]),
+    ("c", ["b"]),
+    ("b", ["a"]),
+    ("a", []),
+]
+
+
+def commits(log):
+    return [{"commit": commitid, "parents": parents} for commitid, parents in log]
+
+
+class CommitGraphTest(unittest.TestCase):
+    def test_merge_opens_and_closes_a_lane(self):
+        graph = CommitGraph().layout(commits(LOG), last=True)
+        self.assertEqual([c["commitColumn"] for c in graph], [0, 1, 0, 0, 0])
+        # the merge opens a lane for its second parent
+        self.assertEqual(graph[0]["graph"]["down"], [(0, 0), (0, 1)])
+        self.assertEqual(graph[1]["graph"]["down"], [(0, 0), (2, 2)])
+        # which the first parent lane joins, as both lead to the same commit
+        self.assertEqual(graph[2]["graph"]["down"], [(2, 1), (0, 0)])
+        self.assertEqual(graph[3]["graph"]["up"], [(1, 0), (0, 0)])
+        self.assertEqual(graph[4]["graph"]["down"], [])
+        self.assertEqual(max(graphColumns(c) for c in graph), 2)
+
+    def test_layout_can_be_extended_a_page_at_a_time(self):
+        whole = CommitGraph().layout(commits(LOG), last=True)
+        graph = CommitGraph()
+        paged = graph.layout(commits(LOG[:2])) + graph.layout(commits(LOG[2:]), last=True)
+        self.assertEqual(paged, whole)
+
+    def test_linear_graph_ignores_missing_parents(self):
+        log = commits([("c", ["x"]), ("b", ["y", "z"]), ("a", ["w"])])
+        graph = CommitGraph(linear=True).layout(log, last=True)
+        self.assertEqual([c["commitColumn"] for c in graph], [0, 0, 0])
+        self.assertEqual(graph[1]["graph"], {"up": [(0, 0)], "down": [(0, 0)]})
+        self.assertEqual(graph[2]["graph"]["down"], [])
+
+    def test_branch_tips_open_new_lanes(self):
+        log = commits([("b", ["a"]), ("c", ["a"]), ("a", [])])
+        graph = CommitGraph().layout(log, last=True)
+        self.assertEqual([c["commitColumn"] for c in graph], [0, 1, 0])
+        self.assertEqual(graph[1]["graph"]["up"], [(0, 0)])
+        self.assertEqual(graph[1]["graph"]["down"], [(0, 0), (2, 1)])
+        self.assertEqual(graph[2]["graph"]["up"], [(0, 0), (1, 0)])
@@ -0,0 +1,49 @@
+from qgis.PyQt.QtCore import QModelIndex
+from qgis.testing import start_app, unittest
+
+start_app()
+
+from kart.gui.diffviewer import DiffTreeModel, FeatureItem  # noqa: E402
+
+
+def feature(fid, changetype):
+    return {
+        "type": "Feature",
+        "geometry": None,
+        "properties": {"fid": fid},
+        "id": f"layer:feature:{fid}:{changetype}",
+    }
+
+
+class DiffTreeModelTest(unittest.TestCase):
+    def testFeatureRowsAreFetchedInBatches(self):
+        model = DiffTreeModel()
+        model.FETCH_BATCH_SIZE = 10
+        model.addChanges("layer", [feature(i, "I") for i in range(25)], True)
+        datasetIndex = model.index(0, 0, QModelIndex())
+        groupIndex = model.index(0, 0, datasetIndex)
+        self.assertTrue(model.hasChildren(groupIndex))
+        self.assertEqual(model.rowCount(groupIndex), 0)
+        model.fetchMore(groupIndex)
+        self.assertEqual(model.rowCount(groupIndex), 10)
+        model.fetchMore(groupIndex)
+        model.fetchMore(groupIndex)
+        self.assertEqual(model.rowCount(groupIndex), 25)
+        self.assertFalse(model.canFetchMore(groupIndex))
+
+    def testModifiedFeaturesArePairedAcrossChunks(self):
+        model = DiffTreeModel()
+        model.addChanges("layer", [feature(1, "D"), feature(2, "U-")], True)
+        model.addChanges("layer", [feature(2, "U+"), feature(3, "I")], True)
+        datasetIndex = model.index(0, 0, QModelIndex())
+        groups = [model.data(model.index(i, 0, datasetIndex)) for i in range(3)]
+        self.assertEqual(groups, ["Added", "Modified", "Removed"])
+        modifiedIndex = model.index(1, 0, datasetIndex)
+        model.fetchMore(modifiedIndex)
+        self.assertEqual(model.rowCount(modifiedIndex), 1)
+        item = model.nodeFromIndex(model.index(0, 0, modifiedIndex))
+        self.assertIsInstance(item, FeatureItem)
+        self.assertEqual(item.fid, "2")
+        self.assertTrue(item.old["id"].endswith(":U-"))
+        self.assertTrue(item.new["id"].endswith(":U+"))
+        self.assertEqual(model.parent(model.index(0, 0, modifiedIndex)), modifiedIndex)
@@ -0,0 +1,56 @@
+from qgis.core import QgsWkbTypes
+from qgis.testing import start_app, unittest
+
+start_app()
+
+from kart.geojson import GeometryCache, geometryFromGeojson, wkbGeometry  # noqa: E402
+
+
+class GeojsonTest(unittest.TestCase):
+    def testPoint(self):
+        geom = geometryFromGeojson({"type": "Point", "coordinates": [1, 2]})
+        self.assertEqual(geom.asWkt(), "Point (1 2)")
+
+    def testPolygonWithHole(self):
+        geom = geometryFromGeojson(
+            {
+                "type": "Polygon",
+                "coordinates": [
+                    [[0, 0], [10, 0], [10, 10], [0, 10], [0, 0]],
+                    [[2, 2], [4, 2], [4, 4], [2, 2]],
+                ],
+            }
+        )
+        self.assertEqual(geom.wkbType(), QgsWkbTypes.Polygon)
+        self.assertEqual(geom.constGet().numInteriorRings(), 1)
+        self.assertEqual(geom.area(), 98)
+
+    def testMultiLineStringZ(self):
+        geom = geometryFromGeojson(
+            {
+                "type": "MultiLineString",
+                "coordinates": [[[0, 0, 1], [1, 1, 2]], [[2, 2, 3], [3, 3, 4]]],
+            }
+        )
+        self.assertEqual(geom.wkbType(), QgsWkbTypes.MultiLineStringZ)
+        self.assertEqual(geom.constGet().numGeometries(), 2)
+
+    def testWkbGeometry(self):
+        wkb = geometryFromGeojson({"type": "Point", "coordinates": [1, 2, 3]}).asWkb()
+        geometry = wkbGeometry(bytes(wkb))
+        self.assertEqual(geometry["type"], "Point")
+        self.assertEqual(geometryFromGeojson(geometry).asWkt(), "PointZ (1 2 3)")
+
+    def testNullGeometry(self):
+        self.assertIsNone(geometryFromGeojson(None))
+
+    def testCacheEvictsLeastRecentlyUsed(self):
+        cache = GeometryCache(maxSize=2)
+        point = {"type": "Point", "coordinates": [1, 2]}
+        cache.geometry("a", point)
+        cache.geometry("b", point)
+        cache.geometry("a", None)
+        cache.geometry("c", point)
+        # "a" was used last, so "b" was dropped
+        self.assertEqual(cache.geometry("a", None).asWkt(), "Point (1 2)")
+        self.assertIsNone(cache.geometry("b", None))
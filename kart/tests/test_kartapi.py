@@ -1,7 +1,9 @@
 import os
 import re
 import shutil
+import sqlite3
 import tempfile
+import time
 
 from qgis.core import (
     QgsCoordinateReferenceSystem,
@@ -10,19 +12,34 @@ from qgis.core import (
     QgsPointXY,
     QgsRectangle,
     QgsReferencedRectangle,
+    QgsVectorLayer,
     edit,
 )
+from qgis.PyQt.QtCore import QCoreApplication, QTimer
 from qgis.PyQt.QtTest import QSignalSpy
 from qgis.testing import start_app, unittest
 
+from kart import kartapi
+from kart.canvasrefresh import CanvasRefreshScheduler
 from kart.core import RepoManager
+from kart.core.repo_watcher import RepoWatcher
+from kart.geojson import geometryFromGeojson
 from kart.kartapi import (
+    BRANCHES_CACHE,
+    CONFIG_CACHE,
+    STATUS_CACHE,
+    FeatureHistory,
     KartException,
+    KartProcessPool,
     Repository,
+    deferredDuringKartCalls,
     executeKart,
+    executeKartAsync,
     installedVersion,
+    kartLatencies,
     kartVersionDetails,
 )
+from kart.repocache import RepoCache
 from kart.tests.utils import patch_iface
 from kart.utils import HELPERMODE, KARTPATH, setSetting
 
@@ -122,6 +139,66 @@ class TestKartapi(unittest.TestCase):
             output = executeKart(["data"], jsonoutput=True)
             assert output == {"name": "café"}
 
+    def testExecuteKartAsync(self):
+        with tempfile.TemporaryDirectory() as folder:
+            fakeKart = os.path.join(folder, "kart")
+            with open(fakeKart, "w") as f:
+                f.write(
+                    '#!/usr/bin/env python3\nimport sys\nsys.stdout.write(\'{"status": "ok"}\')\n'
+                )
+            os.chmod(fakeKart, 0o755)
+            setSetting(KARTPATH, folder)
+            results = []
+            task = executeKartAsync(["status"], jsonoutput=True, onFinished=results.append)
+            assert task.result() == {"status": "ok"}
+            assert results == [{"status": "ok"}]
+
+    def testKartLatenciesAreRecorded(self):
+        kartVersionDetails()
+        latencies = kartLatencies()
+        assert "kart" in latencies
+        assert latencies["kart"]["calls"] >= 1
+        assert latencies["kart"]["mean"] >= 0
+
+    def testHandlersAreDeferredDuringKartCalls(self):
+        calls = []
+        handler = deferredDuringKartCalls(lambda: calls.append(kartapi._waitingLoops))
+        # fires while the Kart call below is waited for
+        QTimer.singleShot(0, handler)
+        QTimer.singleShot(0, handler)
+        executeKart(["--version"])
+        QCoreApplication.processEvents()
+        assert calls == [0]
+
+    def testKartProcessPoolsShareSlotsAndKeepLatencies(self):
+        first = KartProcessPool.forPath("/pooltest/first")
+        second = KartProcessPool.forPath("/pooltest/second")
+        assert first._slots is second._slots
+        first.finished(None, "pooltest", 0.5)
+        first._lastUsed = time.monotonic() - 2 * KartProcessPool.IDLE_TIMEOUT
+        KartProcessPool.forPath("/pooltest/second")
+        assert first not in KartProcessPool.pools()
+        assert kartLatencies()["pooltest"]["calls"] == 1
+        again = KartProcessPool.forPath("/pooltest/first")
+        assert again is not first
+        assert again.latencies()["pooltest"]["max"] == 500
+
+    def testCancelKartTaskKillsProcess(self):
+        with tempfile.TemporaryDirectory() as folder:
+            fakeKart = os.path.join(folder, "kart")
+            with open(fakeKart, "w") as f:
+                f.write("#!/usr/bin/env python3\nimport time\ntime.sleep(60)\n")
+            os.chmod(fakeKart, 0o755)
+            setSetting(KARTPATH, folder)
+            errors = []
+            task = executeKartAsync(["status"], onError=errors.append)
+            start = time.time()
+            QTimer.singleShot(500, task.cancel)
+            with self.assertRaises(KartException):
+                task.result()
+            assert time.time() - start < 30
+            assert len(errors) == 1
+
     def testStoreReposInSettings(self):
         manager = RepoManager()
         assert not manager.repos()
@@ -148,6 +225,17 @@ class TestKartapi(unittest.TestCase):
         manager3 = RepoManager()
         self.assertEqual(len(manager3.repos()), 0)
 
+    def testRepoForLayer(self):
+        manager = RepoManager()
+        manager.add_repo(self.testRepo)
+        layer = self.testRepo.workingCopyLayer("testlayer")
+        assert manager.repo_for_layer(layer) is self.testRepo
+        gpkgPath = os.path.join(os.path.dirname(__file__), "data", "layers", "testlayer.gpkg")
+        otherLayer = QgsVectorLayer(gpkgPath, "testlayer")
+        assert manager.repo_for_layer(otherLayer) is None
+        manager.remove_repo(self.testRepo)
+        assert manager.repo_for_layer(layer) is None
+
     def testInit(self):
         with tempfile.TemporaryDirectory() as folder:
             repo = Repository(folder)
@@ -196,6 +284,65 @@ class TestKartapi(unittest.TestCase):
         assert "Modified" in log[2]["message"]
         assert "Added" in log[3]["message"]
 
+    def testLogPages(self):
+        log = self.testRepo.log()
+        assert self.testRepo.log(skip=1, limit=2) == log[1:3]
+        pager = self.testRepo.logPager(pageSize=2)
+        pages = []
+        while pager.hasMore():
+            pages.append(pager.nextPage())
+        assert [len(page) for page in pages] == [2, 2, 1]
+        assert sum(pages, []) == log
+
+    def testCommitCache(self):
+        folder, repo = createRepoCopy()
+        cachePath = os.path.join(folder.name, "cache.sqlite")
+
+        def logCalls():
+            return kartLatencies().get("log", {}).get("calls", 0)
+
+        cache = RepoCache(repo, cachePath)
+        log = repo.executeKart(["log", "-otext:%H", "--date-order"]).split()
+        # too many new commits to wait for, so they are read in the background
+        assert cache.logIds(maxNewCommits=1) is None
+        assert cache.logIds() == log
+        commits = cache.commits(log)
+        assert [c["commit"] for c in commits] == log
+        assert "HEAD -> main" in commits[0]["refs"]
+        # cached commits are not read again
+        calls = logCalls()
+        assert cache.logIds("main") == log
+        assert logCalls() == calls
+        cache.close()
+        # the cache outlives the object reading it
+        cache = RepoCache(repo, cachePath)
+        assert cache.logIds() == log
+        assert logCalls() == calls
+        cache.close()
+        folder.cleanup()
+
+    def testMetaCache(self):
+        folder, repo = createRepoCopy()
+        cachePath = os.path.join(folder.name, "cache.sqlite")
+
+        def metaCalls():
+            return kartLatencies().get("meta", {}).get("calls", 0)
+
+        cache = RepoCache(repo, cachePath)
+        meta = cache.meta()
+        assert meta == repo.executeKart(["meta", "get"], True)
+        assert "schema.json" in meta["testlayer"]
+        calls = metaCalls()
+        cache.close()
+        # read again from disk, as HEAD hasn't moved
+        cache = RepoCache(repo, cachePath)
+        assert cache.meta() == meta
+        assert metaCalls() == calls
+        # the metadata of an older commit is read from Kart
+        assert cache.meta("HEAD~1") is not None
+        cache.close()
+        folder.cleanup()
+
     def testLogForMissingDataset(self):
         log = self.testRepo.log(dataset="wronglayer")
         assert len(log) == 0
@@ -213,6 +360,176 @@ class TestKartapi(unittest.TestCase):
         assert len(features) == 2
         assert features[0]["geometry"] == features[1]["geometry"]
 
+    def testDiffWithSchemaChanges(self):
+        hasSchemaChanges, diff = self.testRepo.diffWithSchemaChanges("HEAD~1", "HEAD~2")
+        assert hasSchemaChanges == self.testRepo.diffHasSchemaChanges("HEAD~1", "HEAD~2")
+        expected = self.testRepo.diff("HEAD~1", "HEAD~2")
+        assert list(diff) == list(expected)
+        ids = sorted(f["id"] for f in diff["testlayer"])
+        assert ids == sorted(f["id"] for f in expected["testlayer"])
+
+        _, wkbDiff = self.testRepo.diffWithSchemaChanges("HEAD~1", "HEAD~2", wkbGeometries=True)
+        for feature, geojson in zip(wkbDiff["testlayer"], diff["testlayer"]):
+            assert feature["geometry"]["type"] == geojson["geometry"]["type"]
+            expectedGeom = geometryFromGeojson(geojson["geometry"])
+            assert geometryFromGeojson(feature["geometry"]).equals(expectedGeom)
+
+    def testDatasetDiffs(self):
+        diff = self.testRepo.diff("HEAD~1", "HEAD~2")
+        streamed = []
+        diffs = self.testRepo.datasetDiffs("HEAD~1", "HEAD~2", workers=2)
+        diffs.onDataset(lambda dataset, features: streamed.append(dataset))
+        assert diffs.result() == diff
+        assert streamed == ["testlayer"]
+
+    def testFeatureHistory(self):
+        changed = self.testRepo.diff("HEAD~1", "HEAD~2")["testlayer"][0]
+        fid = changed["id"].split(":")[2]
+        log = self.testRepo.log(dataset="testlayer", featureid=fid)
+        fields = self.testRepo.workingCopyLayer("testlayer").fields()
+        history = self.testRepo.featureHistory("testlayer", fid, log, fields)
+        commit = log[0]
+        diff = self.testRepo.diff(commit["parents"][0], commit["commit"], "testlayer", fid)
+        new, old = history.versions(commit["commit"])
+        assert new.hasGeometry() and old.hasGeometry()
+        for feature, geojson in [(new, diff["testlayer"][0]), (old, diff["testlayer"][-1])]:
+            for name, value in geojson["properties"].items():
+                assert feature[name] == value
+        # versions are cached once fetched, so a new history needs no Kart calls
+        again = self.testRepo.featureHistory("testlayer", fid, log, fields)
+        assert commit["commit"] not in again._pending
+        assert again.versions(commit["commit"])[1].attributes() == old.attributes()
+        history.cancel()
+
+    def testFeatureHistoryPrefetchesNearbyCommits(self):
+        commits = [{"commit": f"{i:040x}", "parents": [f"{i + 1:040x}"]} for i in range(30)]
+        fields = self.testRepo.workingCopyLayer("testlayer").fields()
+        history = FeatureHistory(self.testRepo, "testlayer", 1, commits, fields, 1)
+        ids = [commit["commit"] for commit in commits]
+        history._prefetchAround(ids[0])
+        assert history._pending == ids[: FeatureHistory.PREFETCH_COMMITS + 1]
+        history._prefetchAround(ids[10])
+        assert history._pending[0] == ids[10]
+        assert sorted(history._pending) == sorted(
+            ids[10 - FeatureHistory.PREFETCH_COMMITS : 11 + FeatureHistory.PREFETCH_COMMITS]
+        )
+
+    def testDiffStream(self):
+        chunks = []
+        stream = self.testRepo.diffStream("HEAD~1", "HEAD~2", chunkSize=1)
+        stream.onDataset(lambda dataset, features: chunks.append((dataset, features)))
+        assert stream.result() is False
+        # the two versions of a modified feature are never split
+        assert len(chunks) == 1
+        dataset, features = chunks[0]
+        assert dataset == "testlayer"
+        diff = self.testRepo.diff("HEAD~1", "HEAD~2")["testlayer"]
+        assert sorted(f["id"] for f in features) == sorted(f["id"] for f in diff)
+        assert features[0]["geometry"]["type"] == diff[0]["geometry"]["type"]
+
+        chunks = []
+        stream = self.testRepo.diffStream("HEAD", "HEAD~1", wkbGeometries=True)
+        stream.onDataset(lambda dataset, features: chunks.append((dataset, features)))
+        stream.result()
+        assert chunks[0][1][0]["id"].endswith(":D")
+
+    def testSnapshot(self):
+        folder, repo = createRepoCopy()
+        snapshot = repo.snapshot()
+        assert snapshot.currentBranch == "main"
+        assert len(snapshot.branches) == 2
+        assert snapshot.vectorDatasets == ["testlayer"]
+        assert snapshot.isWorkingTreeClean()
+        assert repo.snapshot() is snapshot
+        repo.createBranch("snapshotbranch")
+        assert "snapshotbranch" in repo.snapshot().branches
+        folder.cleanup()
+
+    def testWatcherExpiresCaches(self):
+        folder, repo = createRepoCopy()
+        watcher = RepoWatcher(repo)
+        assert repo.isWatched()
+        repo._configDict = {"user.name": "cached"}
+        repo._caches = {STATUS_CACHE: {"status": {}}, BRANCHES_CACHE: {"branch": {}}}
+        with open(os.path.join(repo.path, ".kart", "config"), "a") as f:
+            f.write("[watcher]\n\ttest = true\n")
+        scopes = watcher.check()
+        assert CONFIG_CACHE in scopes and STATUS_CACHE in scopes
+        assert repo._configDict is None
+        assert STATUS_CACHE not in repo._caches
+        assert BRANCHES_CACHE in repo._caches
+        assert watcher.check() == []
+        watcher.stop()
+        assert not repo.isWatched()
+        assert not repo._caches
+        folder.cleanup()
+
+    def testStatusNotCachedForServerWorkingCopy(self):
+        folder, repo = createRepoCopy()
+        with open(os.path.join(repo.path, ".kart", "config"), "a") as f:
+            f.write('[kart "workingcopy"]\n\tlocation = postgresql://host/db/schema\n')
+        watcher = RepoWatcher(repo)
+        assert not watcher.watchesWorkingCopy
+        calls = []
+        repo._cached(STATUS_CACHE, "status", lambda: calls.append(1))
+        repo._cached(STATUS_CACHE, "status", lambda: calls.append(1))
+        assert len(calls) == 2
+        watcher.stop()
+        folder.cleanup()
+
+    def testCanvasRefreshIsCoalesced(self):
+        scheduler = CanvasRefreshScheduler()
+        scheduler.schedule(self.testRepo, set())
+        assert not scheduler.pending
+        scheduler.schedule(self.testRepo, {"testlayer"}, {"testlayer": ("fid", {1: "I"})})
+        scheduler.schedule(self.testRepo, {"testlayer"}, {"testlayer": ("fid", {1: "U", 2: "D"})})
+        scheduler.schedule(self.testRepo, {"otherlayer"})
+        changes = scheduler.pending[self.testRepo.path][1]
+        assert changes == {"testlayer": ("fid", {1: "I", 2: "D"}), "otherlayer": None}
+        scheduler.schedule(self.testRepo, {"testlayer"})
+        assert scheduler.pending[self.testRepo.path][1]["testlayer"] is None
+        scheduler.schedule(self.testRepo)
+        assert scheduler.pending[self.testRepo.path][1] is None
+        scheduler.refresh()
+        assert not scheduler.pending
+
+    def testCanvasChanges(self):
+        head = self.testRepo._resolveRef("HEAD")
+        previous = self.testRepo.log()[1]["commit"]
+        datasets, features = self.testRepo._canvasChanges(previous, head)
+        assert datasets == {"testlayer"}
+        pkName, changes = features["testlayer"]
+        assert list(changes.values()) == ["D"]
+        assert self.testRepo._canvasChanges(head, head, {"other"}) == ({"other"}, None)
+
+    def testCanvasChangesWhenResettingBackwards(self):
+        head = self.testRepo._resolveRef("HEAD")
+        previous = self.testRepo.log()[1]["commit"]
+        datasets, features = self.testRepo._canvasChanges(head, previous)
+        assert datasets == {"testlayer"}
+        pkName, changes = features["testlayer"]
+        assert list(changes.values()) == ["I"]
+
+    def testCanvasChangesWithDivergedBranches(self):
+        folder, repo = createRepoCopy()
+        repo.createBranch("newbranch")
+        for branch, x in [("newbranch", 0), ("main", 1)]:
+            repo.checkoutBranch(branch)
+            layer = repo.workingCopyLayer("testlayer")
+            with edit(layer):
+                feature = QgsFeature(layer.fields())
+                feature.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(x, x)))
+                feature.setAttributes([100 + x, x])
+                layer.addFeatures([feature])
+            repo.commit(f"Added in {branch}")
+        datasets, features = repo._canvasChanges(
+            repo._resolveRef("newbranch"), repo._resolveRef("main")
+        )
+        assert datasets == {"testlayer"}
+        pkName, changes = features["testlayer"]
+        assert changes == {100: "D", 101: "I"}
+        folder.cleanup()
+
     def testCreateAndDeleteBranch(self):
         self.testRepo.createBranch("mynewbranch")
         branches = self.testRepo.branches()
@@ -245,6 +562,31 @@ class TestKartapi(unittest.TestCase):
         assert not bool(diff.get("testlayer", []))
         folder.cleanup()
 
+    def testDiffSummary(self):
+        folder, repo = createRepoCopy()
+        assert repo.diffSummary() == {}
+        layer = repo.workingCopyLayer("testlayer")
+        feature = list(layer.getFeatures())[0]
+        with edit(layer):
+            layer.deleteFeatures([feature.id()])
+        summary = repo.diffSummary()
+        assert summary == {"testlayer": {"inserts": 0, "updates": 0, "deletes": 1, "total": 1}}
+        assert repo.diffSummary(dataset="otherlayer") == {}
+        assert repo.diffSummary("HEAD", "HEAD~1") == {"testlayer": {"total": 1}}
+        folder.cleanup()
+
+    def testDiffSummaryWithOnlySchemaChanges(self):
+        folder, repo = createRepoCopy()
+        db = sqlite3.connect(os.path.join(repo.path, repo.workingCopyLocation()))
+        db.execute("ALTER TABLE testlayer ADD COLUMN newfield INTEGER")
+        db.commit()
+        db.close()
+        repo.invalidateCaches()
+        summary = repo.diffSummary()
+        assert summary["testlayer"]["total"] == 0
+        assert summary["testlayer"]["meta"] > 0
+        folder.cleanup()
+
     def testCommit(self):
         folder, repo = createRepoCopy()
         layer = repo.workingCopyLayer("testlayer")
@@ -283,6 +625,13 @@ class TestKartapi(unittest.TestCase):
     def testWorkingCopyLayerCrs(self):
         assert "EPSG:4326" == self.testRepo.workingCopyLayerCrs("testlayer")
 
+    def testDatasetMetaOfMissingDataset(self):
+        with self.assertRaises(KartException):
+            self.testRepo.datasetMeta("missinglayer")
+        head = self.testRepo._resolveRef("HEAD")
+        meta = self.testRepo.diffDatasetMeta("testlayer", head, "HEAD~1")
+        assert meta == self.testRepo.datasetMeta("testlayer", head)
+
     def testDeleteDataset(self):
         folder, repo = createRepoCopy()
         ncommits = len(repo.log())
@@ -314,6 +663,31 @@ class TestKartapi(unittest.TestCase):
         assert log[0]["message"] == "A new commit"
         folder.cleanup()
 
+    def testResolveConflicts(self):
+        folder, repo = createRepoCopy()
+        repo.createBranch("newbranch")
+        layer = repo.workingCopyLayer("testlayer")
+        features = list(layer.getFeatures())[:2]
+        for branch, value in [("newbranch", 10), ("main", 20)]:
+            repo.checkoutBranch(branch)
+            layer = repo.workingCopyLayer("testlayer")
+            with edit(layer):
+                for feature in features:
+                    layer.changeAttributeValue(feature.id(), 1, value)
+            repo.commit(f"Modified in {branch}")
+        assert repo.mergeBranch("newbranch")
+        conflicts = repo.conflicts()["testlayer"]
+        assert len(conflicts) == 2
+        labels = [f"testlayer:feature:{fid}" for fid in conflicts]
+        task = repo.resolveConflictsAsync({label: "theirs" for label in labels})
+        task.result()
+        assert task.progress() == 100
+        assert not repo.conflicts()
+        repo.continueMerge()
+        layer = repo.workingCopyLayer("testlayer")
+        assert {f[1] for f in layer.getFeatures() if f.id() in {g.id() for g in features}} == {10}
+        folder.cleanup()
+
     """
     def testBranchAndMergeWithDelete(self):
         folder, repo = createRepoCopy()
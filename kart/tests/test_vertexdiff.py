@@ -0,0 +1,51 @@
+from qgis.core import QgsGeometry
+from qgis.testing import start_app, unittest
+
+start_app()
+
+from kart import vertexdiff  # noqa: E402
+from kart.vertexdiff import multiPoint, vertexDiff  # noqa: E402
+
+OLD = QgsGeometry.fromWkt("POLYGON ((0 0, 10 0, 10 10, 0 10, 0 0))")
+NEW = QgsGeometry.fromWkt("POLYGON Z ((0 0 1, 10 0.000001 1, 12 12 1, 0 10 1, 0 0 1))")
+
+
+def points(coords):
+    return sorted((round(x, 6), round(y, 6)) for x, y in coords)
+
+
+class VertexDiffTest(unittest.TestCase):
+    def testVerticesWithinToleranceAreUnchanged(self):
+        diff = vertexDiff(OLD, NEW, 0.00001)
+        self.assertEqual(points(diff["A"]), [(12, 12)])
+        self.assertEqual(points(diff["R"]), [(10, 10)])
+        self.assertEqual(points(diff["U"]), [(0, 0), (0, 10), (10, 0)])
+
+    def testExactComparison(self):
+        diff = vertexDiff(OLD, NEW, 0)
+        self.assertEqual(points(diff["A"]), [(10, 0.000001), (12, 12)])
+        self.assertEqual(points(diff["R"]), [(10, 0), (10, 10)])
+
+    def testMissingGeometry(self):
+        diff = vertexDiff(None, QgsGeometry.fromWkt("MULTIPOINT ((1 2), (3 4))"), 0.00001)
+        self.assertEqual(points(diff["A"]), [(1, 2), (3, 4)])
+        self.assertEqual(len(diff["R"]), 0)
+
+    def testEmptyGeometries(self):
+        empty = QgsGeometry.fromWkt("POLYGON EMPTY")
+        for tolerance in (0, 0.00001):
+            diff = vertexDiff(empty, QgsGeometry.fromWkt("LINESTRING EMPTY"), tolerance)
+            for changetype in ("A", "R", "U"):
+                self.assertEqual(len(diff[changetype]), 0)
+
+    @unittest.skipIf(vertexdiff.np is None, "NumPy is not available")
+    def testPythonFallbackGivesTheSameDiff(self):
+        expected = vertexdiff._numpyVertexDiff(OLD, NEW, 0.00001)
+        diff = vertexdiff._pythonVertexDiff(OLD, NEW, 0.00001)
+        for changetype in ("A", "R", "U"):
+            self.assertEqual(points(diff[changetype]), points(expected[changetype]))
+
+    def testMultiPoint(self):
+        geom = multiPoint(vertexDiff(OLD, NEW, 0.00001)["U"])
+        self.assertEqual(geom.constGet().numGeometries(), 3)
+        self.assertIsNone(multiPoint([]))
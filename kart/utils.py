@@ -7,7 +7,7 @@ from qgis.PyQt.QtCore import (
     QSettings,
     Qt,
 )
-from qgis.PyQt.QtWidgets import QApplication, QLabel, QMessageBox, QProgressBar
+from qgis.PyQt.QtWidgets import QApplication, QLabel, QMessageBox, QProgressBar, QPushButton
 from qgis.utils import iface as qgisiface
 
 # This can be further patched using the test.utils module
@@ -26,7 +26,7 @@ def tr(string):
 
 
 class ProgressBar:
-    def __init__(self, title):
+    def __init__(self, title, onCancel=None):
         self.progressMessageBar = iface.messageBar().createMessage(f"<b>{title}</b>")
         self.label = QLabel()
         self.progressMessageBar.layout().addWidget(self.label)
@@ -35,6 +35,10 @@ class ProgressBar:
         self.progress.setValue(0)
         self.progress.setAlignment(Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignVCenter)
         self.progressMessageBar.layout().addWidget(self.progress)
+        if onCancel is not None:
+            self.cancelButton = QPushButton(tr("Cancel"))
+            self.cancelButton.clicked.connect(onCancel)
+            self.progressMessageBar.layout().addWidget(self.cancelButton)
         iface.messageBar().pushWidget(self.progressMessageBar, Qgis.MessageLevel.Info)
         QCoreApplication.processEvents()
 
@@ -96,6 +100,18 @@ HELPERMODE = "HelperMode"
 AUTOCOMMIT = "AutoCommit"
 DIFFSTYLES = "DiffStyles"
 LASTREPO = "LastRepo"
+PARALLELDIFF = "ParallelDiff"
+DIFFWORKERS = "DiffWorkers"
+DIFFWARNINGSIZE = "DiffWarningSize"
+VERTEXDIFFTOLERANCE = "VertexDiffTolerance"
+AUTOMERGE = "AutoMerge"
+AUTOMERGEGEOMETRY = "AutoMergeGeometry"
+AUTOMERGETIMESTAMPFIELD = "AutoMergeTimestampField"
+
+# number of changed features above which showing a diff has to be confirmed
+DEFAULT_DIFF_WARNING_SIZE = 10000
+# distance under which vertices are taken as the same one in vertex diffs
+DEFAULT_VERTEX_DIFF_TOLERANCE = 0.00001
 
 # Palette Definitions
 PALETTES = {
@@ -119,7 +135,7 @@ CURRENT_COLOR_REMOVED = "CurrentColorRemoved"
 CURRENT_COLOR_MODIFIED = "CurrentColorModified"
 CURRENT_COLOR_UNCHANGED = "CurrentColorUnchanged"
 
-setting_types = {HELPERMODE: bool, AUTOCOMMIT: bool}
+setting_types = {HELPERMODE: bool, AUTOCOMMIT: bool, PARALLELDIFF: bool, AUTOMERGE: bool}
 
 
 def setSetting(name, value):
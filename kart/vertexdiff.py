@@ -0,0 +1,178 @@
+"""
+Comparison of the vertices of two versions of a geometry, for the vertex
+diff of the diff viewer
+"""
+
+import struct
+
+from qgis.core import QgsGeometry, QgsMultiPoint, QgsPoint
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+ADDED = "A"
+REMOVED = "R"
+UNCHANGED = "U"
+
+# dimensions added to x and y by the thousands of an ISO WKB type
+_EXTRA_DIMENSIONS = {0: 0, 1: 1, 2: 1, 3: 2}
+_WKB_25D = 0x80000000
+_POINT, _LINESTRING, _POLYGON, _TRIANGLE = 1, 2, 3, 17
+_COLLECTIONS = {4, 5, 6, 7, 15, 16}
+_MULTIPOINT = 4
+
+
+def _wkbCoordinates(wkb, offset, chunks):
+    """
+    Appends to chunks the x and y coordinates of the geometry at offset in
+    a WKB buffer, as arrays, and returns the offset after it
+    """
+    byteOrder = "<" if wkb[offset] == 1 else ">"
+    (wkbType,) = struct.unpack_from(byteOrder + "I", wkb, offset + 1)
+    offset += 5
+    if wkbType & _WKB_25D:
+        baseType, dimensions = wkbType & 0xFF, 3
+    else:
+        baseType, dimensions = wkbType % 1000, 2 + _EXTRA_DIMENSIONS[wkbType // 1000]
+    coordinate = np.dtype(byteOrder + "f8")
+
+    def points(count, offset):
+        values = np.frombuffer(wkb, dtype=coordinate, count=count * dimensions, offset=offset)
+        chunks.append(values.reshape(count, dimensions)[:, :2])
+        return offset + count * dimensions * 8
+
+    if baseType == _POINT:
+        return points(1, offset)
+    (count,) = struct.unpack_from(byteOrder + "I", wkb, offset)
+    offset += 4
+    if baseType == _LINESTRING:
+        return points(count, offset)
+    elif baseType in (_POLYGON, _TRIANGLE):
+        for _ in range(count):
+            (ringCount,) = struct.unpack_from(byteOrder + "I", wkb, offset)
+            offset = points(ringCount, offset + 4)
+        return offset
+    elif baseType in _COLLECTIONS:
+        for _ in range(count):
+            offset = _wkbCoordinates(wkb, offset, chunks)
+        return offset
+    # curves, which are compared vertex by vertex instead
+    raise ValueError(f"Unsupported WKB type: {wkbType}")
+
+
+def vertexCoordinates(geom):
+    """
+    Returns the x and y coordinates of the vertices of a geometry, as an
+    array with a row per vertex. Requires NumPy.
+    """
+    if geom is None or geom.isEmpty():
+        return np.empty((0, 2))
+    try:
+        chunks = []
+        _wkbCoordinates(bytes(geom.asWkb()), 0, chunks)
+        coords = np.concatenate(chunks)
+    except ValueError:
+        coords = np.array([(v.x(), v.y()) for v in geom.vertices()], dtype=float).reshape(-1, 2)
+    # empty points are written as NaN coordinates
+    return coords[~np.isnan(coords).any(axis=1)]
+
+
+def _numpyVertexDiff(oldGeom, newGeom, tolerance):
+    def keys(geom):
+        coords = vertexCoordinates(geom)
+        if tolerance > 0:
+            coords = np.round(coords / tolerance).astype(np.int64)
+        return coords
+
+    oldKeys = keys(oldGeom)
+    newKeys = keys(newGeom)
+    # the vertices of both versions sorted together, so equal ones are next
+    # to each other, those of the old version first
+    allKeys = np.concatenate([oldKeys, newKeys])
+    if len(allKeys) == 0:
+        # e.g. both geometries are empty
+        empty = np.empty((0, 2))
+        return {ADDED: empty, REMOVED: empty, UNCHANGED: empty}
+    isNew = np.concatenate([np.zeros(len(oldKeys), bool), np.ones(len(newKeys), bool)])
+    order = np.lexsort((isNew, allKeys[:, 1], allKeys[:, 0]))
+    allKeys = allKeys[order]
+    isNew = isNew[order]
+    isFirst = np.ones(len(allKeys), bool)
+    isFirst[1:] = (allKeys[1:] != allKeys[:-1]).any(axis=1)
+    firsts = np.flatnonzero(isFirst)
+    lasts = np.append(firsts[1:], len(allKeys)) - 1
+    inOld = ~isNew[firsts]
+    inNew = isNew[lasts]
+    unique = allKeys[firsts]
+    diff = {
+        ADDED: unique[inNew & ~inOld],
+        REMOVED: unique[inOld & ~inNew],
+        UNCHANGED: unique[inOld & inNew],
+    }
+    if tolerance > 0:
+        diff = {changetype: keys * tolerance for changetype, keys in diff.items()}
+    return diff
+
+
+def _pythonVertexDiff(oldGeom, newGeom, tolerance):
+    def keys(geom):
+        if geom is None or geom.isEmpty():
+            return set()
+        if tolerance > 0:
+            return {(round(v.x() / tolerance), round(v.y() / tolerance)) for v in geom.vertices()}
+        return {(v.x(), v.y()) for v in geom.vertices()}
+
+    oldKeys = keys(oldGeom)
+    newKeys = keys(newGeom)
+    diff = {
+        ADDED: newKeys - oldKeys,
+        REMOVED: oldKeys - newKeys,
+        UNCHANGED: oldKeys & newKeys,
+    }
+    if tolerance > 0:
+        diff = {
+            changetype: [(x * tolerance, y * tolerance) for x, y in keys]
+            for changetype, keys in diff.items()
+        }
+    return diff
+
+
+def vertexDiff(oldGeom, newGeom, tolerance):
+    """
+    Classifies the vertices of two versions of a geometry as added, removed
+    or unchanged. Vertices closer than tolerance (snapped to a grid of that
+    size) are taken as the same one; 0 compares exact coordinates.
+
+    Returns the coordinates of the vertices of each change type, as arrays
+    when NumPy is available and as lists of (x, y) otherwise.
+    """
+    if np is not None:
+        return _numpyVertexDiff(oldGeom, newGeom, tolerance)
+    return _pythonVertexDiff(oldGeom, newGeom, tolerance)
+
+
+def multiPoint(coords):
+    """
+    Returns a MultiPoint geometry with the given vertices, or None if there
+    are none
+    """
+    if len(coords) == 0:
+        return None
+    if np is not None and isinstance(coords, np.ndarray):
+        # written as WKB in one go, rather than adding the points one by one
+        points = np.empty(
+            len(coords), dtype=[("order", "u1"), ("type", "<u4"), ("x", "<f8"), ("y", "<f8")]
+        )
+        points["order"] = 1
+        points["type"] = _POINT
+        points["x"] = coords[:, 0]
+        points["y"] = coords[:, 1]
+        geom = QgsGeometry()
+        geom.fromWkb(struct.pack("<BII", 1, _MULTIPOINT, len(coords)) + points.tobytes())
+        return geom
+    multi = QgsMultiPoint()
+    for x, y in coords:
+        multi.addGeometry(QgsPoint(x, y))
+    return QgsGeometry(multi)